@@ -0,0 +1,361 @@
+# Drive every organization route through the full app against a local mongod and a fake
+# Authentication service, and report throughput and latency percentiles per route as JSON.
+#
+#   ENV_FILE=./.env MONGODB_URI=mongodb://127.0.0.1:27017/?replicaSet=rs0 MONGODB_DATABASE=organization_bench \
+#       python -m benchmarks.e2e --users 50 --orgs-per-user 20 --members-per-org 5 --roles-per-user 10 --output e2e.json
+#
+# Pass --baseline with an earlier report to exit non-zero when a route's p95 regresses.
+#
+# The fake Authentication service listens on AUTHENTICATION_SERVICE_URL, so the auth sync
+# dispatcher runs unchanged. The database named by MONGODB_DATABASE is dropped before and after the run.
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import jwt
+import uvicorn
+from bson import ObjectId
+from fastapi import FastAPI
+
+from core.config.database import AsyncOrganizationDatabase
+from core.config.env import get_env
+from core.models.organization import OrganizationCreate
+from core.models.roles import RoleAssignedInDB
+from core.services.organization import AsyncOrganizationService
+from core.utils.managers.roles import ROLE_TEMPLATES, AsyncRoleManager, DefaultRoles
+from main import app, lifespan
+
+env = get_env()
+async_db = AsyncOrganizationDatabase()
+service = AsyncOrganizationService()
+role_manager = AsyncRoleManager()
+
+# Requests received by the fake Authentication service, by method
+auth_requests = Counter()
+fake_auth = FastAPI()
+
+
+@fake_auth.put('/auth/')
+async def auth_snapshot():
+    auth_requests['PUT'] += 1
+    return {'message': 'ok'}
+
+
+@fake_auth.patch('/auth/')
+async def auth_change_set():
+    auth_requests['PATCH'] += 1
+    return {'message': 'ok'}
+
+
+class Seed:
+    # Ids created while seeding, used to build realistic requests
+    def __init__(self) -> None:
+        self.users: List[str] = []
+        self.tokens: Dict[str, str] = {}
+        # owner id -> [(organization id, [admin, manager, user] role ids)]
+        self.owned: Dict[str, List[Tuple[str, List[str]]]] = {}
+        # organization id -> member ids other than the owner
+        self.members: Dict[str, List[str]] = {}
+        # organization ids created during the run, consumed by the delete route
+        self.created: Dict[str, List[str]] = {}
+        # (owner id, cascade delete job id) returned by the delete route
+        self.jobs: List[Tuple[str, str]] = []
+
+
+def _token(user_id: str) -> str:
+    return jwt.encode({'sub': user_id, 'scope': 'access_token', 'exp': int(time.time()) + 24 * 3600},
+                      env.JWT_SECRET_KEY.get_secret_value(), algorithm=env.JWT_ALGORITHM)
+
+
+async def drop_database() -> None:
+    await async_db.client.drop_database(env.MONGODB_DATABASE)
+
+
+async def seed(users: int, orgs_per_user: int, members_per_org: int, roles_per_user: int, rng: random.Random) -> Seed:
+    data = Seed()
+    data.users = [str(ObjectId()) for _ in range(users)]
+    data.tokens = {user_id: _token(user_id) for user_id in data.users}
+    names: Dict[str, str] = {}
+
+    for owner_id in data.users:
+        results = await service.create_many(owner_id=owner_id, data=[
+            OrganizationCreate(name=f'Organization {index}', description='Benchmark organization')
+            for index in range(orgs_per_user)])
+        organization_ids = [result.id for result in results if result.error is None]
+        names.update({result.id: f'Organization {result.index}' for result in results if result.error is None})
+        role_ids = await role_manager.setup_many(organization_ids=organization_ids)
+        await role_manager.assign_roles([RoleAssignedInDB(toId=owner_id, organizationId=organization_id, roleId=roles[DefaultRoles.admin])
+                                         for organization_id, roles in role_ids.items()])
+        # Role ids in template order: admin, manager, user
+        data.owned[owner_id] = [(organization_id, [str(role_ids[organization_id][name]) for name in ROLE_TEMPLATES])
+                                for organization_id in organization_ids]
+        data.created[owner_id] = []
+
+    # Extra members per organization, drawn from the other users
+    memberships = []
+    member_of: Dict[str, List[Tuple[str, List[str]]]] = {user_id: [] for user_id in data.users}
+    for owner_id, organizations in data.owned.items():
+        others = [user_id for user_id in data.users if user_id != owner_id]
+        for organization_id, role_ids in organizations:
+            members = rng.sample(others, min(members_per_org, len(others)))
+            data.members[organization_id] = members
+            for member_id in members:
+                member_of[member_id].append((organization_id, role_ids))
+                memberships.append(service._new_membership(
+                    owner_id, {'_id': organization_id, 'name': names[organization_id]}, member_id=member_id))
+    if memberships:
+        await async_db.organization_member_collection.insert_many(memberships, ordered=False)
+
+    # 'user' role in up to roles_per_user of the organizations each user joined
+    assignments = []
+    for member_id, organizations in member_of.items():
+        for organization_id, role_ids in rng.sample(organizations, min(roles_per_user, len(organizations))):
+            assignments.append(RoleAssignedInDB(
+                toId=member_id, organizationId=organization_id, roleId=role_ids[2]))
+    if assignments:
+        await role_manager.assign_roles(assignments)
+    return data
+
+
+# (method, url, httpx request kwargs, callback receiving the response or None)
+Request = Tuple[str, str, Dict[str, Any], Optional[Callable[[httpx.Response], None]]]
+
+
+def scenarios(data: Seed, rng: random.Random, batch_size: int) -> List[Tuple[str, Callable[[int], Request]]]:
+    # Each scenario maps a request index to a Request
+    def headers(user_id: str, **extra) -> Dict[str, str]:
+        return dict(extra, Authorization=f'Bearer {data.tokens[user_id]}')
+
+    def owner() -> str:
+        return rng.choice(data.users)
+
+    def owned_organization(user_id: str) -> str:
+        return rng.choice(data.owned[user_id])[0]
+
+    def create(index: int) -> Request:
+        user_id = owner()
+
+        def created(response: httpx.Response) -> None:
+            if response.status_code == 200:
+                data.created[user_id].append(response.json())
+        return ('POST', '/organizations/', {'headers': headers(user_id), 'json': {
+            'name': f'Created {index}', 'description': 'Created during benchmark'}}, created)
+
+    def read(index: int) -> Request:
+        user_id = owner()
+        return ('GET', '/organizations/', {'headers': headers(user_id),
+                                           'params': {'organization_id': owned_organization(user_id)}}, None)
+
+    def read_all(index: int) -> Request:
+        return ('GET', '/organizations/all/', {'headers': headers(owner())}, None)
+
+    def read_all_page(index: int) -> Request:
+        return ('GET', '/organizations/all/', {'headers': headers(owner()), 'params': {'limit': 50}}, None)
+
+    def read_all_stream(index: int) -> Request:
+        return ('GET', '/organizations/all/', {'headers': headers(owner(), Accept='application/x-ndjson')}, None)
+
+    def summary(index: int) -> Request:
+        return ('GET', '/organizations/summary/', {'headers': headers(owner())}, None)
+
+    def search(index: int) -> Request:
+        return ('GET', '/organizations/search/', {'headers': headers(owner()),
+                                                  'params': {'q': f'organization {rng.randrange(10)}', 'limit': 20}}, None)
+
+    def changes(index: int) -> Request:
+        since = (datetime.utcnow() - timedelta(minutes=1)).isoformat()
+        return ('GET', '/organizations/changes/', {'headers': headers(owner()), 'params': {'since': since}}, None)
+
+    def update(index: int) -> Request:
+        user_id = owner()
+        return ('PUT', f'/organizations/{owned_organization(user_id)}', {'headers': headers(user_id), 'json': {
+            'name': f'Updated {index}', 'description': 'Updated during benchmark'}}, None)
+
+    def sync(index: int) -> Request:
+        return ('POST', '/organizations/sync/', {'headers': headers(owner())}, None)
+
+    def batch(index: int) -> Request:
+        return ('POST', '/organizations/batch/', {'headers': headers(owner()), 'json': [
+            {'name': f'Batch {index}.{item}', 'description': 'Created during benchmark'} for item in range(batch_size)]}, None)
+
+    # Assign the 'manager' role to members of one of the caller's organizations, then revoke the same items
+    role_batches: List[Tuple[str, List[Dict[str, str]]]] = []
+
+    def role_batch() -> Tuple[str, List[Dict[str, str]]]:
+        user_id = owner()
+        organization_id, role_ids = rng.choice(data.owned[user_id])
+        return user_id, [{'toId': member_id, 'organizationId': organization_id, 'roleId': role_ids[1]}
+                         for member_id in data.members[organization_id][:batch_size]]
+
+    def assign(index: int) -> Request:
+        user_id, items = role_batch()
+        role_batches.append((user_id, items))
+        return ('POST', '/organizations/roles/assign/', {'headers': headers(user_id), 'json': items}, None)
+
+    def revoke(index: int) -> Request:
+        user_id, items = role_batches.pop() if role_batches else role_batch()
+        return ('POST', '/organizations/roles/revoke/', {'headers': headers(user_id), 'json': items}, None)
+
+    def check(index: int) -> Request:
+        # The owner checks members of one of their organizations, which takes the access_control path
+        user_id = owner()
+        organization_id = owned_organization(user_id)
+        return ('POST', '/organizations/permissions/check/', {'headers': headers(user_id), 'json': [
+            {'userId': member_id, 'organizationId': organization_id, 'permission': rng.choice(['read:org', 'write:org'])}
+            for member_id in data.members[organization_id][:batch_size]]}, None)
+
+    def delete(index: int) -> Request:
+        # Organizations made by the create route, falling back to seeded ones once those run out
+        candidates = [user_id for user_id, ids in data.created.items() if ids]
+        user_id = rng.choice(candidates) if candidates else owner()
+        organization_id = data.created[user_id].pop() if candidates else owned_organization(user_id)
+
+        def deleted(response: httpx.Response) -> None:
+            if response.status_code == 202:
+                data.jobs.append((user_id, response.json()['jobId']))
+        return ('DELETE', f'/organizations/{organization_id}', {'headers': headers(user_id)}, deleted)
+
+    def read_job(index: int) -> Request:
+        # Jobs started by the delete route; an unknown id (answered 404) if it was skipped
+        user_id, job_id = rng.choice(data.jobs) if data.jobs else (owner(), str(ObjectId()))
+        return ('GET', f'/organizations/jobs/{job_id}', {'headers': headers(user_id)}, None)
+
+    return [('create_organization', create), ('read_organization', read), ('read_organizations', read_all),
+            ('read_organizations_page', read_all_page), ('read_organizations_ndjson', read_all_stream),
+            ('read_summary', summary), ('read_changes', changes),
+            ('search_organizations', search), ('update_organization', update), ('resync_organizations', sync),
+            ('create_organizations', batch),
+            ('assign_roles', assign), ('revoke_roles', revoke), ('check_permissions', check),
+            ('delete_organization', delete), ('read_delete_job', read_job)]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    latencies = sorted(latencies)
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {'requests': len(latencies), 'errors': errors,
+            'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+            'mean_ms': round(statistics.fmean(latencies) * 1000, 3) if latencies else None,
+            'p50_ms': round(percentiles[49] * 1000, 3) if latencies else None,
+            'p95_ms': round(percentiles[94] * 1000, 3) if latencies else None,
+            'p99_ms': round(percentiles[98] * 1000, 3) if latencies else None,
+            'max_ms': round(latencies[-1] * 1000, 3) if latencies else None}
+
+
+async def run_route(client: httpx.AsyncClient, build: Callable[[int], Request], requests: int, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statuses = Counter()
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        for index in counter:
+            method, url, kwargs, callback = build(index)
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            await response.aread()
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+            if callback:
+                callback(response)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    result = summarize(latencies, sum(count for status, count in statuses.items() if status >= 400), elapsed)
+    result['statuses'] = {str(status): count for status, count in sorted(statuses.items())}
+    return result
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    auth_url = httpx.URL(str(env.AUTHENTICATION_SERVICE_URL))
+    auth_server = uvicorn.Server(uvicorn.Config(fake_auth, host=auth_url.host, port=auth_url.port or 80,
+                                                log_level='warning', lifespan='off'))
+    auth_task = asyncio.create_task(auth_server.serve())
+    while not auth_server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        await drop_database()
+        async with lifespan(app):
+            seeded_at = time.perf_counter()
+            data = await seed(args.users, args.orgs_per_user, args.members_per_org, args.roles_per_user, rng)
+            seed_seconds = time.perf_counter() - seeded_at
+
+            routes = {}
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+                for name, build in scenarios(data, rng, args.batch_size):
+                    if args.routes and name not in args.routes:
+                        continue
+                    routes[name] = await run_route(client, build, args.requests, args.concurrency)
+        # Leaving the lifespan drains the auth sync queue, so the counts below are complete
+    finally:
+        if not args.keep:
+            await drop_database()
+        auth_server.should_exit = True
+        await auth_task
+
+    return {'config': {'users': args.users, 'orgs_per_user': args.orgs_per_user,
+                       'members_per_org': args.members_per_org, 'roles_per_user': args.roles_per_user,
+                       'requests': args.requests, 'concurrency': args.concurrency,
+                       'batch_size': args.batch_size, 'seed': args.seed},
+            'seed_seconds': round(seed_seconds, 3),
+            'routes': routes,
+            'auth_service': dict(auth_requests)}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--orgs-per-user', type=int, default=10)
+    parser.add_argument('--members-per-org', type=int, default=5)
+    parser.add_argument('--roles-per-user', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=10, help='items per batch route request')
+    parser.add_argument('--routes', nargs='*', help='only run these routes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help='keep the benchmark database afterwards')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='earlier JSON report to compare p95 latencies against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative p95 increase over the baseline before failing')
+    return parser.parse_args()
+
+
+def regressions(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    # Routes whose p95 grew by more than the tolerance since the baseline run
+    found = []
+    for name, result in report['routes'].items():
+        previous = baseline.get('routes', {}).get(name)
+        if not previous or not previous.get('p95_ms') or result['p95_ms'] is None:
+            continue
+        if result['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            found.append(f"{name}: p95 {previous['p95_ms']}ms -> {result['p95_ms']}ms")
+    return found
+
+
+if __name__ == '__main__':
+    if not env.MONGODB_URI:
+        sys.exit('Set MONGODB_URI to a local mongod; the benchmark drops MONGODB_DATABASE')
+    args = parse_args()
+    report = asyncio.run(main(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline) as file:
+            failed = regressions(report, json.load(file), args.tolerance)
+        if failed:
+            sys.exit('Latency regressions:\n' + '\n'.join(failed))
@@ -0,0 +1,66 @@
+# Compare per-document cost of the hand-built response path with the TypeAdapter/orjson path.
+#
+#   python -m benchmarks.serialization --documents 500 --repeat 50
+import argparse
+import json
+import timeit
+from datetime import datetime
+
+import orjson
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from core.models.organization import OrganizationResponse
+from core.utils.serialization import list_adapter, validate_list
+
+
+def raw_documents(count: int):
+    # Documents as returned before projections: ObjectIds still need converting
+    timestamp = datetime.utcnow()
+    return [{'_id': ObjectId(), 'name': f'Organization {index}', 'description': 'Benchmark organization',
+             'ownerId': ObjectId(), 'createdAt': timestamp, 'updatedAt': timestamp} for index in range(count)]
+
+
+def projected_documents(documents):
+    # Documents as returned with ORGANIZATION_RESPONSE_PROJECTION: ids converted server-side
+    return [dict(document, _id=str(document['_id']), ownerId=str(document['ownerId'])) for document in documents]
+
+
+def current_path(documents):
+    organizations = []
+    for document in documents:
+        organization = OrganizationResponse(
+            _id=str(document['_id']),
+            name=document['name'],
+            description=document['description'],
+            ownerId=str(document['ownerId']),
+            createdAt=document['createdAt'],
+            updatedAt=document['updatedAt']
+        )
+        organization.id = str(organization.id)
+        organization.ownerId = str(organization.ownerId)
+        organizations.append(organization.model_dump())
+    return json.dumps(jsonable_encoder(organizations)).encode()
+
+
+def adapter_path(documents):
+    organizations = validate_list(OrganizationResponse, documents)
+    return orjson.dumps(list_adapter(OrganizationResponse).dump_python(organizations, mode='json', by_alias=True))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--documents', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    raw = raw_documents(args.documents)
+    projected = projected_documents(raw)
+    for name, fn, documents in (('current', current_path, raw), ('adapter', adapter_path, projected)):
+        seconds = timeit.timeit(lambda: fn(documents), number=args.repeat)
+        per_document = seconds / (args.repeat * args.documents) * 1e6
+        print(f'{name:>8}: {per_document:7.2f} us/document')
+
+
+if __name__ == '__main__':
+    main()
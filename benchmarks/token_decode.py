@@ -0,0 +1,45 @@
+# Compare bearer token decoding with and without the verified-claims cache.
+#
+#   ENV_FILE=./.env python -m benchmarks.token_decode --iterations 20000
+import argparse
+import time
+import timeit
+
+import jwt
+from quest_maker_api_shared_library.token_manager import TokenManager
+
+from core.api.dependencies import CachedTokenDecoder
+from core.config.env import get_env
+from core.utils.cache import TTLCache
+
+env = get_env()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    secret = env.JWT_SECRET_KEY.get_secret_value()
+    token = jwt.encode({'sub': '65a000000000000000000001', 'scope': 'access_token',
+                        'exp': int(time.time()) + 3600}, secret, algorithm=env.JWT_ALGORITHM)
+    token_manager = TokenManager(key=secret,
+                                 jwt_expiration_time_in_minutes=env.JWT_EXPIRATION_TIME_IN_MINUTES)
+    decoder = CachedTokenDecoder(token_manager=token_manager,
+                                 cache=TTLCache(max_size=1024, ttl=300))
+
+    def uncached():
+        payload = token_manager.decode_token(token=token)
+        return 'access_token' in str(payload['scope']).split()
+
+    def cached():
+        return 'access_token' in decoder.decode(token).scope
+
+    for name, fn in (('uncached', uncached), ('cached', cached)):
+        seconds = timeit.timeit(fn, number=args.iterations)
+        print(f'{name:>9}: {seconds / args.iterations * 1e6:8.2f} us/call')
+    print(f'cache hits={decoder.cache.hits} misses={decoder.cache.misses}')
+
+
+if __name__ == '__main__':
+    main()
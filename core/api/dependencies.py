@@ -0,0 +1,72 @@
+import hashlib
+import time
+from http import HTTPStatus
+from typing import FrozenSet, NamedTuple
+
+from fastapi import HTTPException, Security
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from quest_maker_api_shared_library.token_manager import TokenManager
+from quest_maker_api_shared_library.errors.authentication import InvalidTokenError, ExpiredTokenError
+
+from core.config.env import get_env
+from core.utils.cache import TTLCache
+from core.utils.metrics import registry
+
+env = get_env()
+bearer = HTTPBearer()
+
+
+class TokenClaims(NamedTuple):
+    subject: str
+    scope: FrozenSet[str]
+    expires_at: float
+    credentials: str
+
+
+class CachedTokenDecoder:
+    # Verified claims keyed by a hash of the token, kept no longer than the token's exp
+    def __init__(self, token_manager: TokenManager, cache: TTLCache) -> None:
+        self.token_manager = token_manager
+        self.cache = cache
+
+    def decode(self, credentials: str) -> TokenClaims:
+        key = hashlib.sha256(credentials.encode()).digest()
+        claims = self.cache.get(key)
+        if claims is not None and claims.expires_at > time.time():
+            return claims
+
+        payload = self.token_manager.decode_token(token=credentials)
+        claims = TokenClaims(
+            subject=str(payload['sub']),
+            scope=frozenset(str(payload['scope']).split()),
+            expires_at=float(payload.get('exp', 0)),
+            credentials=credentials
+        )
+        ttl = min(self.cache.ttl, claims.expires_at - time.time())
+        if ttl > 0:
+            self.cache.set(key, claims, ttl=ttl)
+        return claims
+
+
+token_decoder = CachedTokenDecoder(
+    token_manager=TokenManager(key=env.JWT_SECRET_KEY.get_secret_value(),
+                               jwt_expiration_time_in_minutes=env.JWT_EXPIRATION_TIME_IN_MINUTES,),
+    cache=registry.register_cache('tokens', TTLCache(max_size=env.TOKEN_CACHE_SIZE,
+                                                     ttl=env.TOKEN_CACHE_TTL_SECONDS))
+)
+
+
+def authenticated_user(token: HTTPAuthorizationCredentials = Security(bearer)) -> TokenClaims:
+    # Resolve the bearer token into claims carrying the 'access_token' scope
+    try:
+        claims = token_decoder.decode(token.credentials)
+    except ExpiredTokenError as e:
+        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail={
+                            'message': f'{e.detail}'})
+    except InvalidTokenError as e:
+        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail={
+                            'message': f'{e.detail}'})
+    if 'access_token' not in claims.scope:
+        raise HTTPException(status_code=HTTPStatus.FORBIDDEN, detail={
+                            'message': 'Unauthorized access or Insufficient scope'})
+    return claims
@@ -0,0 +1,23 @@
+from http import HTTPStatus
+
+from fastapi import APIRouter, HTTPException
+
+from core.config.database import ping
+
+
+health = APIRouter()
+
+
+@health.get('/live')
+# Process is up and serving requests
+async def live():
+    return {'status': 'ok'}
+
+
+@health.get('/ready')
+# Process can reach MongoDB and should receive traffic
+async def ready():
+    if not await ping():
+        raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail={
+                            'message': 'Database unavailable'})
+    return {'status': 'ok'}
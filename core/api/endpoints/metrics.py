@@ -0,0 +1,14 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from core.utils.metrics import registry
+
+
+metrics = APIRouter()
+PROMETHEUS_MEDIA_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+@metrics.get('/metrics', response_class=PlainTextResponse)
+# Request, MongoDB command and cache metrics in Prometheus text format
+async def read_metrics():
+    return PlainTextResponse(registry.render(), media_type=PROMETHEUS_MEDIA_TYPE)
@@ -1,247 +1,339 @@
 from http import HTTPStatus
+from datetime import datetime
+from typing import Dict, List, Optional
 
-from fastapi import APIRouter, HTTPException, Security
-from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from quest_maker_api_shared_library.token_manager import TokenManager
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from quest_maker_api_shared_library.custom_types import PydanticObjectId
-from quest_maker_api_shared_library.errors.authentication import InvalidTokenError, ExpiredTokenError
-import requests
 
-from core.config.env import Env
+from core.api.dependencies import TokenClaims, authenticated_user
+from core.config.env import get_env
 from core.errors.database import DocumentNotFoundError
-from core.models.organization import OrganizationCreate, OrganizationUpdate
+from core.models.batch import BatchItemResult
+from core.models.organization import OrganizationCreate, OrganizationResponse, OrganizationSearchResult, OrganizationUpdate
+from core.models.permissions import PermissionCheck, PermissionCheckResult
 from core.models.roles import RoleAssignedInDB
-from core.services.organization import OrganizationService
-from core.utils.managers.roles import RoleManager
+from core.services.cascade import cascade_jobs
+from core.services.changes import ChangeFeed
+from core.services.organization import AsyncOrganizationService, SearchMode
+from core.services.provisioning import OrganizationProvisioner
+from core.services.summary import AsyncMemberSummaryService
+from core.utils.auth_sync import PendingChanges, dispatcher
+from core.utils.etag import etag_matches, make_etag, organization_etag
+from core.utils.managers.roles import ROLE_TEMPLATES, AsyncRoleManager, DefaultRoles
+from core.utils.permissions import PERMISSION_BITS, Permissions
+from core.utils.serialization import list_response
+
+
+env = get_env()
+organization = APIRouter()
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+MAX_BATCH_SIZE = 1000
+MAX_SEARCH_LIMIT = 100
+service = AsyncOrganizationService()
+provisioner = OrganizationProvisioner()
+role_manager = AsyncRoleManager()
+summaries = AsyncMemberSummaryService()
+changes = ChangeFeed()
+# Clients may keep responses but must revalidate them with If-None-Match
+CACHE_CONTROL = 'private, no-cache'
 
 
-organization = APIRouter()
-bearer = HTTPBearer()
-service = OrganizationService()
-env = Env()
-token_manager = TokenManager(key=env.JWT_SECRET_KEY.get_secret_value(),
-                             jwt_expiration_time_in_minutes=env.JWT_EXPIRATION_TIME_IN_MINUTES,)
-role_manager = RoleManager()
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=HTTPStatus.NOT_MODIFIED, headers={'ETag': etag, 'Cache-Control': CACHE_CONTROL})
 
 
 @organization.post('/')
 # Create new organization instance
-def create_organization(data: OrganizationCreate, token: HTTPAuthorizationCredentials = Security(bearer)):
+async def create_organization(data: OrganizationCreate, user: TokenClaims = Depends(authenticated_user)):
+    owner_id = user.subject
     try:
-        payload = token_manager.decode_token(token=token.credentials)
-        owner_id = str(payload['sub'])
-        scope = str(payload['scope'])
-        if 'access_token' in scope.split():
-            try:
-                organization_id = service.create(owner_id=owner_id, data=data)
-                role_ids = role_manager.setup(organization_id=organization_id)
-                if role_ids:
-                    role_manager.assign_role(data=RoleAssignedInDB(
-                        toId=owner_id, organizationId=organization_id, roleId=role_ids[0]))
-                try:
-                    # Set up request headers
-                    headers = {'Authorization': f'Bearer {token.credentials}'}
-
-                    json_data = {}
-                    json_data['organizations'] = []
-                    json_data['roles'] = []
-
-                    # Pass organization details to Authentication service
-                    organizations = service.read_all(member_id=owner_id)
-                    for organization in organizations:
-                        organization.id = str(organization.id)
-                        organization.ownerId = str(organization.ownerId)
-                        json_data['organizations'].append(
-                            organization.model_dump())
-
-                    # Pass role details to Authentication service
-                    roles = role_manager.get_roles(to_id=owner_id)
-                    for role in roles:
-                        role['_id'] = str(role['_id'])
-                        role['organizationId'] = str(role['organizationId'])
-                        json_data['roles'].append(role)
-
-                    response = requests.put(url=f'{env.AUTHENTICATION_SERVICE_URL}auth/',
-                                            json=json_data,
-                                            headers=headers)
-
-                    if response.status_code == HTTPStatus.OK:
-                        return str(organization_id)
-
-                except HTTPException:
-                    raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail={
-                                        'message': 'Internal Server Error'})
-
-            except HTTPException:
-                raise HTTPException(
-                    status_code=HTTPStatus.BAD_REQUEST, detail={'message': 'Invalid request'})
-        else:
-            raise HTTPException(status_code=HTTPStatus.FORBIDDEN, detail={
-                                'message': 'Unauthorized access or Insufficient scope'})
-    except ExpiredTokenError as e:
-        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail={
-                            'message': f'{e.detail}'})
-    except InvalidTokenError as e:
-        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail={
-                            'message': f'{e.detail}'})
+        provisioned = await provisioner.provision(owner_id=owner_id, data=data)
+        # Pass organization and owner role to Authentication service in the background
+        owner_roles = [role for role in provisioned.roles
+                       if str(role.id) == provisioned.owner_role_id]
+        dispatcher.enqueue(user_id=owner_id, token=user.credentials, changes=PendingChanges(
+            organizations=[provisioned.organization], roles=owner_roles))
+        return str(provisioned.organization.id)
+
+    except HTTPException:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST, detail={'message': 'Invalid request'})
 
 
 @organization.get('/')
 # Fetch organization instance
-def read_organization(organization_id: PydanticObjectId, token: HTTPAuthorizationCredentials = Security(bearer)):
+async def read_organization(organization_id: PydanticObjectId, response: Response, if_none_match: Optional[str] = Header(default=None),
+                            user: TokenClaims = Depends(authenticated_user)):
     try:
-        payload = token_manager.decode_token(token=token.credentials)
-        member_id = str(payload['sub'])
-        scope = str(payload['scope'])
-        if 'access_token' in scope.split():
-            try:
-                organization = service.read(
-                    member_id=member_id, organization_id=organization_id)
-                return organization
-
-            except DocumentNotFoundError:
-                raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail={
-                                    'message': 'Resource not found'})
-            except HTTPException:
-                raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail={
-                                    'message': 'Invalid request'})
-        else:
-            raise HTTPException(status_code=HTTPStatus.FORBIDDEN, detail={
-                'message': 'Unauthorized access or Insufficient scope'})
-    except ExpiredTokenError as e:
-        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail={
-                            'message': f'{e.detail}'})
-    except InvalidTokenError as e:
-        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail={
-                            'message': f'{e.detail}'})
+        organization = await service.read(
+            member_id=user.subject, organization_id=organization_id)
+        etag = organization_etag(organization)
+        if etag_matches(if_none_match, etag):
+            return _not_modified(etag)
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        return organization
+
+    except DocumentNotFoundError:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail={
+                            'message': 'Resource not found'})
+    except HTTPException:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail={
+                            'message': 'Invalid request'})
 
 
 @organization.get('/all/')
 # Fetch all organization instances associated with an authenticated user
-def read_organizations(token: HTTPAuthorizationCredentials = Security(bearer)):
+async def read_organizations(limit: Optional[int] = Query(default=None, ge=1, le=1000), after: Optional[PydanticObjectId] = None,
+                             accept: Optional[str] = Header(default=None), if_none_match: Optional[str] = Header(default=None),
+                             user: TokenClaims = Depends(authenticated_user)):
+    streaming = bool(accept and NDJSON_MEDIA_TYPE in accept)
+    if streaming and limit:
+        # A stream's headers go out before its last organization is known, so it cannot carry a next
+        # cursor; it returns everything after `after` instead
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail={
+                            'message': f'limit is not supported with {NDJSON_MEDIA_TYPE}'})
+    try:
+        # The member's version changes with any membership or listed organization, so a matching
+        # validator is answered without running the aggregation
+        version = await service.membership_version(user.subject)
+        etag = make_etag(user.subject, version, limit, after, streaming)
+        if etag_matches(if_none_match, etag):
+            return _not_modified(etag)
+        headers = {'ETag': etag, 'Cache-Control': CACHE_CONTROL}
+
+        if streaming:
+            # Stream one JSON document per line straight from the Mongo cursor
+            async def lines():
+                async for organization in service.stream_all(member_id=user.subject, after=after):
+                    yield organization.model_dump_json(by_alias=True) + '\n'
+            return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+        organizations = await service.read_all(
+            member_id=user.subject, limit=limit, after=after, version=version)
+        if limit and len(organizations) == limit:
+            # Cursor for the next page, passed back as the 'after' parameter
+            headers['X-Next-Cursor'] = str(organizations[-1].id)
+        return list_response(OrganizationResponse, organizations, headers=headers)
+
+    except DocumentNotFoundError:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail={
+                            'message': 'Resource not found'})
+    except HTTPException:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail={
+                            'message': 'Invalid request'})
+
+
+@organization.get('/search/')
+# Search the authenticated user's organizations by name prefix, or by whole words when the text index is enabled
+async def search_organizations(q: str = Query(min_length=1, max_length=200), mode: str = Query(default=SearchMode.prefix, pattern='^(prefix|word)$'),
+                               limit: int = Query(default=20, ge=1, le=MAX_SEARCH_LIMIT), after: Optional[PydanticObjectId] = None,
+                               user: TokenClaims = Depends(authenticated_user)):
+    if mode == SearchMode.word and not env.ORGANIZATION_TEXT_SEARCH:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail={
+                            'message': 'Full-word search is not enabled'})
+    try:
+        organizations = await service.search(
+            member_id=user.subject, query=q, mode=mode, limit=limit, after=after)
+        headers = {}
+        if len(organizations) == limit:
+            # Cursor for the next page, passed back as the 'after' parameter
+            headers['X-Next-Cursor'] = str(organizations[-1].id)
+        return list_response(OrganizationSearchResult, organizations, headers=headers)
+
+    except DocumentNotFoundError:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail={
+                            'message': 'Resource not found'})
+    except HTTPException:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail={
+                            'message': 'Invalid request'})
+
+
+@organization.get('/summary/')
+# Fetch the authenticated user's organizations and roles from their materialized summary
+async def read_summary(user: TokenClaims = Depends(authenticated_user)):
     try:
-        payload = token_manager.decode_token(token=token.credentials)
-        member_id = str(payload['sub'])
-        scope = str(payload['scope'])
-        if 'access_token' in scope.split():
-            try:
-                organizations = service.read_all(member_id=member_id)
-                return organizations
-
-            except DocumentNotFoundError:
-                raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail={
-                                    'message': 'Resource not found'})
-            except HTTPException:
-                raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail={
-                                    'message': 'Invalid request'})
-    except ExpiredTokenError as e:
-        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail={
-                            'message': f'{e.detail}'})
-    except InvalidTokenError as e:
-        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail={
-                            'message': f'{e.detail}'})
+        return await summaries.read(member_id=user.subject)
+
+    except HTTPException:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail={
+                            'message': 'Invalid request'})
+
+
+@organization.get('/changes/')
+# Fetch the organizations, memberships and roles modified since a previous response's cursor
+async def read_changes(since: Optional[datetime] = Query(None), user: TokenClaims = Depends(authenticated_user)):
+    try:
+        return await changes.changes_since(member_id=user.subject, since=since)
+
+    except HTTPException:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail={
+                            'message': 'Invalid request'})
 
 
 @organization.put('/{organization_id}')
 # Update organization instance
-def update_organization(organization_id: PydanticObjectId, data: OrganizationUpdate, token: HTTPAuthorizationCredentials = Security(bearer)):
+async def update_organization(organization_id: PydanticObjectId, data: OrganizationUpdate, user: TokenClaims = Depends(authenticated_user)):
+    owner_id = user.subject
     try:
-        payload = token_manager.decode_token(token=token.credentials)
-        owner_id = str(payload['sub'])
-        scope = str(payload['scope'])
-        if 'access_token' in scope.split():
-            try:
-                data = service.update(owner_id=owner_id, organization_id=str(
-                    organization_id), data=data)
-                try:
-                    # Set up request headers
-                    headers = {'Authorization': f'Bearer {token.credentials}'}
-
-                    json_data = {}
-                    json_data['organizations'] = []
-
-                    # Pass organization details to Authentication service
-                    organizations = service.read_all(member_id=owner_id)
-                    for organization in organizations:
-                        organization.id = str(organization.id)
-                        organization.ownerId = str(organization.ownerId)
-                        json_data['organizations'].append(
-                            organization.model_dump())
-
-                    response = requests.put(url=f'{env.AUTHENTICATION_SERVICE_URL}auth/',
-                                            json=json_data,
-                                            headers=headers)
-
-                    if response.status_code == HTTPStatus.OK:
-                        return data
-
-                except HTTPException:
-                    raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail={
-                                        'message': 'Internal Server Error'})
-
-            except HTTPException:
-                raise HTTPException(
-                    status_code=HTTPStatus.BAD_REQUEST, detail={'message': 'Invalid request'})
-        else:
-            raise HTTPException(status_code=HTTPStatus.FORBIDDEN, detail={
-                                'message': 'Unauthorized access or Insufficient scope'})
-    except ExpiredTokenError as e:
-        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail={
-                            'message': f'{e.detail}'})
-    except InvalidTokenError as e:
-        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail={
-                            'message': f'{e.detail}'})
-
-
-@organization.delete('/{organization_id}')
-# Delete organization instance
-def delete_organization(organization_id: PydanticObjectId, token: HTTPAuthorizationCredentials = Security(bearer)):
+        data = await service.update(owner_id=owner_id, organization_id=str(
+            organization_id), data=data)
+        # Pass organization changes to Authentication service in the background
+        dispatcher.enqueue(user_id=owner_id, token=user.credentials, changes=PendingChanges(
+            upserted_organizations=[organization_id]))
+        return data
+
+    except DocumentNotFoundError:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail={
+                            'message': 'Organization not found'})
+    except HTTPException:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST, detail={'message': 'Invalid request'})
+
+
+@organization.delete('/{organization_id}', status_code=HTTPStatus.ACCEPTED)
+# Delete organization instance; its memberships, roles and assignments are removed by a background job
+async def delete_organization(organization_id: PydanticObjectId, user: TokenClaims = Depends(authenticated_user)):
+    owner_id = user.subject
+    try:
+        # The cleanup job is recorded before the organization is deleted
+        job_id = await cascade_jobs.delete_organization(
+            owner_id=owner_id, organization_id=str(organization_id))
+        # Pass organization changes to Authentication service in the background
+        dispatcher.enqueue(user_id=owner_id, token=user.credentials, changes=PendingChanges(
+            removed_organizations=[organization_id]))
+        return {"message": "Organization deleted, cleanup scheduled", "jobId": job_id}
+
+    except DocumentNotFoundError:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail={
+                            'message': 'Organization not found'})
+    except HTTPException:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail={
+                            'message': 'Invalid request'})
+
+
+@organization.get('/jobs/{job_id}')
+# Fetch the progress of a cascade delete started by the authenticated user
+async def read_job(job_id: PydanticObjectId, user: TokenClaims = Depends(authenticated_user)):
     try:
-        payload = token_manager.decode_token(token=token.credentials)
-        owner_id = str(payload['sub'])
-        scope = str(payload['scope'])
-        if 'access_token' in scope.split():
-            try:
-                service.delete(owner_id=owner_id,
-                               organization_id=str(organization_id))
-                try:
-                    # Set up request headers
-                    headers = {'Authorization': f'Bearer {token.credentials}'}
-
-                    json_data = {}
-                    json_data['organizations'] = []
-
-                    # Pass organization details to Authentication service
-                    organizations = service.read_all(member_id=owner_id)
-                    for organization in organizations:
-                        organization.id = str(organization.id)
-                        organization.ownerId = str(organization.ownerId)
-                        json_data['organizations'].append(
-                            organization.model_dump())
-
-                    response = requests.put(url=f'{env.AUTHENTICATION_SERVICE_URL}auth/',
-                                            json=json_data,
-                                            headers=headers)
-
-                    if response.status_code == HTTPStatus.OK:
-                        return {"message": "Organization deleted successfully"}
-
-                except HTTPException:
-                    raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail={
-                                        'message': 'Internal Server Error'})
-
-            except DocumentNotFoundError:
-                raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail={
-                                    'message': 'Organization not found'})
-            except HTTPException:
-                raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail={
-                                    'message': 'Invalid request'})
+        return await cascade_jobs.read(owner_id=user.subject, job_id=job_id)
+
+    except DocumentNotFoundError:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail={
+                            'message': 'Job not found'})
+    except HTTPException:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail={
+                            'message': 'Invalid request'})
+
+
+@organization.post('/sync/', status_code=HTTPStatus.ACCEPTED)
+# Push a full snapshot of the authenticated user's organizations and roles to the Authentication service
+async def resync_organizations(user: TokenClaims = Depends(authenticated_user)):
+    dispatcher.enqueue(user_id=user.subject, token=user.credentials)
+    return {"message": "Resync scheduled"}
+
+
+def _check_batch_size(items: List) -> None:
+    if not items or len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail={
+                            'message': f'Batch must contain between 1 and {MAX_BATCH_SIZE} items'})
+
+
+async def _access_controlled_organizations(user: TokenClaims, items: List[RoleAssignedInDB]) -> Dict[str, bool]:
+    # Whether the caller may manage role assignments in each organization referenced by the batch
+    organization_ids = {str(item.organizationId) for item in items}
+    effective_permissions = await role_manager.get_effective_permissions_many(
+        [(user.subject, organization_id) for organization_id in organization_ids])
+    return {organization_id: effective_permissions[role_manager.permission_key(user.subject, organization_id)]
+            .allows(Permissions.access_control) for organization_id in organization_ids}
+
+
+async def _apply_role_batch(user: TokenClaims, items: List[RoleAssignedInDB], apply, changes_for) -> List[BatchItemResult]:
+    _check_batch_size(items)
+    allowed = await _access_controlled_organizations(user, items)
+    permitted = [index for index, item in enumerate(items)
+                 if allowed[str(item.organizationId)]]
+    results = [BatchItemResult(index=index, error='Unauthorized access or Insufficient permission')
+               for index in range(len(items))]
+    for result in await apply([items[index] for index in permitted]):
+        results[permitted[result.index]] = BatchItemResult(
+            index=permitted[result.index], id=result.id, error=result.error)
+
+    # The Authentication service identifies the user from the bearer token, so only the caller's own
+    # changes can be pushed with it; other assignees pick theirs up on their next /sync/
+    role_ids = [str(items[result.index].roleId) for result in results
+                if result.error is None and str(items[result.index].toId) == user.subject]
+    if role_ids:
+        dispatcher.enqueue(user_id=user.subject, token=user.credentials,
+                           changes=changes_for(role_ids))
+    return results
+
+
+@organization.post('/batch/')
+# Create many organization instances owned by the authenticated user
+async def create_organizations(data: List[OrganizationCreate], user: TokenClaims = Depends(authenticated_user)) -> List[BatchItemResult]:
+    _check_batch_size(data)
+    owner_id = user.subject
+    results = await service.create_many(owner_id=owner_id, data=data)
+    organization_ids = [result.id for result in results if result.error is None]
+    if not organization_ids:
+        return results
+
+    role_ids = await role_manager.setup_many(organization_ids=organization_ids)
+    failed = {organization_id: 'Default roles could not be created' for organization_id, roles in role_ids.items()
+              if roles.keys() != ROLE_TEMPLATES.keys()}
+    # The owner is given the admin role wherever it was created
+    assignments = [RoleAssignedInDB(toId=owner_id, organizationId=organization_id, roleId=roles[DefaultRoles.admin])
+                   for organization_id, roles in role_ids.items() if DefaultRoles.admin in roles]
+    assigned = await role_manager.assign_roles(assignments)
+    for result in assigned:
+        if result.error is not None:
+            failed.setdefault(str(assignments[result.index].organizationId),
+                              f'Owner role could not be assigned: {result.error}')
+
+    # Organizations left incomplete keep their id, so the caller can retry or delete them
+    results = [BatchItemResult(index=result.index, id=result.id, error=failed[result.id]) if result.id in failed else result
+               for result in results]
+    # Pass organization and role changes to Authentication service in the background
+    dispatcher.enqueue(user_id=owner_id, token=user.credentials, changes=PendingChanges(
+        upserted_organizations=organization_ids,
+        added_roles=[str(assignments[result.index].roleId) for result in assigned if result.error is None]))
+    return results
+
+
+@organization.post('/roles/assign/')
+# Assign many roles, reporting the outcome of each item
+async def assign_roles(data: List[RoleAssignedInDB], user: TokenClaims = Depends(authenticated_user)) -> List[BatchItemResult]:
+    return await _apply_role_batch(user, data, role_manager.assign_roles,
+                                   lambda role_ids: PendingChanges(added_roles=role_ids))
+
+
+@organization.post('/roles/revoke/')
+# Revoke many role assignments, reporting the outcome of each item
+async def revoke_roles(data: List[RoleAssignedInDB], user: TokenClaims = Depends(authenticated_user)) -> List[BatchItemResult]:
+    return await _apply_role_batch(user, data, role_manager.revoke_roles,
+                                   lambda role_ids: PendingChanges(removed_roles=role_ids))
+
+
+@organization.post('/permissions/check/')
+# Answer many (userId, organizationId, permission) checks from each pair's effective permissions
+async def check_permissions(data: List[PermissionCheck], user: TokenClaims = Depends(authenticated_user)) -> List[PermissionCheckResult]:
+    _check_batch_size(data)
+    # The caller may check their own permissions, and anyone's in organizations where they hold access_control
+    pairs = [(item.userId, item.organizationId) for item in data]
+    pairs += [(user.subject, item.organizationId) for item in data]
+    effective_permissions = await role_manager.get_effective_permissions_many(pairs)
+
+    results = []
+    for index, item in enumerate(data):
+        caller = effective_permissions[role_manager.permission_key(user.subject, item.organizationId)]
+        if str(item.userId) != user.subject and not caller.allows(Permissions.access_control):
+            results.append(PermissionCheckResult(
+                index=index, error='Unauthorized access or Insufficient permission'))
+        elif item.permission not in PERMISSION_BITS:
+            results.append(PermissionCheckResult(index=index, error='Unknown permission'))
         else:
-            raise HTTPException(status_code=HTTPStatus.FORBIDDEN, detail={
-                                'message': 'Unauthorized access or Insufficient scope'})
-    except ExpiredTokenError as e:
-        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail={
-                            'message': f'{e.detail}'})
-    except InvalidTokenError as e:
-        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail={
-                            'message': f'{e.detail}'})
+            results.append(PermissionCheckResult(index=index, allowed=effective_permissions[role_manager.permission_key(
+                item.userId, item.organizationId)].allows(item.permission)))
+    return results
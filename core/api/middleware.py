@@ -0,0 +1,43 @@
+import time
+
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.utils.metrics import current_route, request_duration
+
+
+class TimingMiddleware:
+    # Records request latency per route template and tags the request's Mongo commands with it
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    def _route(self, scope: Scope) -> str:
+        # Match up front so commands issued by the handler already carry the template, not the raw path
+        for route in scope['app'].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return 'unmatched'
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        route = self._route(scope)
+        token = current_route.set(route)
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_duration.observe(time.perf_counter() - started,
+                                     scope['method'], route, str(status))
+            current_route.reset(token)
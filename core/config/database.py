@@ -1,26 +1,140 @@
+import os
+from typing import Any, Dict, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo.mongo_client import MongoClient
 
-from core.config.env import Env
+from core.config.env import get_env
+from core.utils.metrics import command_listener
 
-env = Env()
+# Clients are created on first use and belong to the process that created them, so a
+# pre-fork server never shares sockets between workers
+_clients: Dict[str, Any] = {}
+_client_pid: Optional[int] = None
 
 
-class OrganizationDatabase:
-    uri = 'mongodb+srv://' + env.MONGODB_USERNAME + ':' + \
+def _uri() -> str:
+    env = get_env()
+    if env.MONGODB_URI:
+        # Explicit URI, e.g. a local mongod for development and benchmarks
+        return env.MONGODB_URI
+    return 'mongodb+srv://' + env.MONGODB_USERNAME + ':' + \
         env.MONGODB_PASSWORD.get_secret_value() + \
         '@' + env.MONGODB_CLUSTER + '/?retryWrites=true&w=majority'
-    client = MongoClient(uri)
-    # Set the database name to 'organization_db'
-    db = client['organization_db']
 
-    # Set the collection name to 'organization'
-    organization_collection = db['organization']
 
-    # Set the collection name to 'organization_member'
-    organization_member_collection = db['organization_member']
+def _client_options() -> Dict[str, Any]:
+    env = get_env()
+    return {'maxPoolSize': env.MONGODB_MAX_POOL_SIZE,
+            'minPoolSize': env.MONGODB_MIN_POOL_SIZE,
+            'waitQueueTimeoutMS': env.MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+            'serverSelectionTimeoutMS': env.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+            'event_listeners': [command_listener]}
+
+
+def _process_clients() -> Dict[str, Any]:
+    global _client_pid
+    if _client_pid != os.getpid():
+        # Inherited from a parent process: drop the references without closing the parent's sockets
+        _clients.clear()
+        _client_pid = os.getpid()
+    return _clients
+
+
+def get_client() -> MongoClient:
+    # Blocking client, kept for scripts and maintenance jobs
+    clients = _process_clients()
+    if 'sync' not in clients:
+        clients['sync'] = MongoClient(_uri(), **_client_options())
+    return clients['sync']
+
+
+def get_async_client() -> AsyncIOMotorClient:
+    # asyncio client used by the API request path
+    clients = _process_clients()
+    if 'async' not in clients:
+        clients['async'] = AsyncIOMotorClient(_uri(), **_client_options())
+    return clients['async']
+
+
+def close_clients() -> None:
+    clients = _process_clients()
+    for client in clients.values():
+        client.close()
+    clients.clear()
+
+
+async def ping() -> bool:
+    # Readiness check: the server is selectable and answers within serverSelectionTimeoutMS
+    try:
+        await get_async_client().admin.command('ping')
+        return True
+    except Exception:
+        return False
+
+
+class OrganizationDatabase:
+    @property
+    def client(self) -> MongoClient:
+        return get_client()
+
+    @property
+    def db(self):
+        # Database name defaults to 'organization_db'
+        return self.client[get_env().MONGODB_DATABASE]
+
+    @property
+    def organization_collection(self):
+        # Set the collection name to 'organization'
+        return self.db['organization']
+
+    @property
+    def organization_member_collection(self):
+        # Set the collection name to 'organization_member'
+        return self.db['organization_member']
+
+    @property
+    def role_collection(self):
+        # Set the collection name to 'role'
+        return self.db['role']
+
+    @property
+    def role_assigned(self):
+        # Set the collection name to 'role_assigned'
+        return self.db['role_assigned']
+
+    @property
+    def auth_sync_collection(self):
+        # Set the collection name to 'auth_sync'
+        return self.db['auth_sync']
+
+    @property
+    def membership_version_collection(self):
+        # Set the collection name to 'membership_version'
+        return self.db['membership_version']
+
+    @property
+    def change_stream_state_collection(self):
+        # Set the collection name to 'change_stream_state'
+        return self.db['change_stream_state']
+
+    @property
+    def member_summary_collection(self):
+        # Set the collection name to 'member_summary'
+        return self.db['member_summary']
+
+    @property
+    def job_collection(self):
+        # Set the collection name to 'job'
+        return self.db['job']
+
+    @property
+    def removal_collection(self):
+        # Set the collection name to 'removal'
+        return self.db['removal']
 
-    # Set the collection name to 'role'
-    role_collection = db['role']
 
-    # Set the collection name to 'role_assigned'
-    role_assigned = db['role_assigned']
+class AsyncOrganizationDatabase(OrganizationDatabase):
+    @property
+    def client(self) -> AsyncIOMotorClient:
+        return get_async_client()
@@ -1,4 +1,6 @@
 import os
+from functools import lru_cache
+from typing import Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import AnyHttpUrl, SecretStr
@@ -17,3 +19,39 @@ class Env(BaseSettings):
     JWT_REFRESH_EXPIRATION_TIME_IN_HOURS: int
     JWT_ALGORITHM: str
     AUTHENTICATION_SERVICE_URL: AnyHttpUrl
+    MONGODB_URI: Optional[str] = None
+    MONGODB_DATABASE: str = 'organization_db'
+    MONGODB_MAX_POOL_SIZE: int = 100
+    MONGODB_MIN_POOL_SIZE: int = 0
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS: int = 5000
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS: int = 5000
+    AUTH_SYNC_TIMEOUT_SECONDS: float = 5.0
+    AUTH_SYNC_MAX_RETRIES: int = 3
+    AUTH_SYNC_BACKOFF_SECONDS: float = 0.5
+    AUTH_SYNC_WORKERS: int = 4
+    AUTH_SYNC_DRAIN_TIMEOUT_SECONDS: float = 10.0
+    PERMISSION_CACHE_SIZE: int = 10000
+    PERMISSION_CACHE_TTL_SECONDS: float = 60.0
+    ORGANIZATION_CACHE_SIZE: int = 10000
+    ORGANIZATION_CACHE_TTL_SECONDS: float = 30.0
+    TOKEN_CACHE_SIZE: int = 10000
+    TOKEN_CACHE_TTL_SECONDS: float = 300.0
+    PROVISIONING_USE_TRANSACTIONS: bool = True
+    CASCADE_DELETE_BATCH_SIZE: int = 500
+    CASCADE_DELETE_PAUSE_SECONDS: float = 0.05
+    CASCADE_DELETE_LEASE_SECONDS: float = 60.0
+    CASCADE_DELETE_RESCAN_SECONDS: float = 30.0
+    CASCADE_DELETE_MAX_ATTEMPTS: int = 5
+    CASCADE_DELETE_RETRY_BACKOFF_SECONDS: float = 5.0
+    CHANGE_STREAM_ENABLED: bool = True
+    CHANGE_STREAM_NAME: Optional[str] = None
+    CHANGE_STREAM_RETRY_SECONDS: float = 30.0
+    CHANGE_STREAM_CHECKPOINT_SECONDS: float = 5.0
+    ORGANIZATION_TEXT_SEARCH: bool = False
+    CHANGE_FEED_RETENTION_DAYS: int = 30
+
+
+@lru_cache(maxsize=None)
+def get_env() -> Env:
+    # Settings are parsed once per process and shared by every module
+    return Env()
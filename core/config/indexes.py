@@ -0,0 +1,212 @@
+import argparse
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+from core.config.database import AsyncOrganizationDatabase, OrganizationDatabase
+from core.config.env import get_env
+from core.services.organization import OrganizationQueries
+from core.services.summary import SummaryQueries
+from core.utils.managers.roles import RoleQueries
+
+env = get_env()
+logger = logging.getLogger(__name__)
+
+
+# Declarative registry of the indexes every collection must carry
+INDEXES: Dict[str, List[IndexModel]] = {
+    'organization': [
+        # {'_id', 'ownerId'} update and delete filters are served by the _id index
+        IndexModel([('ownerId', ASCENDING)], name='ownerId'),
+        # Change feed range scans
+        IndexModel([('updatedAt', ASCENDING)], name='updatedAt'),
+    ],
+    'organization_member': [
+        # One membership per (memberId, organizationId)
+        IndexModel([('memberId', ASCENDING), ('organizationId', ASCENDING)],
+                   name='memberId_organizationId', unique=True),
+        IndexModel([('organizationId', ASCENDING), ('ownerId', ASCENDING)],
+                   name='organizationId_ownerId'),
+        # Cascade delete walks an organization's memberships in _id order
+        IndexModel([('organizationId', ASCENDING), ('_id', ASCENDING)],
+                   name='organizationId_id'),
+        # Name search walks one member's memberships in (nameNormalized, organizationId) order
+        IndexModel([('memberId', ASCENDING), ('nameNormalized', ASCENDING), ('organizationId', ASCENDING)],
+                   name='memberId_nameNormalized_organizationId'),
+    ],
+    'role': [
+        # One role of a given name per organization
+        IndexModel([('organizationId', ASCENDING), ('name', ASCENDING)],
+                   name='organizationId_name', unique=True),
+    ],
+    'role_assigned': [
+        # has_permission triple-key lookup, also serves lookups by toId
+        IndexModel([('toId', ASCENDING), ('organizationId', ASCENDING), ('roleId', ASCENDING)],
+                   name='toId_organizationId_roleId', unique=True),
+        IndexModel([('roleId', ASCENDING)], name='roleId'),
+        IndexModel([('organizationId', ASCENDING), ('_id', ASCENDING)],
+                   name='organizationId_id'),
+    ],
+    'member_summary': [
+        # Incremental maintenance finds every summary embedding an organization or role
+        IndexModel([('organizations._id', ASCENDING)], name='organizations_id'),
+        IndexModel([('roles._id', ASCENDING)], name='roles_id'),
+    ],
+    'job': [
+        # Unfinished jobs are looked up on startup
+        IndexModel([('type', ASCENDING), ('status', ASCENDING)], name='type_status'),
+    ],
+    'removal': [
+        # Change feed: one member's removals within a time window
+        IndexModel([('memberId', ASCENDING), ('removedAt', ASCENDING)], name='memberId_removedAt'),
+        IndexModel([('removedAt', ASCENDING)], name='removedAt_ttl',
+                   expireAfterSeconds=env.CHANGE_FEED_RETENTION_DAYS * 24 * 60 * 60),
+    ],
+}
+
+if env.ORGANIZATION_TEXT_SEARCH:
+    # Full-word search, scoped by the memberId equality prefix; names are not stemmed
+    INDEXES['organization_member'].append(
+        IndexModel([('memberId', ASCENDING), ('nameNormalized', TEXT)],
+                   name='memberId_nameNormalized_text', default_language='none'))
+
+
+def service_queries() -> Iterator[Tuple[str, Dict[str, Any]]]:
+    # Representative filters issued by OrganizationService and RoleManager
+    member_id, organization_id, role_id = ObjectId(), ObjectId(), ObjectId()
+    yield 'organization', {'_id': organization_id}
+    yield 'organization', {'_id': organization_id, 'ownerId': member_id}
+    yield 'organization_member', {'memberId': member_id}
+    yield 'organization_member', {'memberId': member_id, 'organizationId': organization_id}
+    yield 'organization_member', {'ownerId': member_id, 'organizationId': organization_id}
+    yield 'role', {'_id': role_id, 'organizationId': organization_id}
+    yield 'role', {'organizationId': organization_id, 'name': {'$in': ['admin', 'manager', 'user']}}
+    yield 'role_assigned', {'toId': member_id}
+    yield 'role_assigned', {'toId': member_id, 'organizationId': organization_id}
+    yield 'role_assigned', {'toId': member_id, 'organizationId': organization_id, 'roleId': role_id}
+    yield 'role_assigned', {'toId': member_id, 'roleId': role_id}
+    yield 'role_assigned', {'roleId': role_id}
+    yield 'organization_member', {'organizationId': organization_id, '_id': {'$gt': member_id}}
+    yield 'role_assigned', {'organizationId': organization_id, '_id': {'$gt': role_id}}
+    yield 'organization', {'updatedAt': {'$gt': datetime(1970, 1, 1)}}
+    yield 'role', {'_id': {'$in': [role_id]}, 'updatedAt': {'$gt': datetime(1970, 1, 1)}}
+    yield 'organization_member', {'memberId': member_id, 'nameNormalized': {'$regex': '^acme'}}
+    yield 'job', {'type': 'cascade_delete', 'status': {'$in': ['pending', 'running']}}
+    yield 'member_summary', {'_id': str(member_id)}
+    yield 'member_summary', {'organizations._id': str(organization_id)}
+    yield 'member_summary', {'roles._id': str(role_id)}
+    yield 'removal', {'memberId': member_id, 'removedAt': {'$gt': datetime(1970, 1, 1)}}
+
+
+def service_aggregations() -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    # The $lookup pipelines behind organization lists, role lookups, permission checks and summary rebuilds
+    member_id, organization_id = ObjectId(), ObjectId()
+    organizations, roles, summaries = OrganizationQueries(), RoleQueries(), SummaryQueries()
+    yield 'organization_member', organizations._read_all_pipeline(member_id, 50)
+    yield 'organization_member', organizations._read_all_pipeline(member_id, 50, organization_id)
+    yield 'role_assigned', roles._role_pipeline(roles._assignment_match([member_id], None))
+    yield 'role_assigned', roles._role_pipeline(roles._assignment_match([member_id], organization_id))
+    yield 'role_assigned', roles._effective_permissions_pipeline(member_id, organization_id)
+    yield 'role_assigned', roles._effective_permissions_many_pipeline([(str(member_id), str(organization_id))])
+    yield 'organization_member', summaries._organizations_pipeline({'memberId': {'$in': [member_id]}})
+    yield 'role_assigned', summaries._roles_pipeline({'toId': {'$in': [member_id]}})
+
+
+def _index_failed(collection_name: str, index: IndexModel, error: OperationFailure) -> str:
+    # e.g. a unique index over data that still holds duplicates; run the dedupe migration and restart
+    name = f"{collection_name}.{index.document['name']}"
+    logger.error('Could not build index %s: %s', name, error)
+    return name
+
+
+def apply_indexes() -> List[str]:
+    # create_indexes is a no-op for indexes that already exist with the same spec. Indexes are built
+    # one at a time so one that cannot be built does not hold back the rest; failures are returned.
+    database = OrganizationDatabase().db
+    failures = []
+    for collection_name, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                database[collection_name].create_indexes([index])
+            except OperationFailure as e:
+                failures.append(_index_failed(collection_name, index, e))
+    return failures
+
+
+async def apply_indexes_async() -> List[str]:
+    database = AsyncOrganizationDatabase().db
+    failures = []
+    for collection_name, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                await database[collection_name].create_indexes([index])
+            except OperationFailure as e:
+                failures.append(_index_failed(collection_name, index, e))
+    return failures
+
+
+def _plan_problems(plan: Dict[str, Any]) -> Iterator[str]:
+    # Collection scans, in-memory sorts, and $lookups pushed down to the slot-based engine that
+    # scan the joined collection instead of probing its index
+    stage = plan.get('stage')
+    if stage in ('COLLSCAN', 'SORT'):
+        yield stage
+    elif stage == 'EQ_LOOKUP' and plan.get('strategy') != 'IndexedLoopJoin':
+        yield f"EQ_LOOKUP {plan.get('strategy')}"
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from _plan_problems(plan[key])
+    for child in plan.get('inputStages', []):
+        yield from _plan_problems(child)
+
+
+def _winning_plans(explanation: Any) -> Iterator[Dict[str, Any]]:
+    # find() puts the plan under queryPlanner; aggregations put it there when pushed down, or
+    # under the $cursor stage when run by the classic engine
+    if isinstance(explanation, dict):
+        for key, value in explanation.items():
+            if key == 'winningPlan':
+                yield value
+            else:
+                yield from _winning_plans(value)
+    elif isinstance(explanation, list):
+        for value in explanation:
+            yield from _winning_plans(value)
+
+
+def verify_indexes() -> List[str]:
+    # Explain every service query and aggregation and report the plans that do not use an index
+    database = OrganizationDatabase().db
+    failures = []
+    for collection_name, query in service_queries():
+        explanation = database[collection_name].find(query).explain()
+        for problem in dict.fromkeys(problem for plan in _winning_plans(explanation) for problem in _plan_problems(plan)):
+            failures.append(f'{problem} {collection_name}: {query}')
+    for collection_name, pipeline in service_aggregations():
+        explanation = database.command('explain', {'aggregate': collection_name, 'pipeline': pipeline, 'cursor': {}},
+                                       verbosity='queryPlanner')
+        for problem in dict.fromkeys(problem for plan in _winning_plans(explanation) for problem in _plan_problems(plan)):
+            failures.append(f'{problem} {collection_name}: {pipeline}')
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Apply and verify organization_db indexes')
+    parser.add_argument('--verify', action='store_true',
+                        help='explain() each service query and aggregation and fail on COLLSCAN or in-memory SORT')
+    args = parser.parse_args()
+
+    if apply_indexes():
+        raise SystemExit(1)
+    if args.verify:
+        failures = verify_indexes()
+        for failure in failures:
+            print(failure)
+        if failures:
+            raise SystemExit(1)
+        print('All service queries and aggregations use an index')
@@ -0,0 +1,18 @@
+from typing import Any, Dict, List
+from pydantic import BaseModel
+
+
+class AuthSyncSnapshot(BaseModel):
+    userId: str
+    version: int
+    organizations: List[Dict[str, Any]] = []
+    roles: List[Dict[str, Any]] = []
+
+
+class AuthSyncChangeSet(BaseModel):
+    userId: str
+    version: int
+    upsertedOrganizations: List[Dict[str, Any]] = []
+    removedOrganizationIds: List[str] = []
+    addedRoles: List[Dict[str, Any]] = []
+    removedRoleIds: List[str] = []
@@ -0,0 +1,8 @@
+from typing import Optional
+from pydantic import BaseModel
+
+
+class BatchItemResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    error: Optional[str] = None
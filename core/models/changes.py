@@ -0,0 +1,37 @@
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel, Field
+from quest_maker_api_shared_library.custom_types import PydanticObjectId
+
+from core.models.organization import OrganizationResponse
+from core.models.roles import RoleResponse
+
+
+class MembershipChange(BaseModel):
+    organizationId: PydanticObjectId = Field(alias='organizationId')
+    createdAt: datetime
+
+
+class AssignmentChange(BaseModel):
+    roleId: PydanticObjectId = Field(alias='roleId')
+    organizationId: PydanticObjectId = Field(alias='organizationId')
+    createdAt: datetime
+
+
+class Removal(BaseModel):
+    # 'organization' or 'role'; documentId is the removed organization's or role's id
+    type: str
+    documentId: PydanticObjectId = Field(alias='documentId')
+    organizationId: PydanticObjectId = Field(alias='organizationId')
+    removedAt: datetime
+
+
+class OrganizationChanges(BaseModel):
+    since: Optional[datetime] = None
+    # Pass back as `since` to continue from where this response stopped
+    cursor: datetime
+    organizations: List[OrganizationResponse] = []
+    memberships: List[MembershipChange] = []
+    roles: List[RoleResponse] = []
+    assignments: List[AssignmentChange] = []
+    removed: List[Removal] = []
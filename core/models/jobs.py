@@ -0,0 +1,15 @@
+from datetime import datetime
+from typing import Dict, Optional
+from pydantic import BaseModel, Field
+from quest_maker_api_shared_library.custom_types import PydanticObjectId
+
+
+class CascadeDeleteJob(BaseModel):
+    id: PydanticObjectId = Field(alias='_id')
+    organizationId: PydanticObjectId = Field(alias='organizationId')
+    status: str
+    stage: str
+    deleted: Dict[str, int] = {}
+    error: Optional[str] = None
+    createdAt: datetime
+    updatedAt: datetime
@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import Optional
 from pydantic import BaseModel, Field
 from quest_maker_api_shared_library.custom_types import PydanticObjectId
@@ -18,26 +19,35 @@ class OrganizationResponse(BaseModel):
     name: str
     description: Optional[str]
     ownerId: PydanticObjectId = Field(alias='ownerId')
-    createdAt: str
-    updatedAt: str
+    createdAt: datetime
+    updatedAt: datetime
 
 
 class OrganizationInDB(BaseModel):
     name: str
     description: Optional[str]
     ownerId: PydanticObjectId = Field(alias='ownerId')
-    createdAt: str
-    updatedAt: str
+    createdAt: datetime
+    updatedAt: datetime
 
 
 class OrganizationOutDB(OrganizationInDB):
     pass
 
 
+class OrganizationSearchResult(BaseModel):
+    id: PydanticObjectId = Field(alias='_id')
+    name: str
+
+
 class OrganizationMemberInDB(BaseModel):
     organizationId: PydanticObjectId = Field(alias='organizationId')
     ownerId: PydanticObjectId = Field(alias='ownerId')
     memberId: PydanticObjectId = Field(alias='memberId')
+    # Copied from the organization so name search is answered from the caller's memberships alone
+    organizationName: str
+    nameNormalized: str
+    createdAt: datetime
 
 
 class OrganizationMemberOutDB(OrganizationMemberInDB):
@@ -0,0 +1,15 @@
+from typing import Optional
+from pydantic import BaseModel, Field
+from quest_maker_api_shared_library.custom_types import PydanticObjectId
+
+
+class PermissionCheck(BaseModel):
+    userId: PydanticObjectId = Field(alias='userId')
+    organizationId: PydanticObjectId = Field(alias='organizationId')
+    permission: str
+
+
+class PermissionCheckResult(BaseModel):
+    index: int
+    allowed: bool = False
+    error: Optional[str] = None
@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import List, Optional
 from pydantic import BaseModel, Field
 from quest_maker_api_shared_library.custom_types import PydanticObjectId
@@ -8,8 +9,9 @@ class RoleCreate(BaseModel):
     organizationId: PydanticObjectId = Field(alias='organizationId')
     description: Optional[str]
     permissions: List[str] = []
-    createdAt: str
-    updatedAt: str
+    permissionMask: int = 0
+    createdAt: datetime
+    updatedAt: datetime
 
 
 class RoleUpdate(RoleCreate):
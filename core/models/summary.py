@@ -0,0 +1,23 @@
+from datetime import datetime
+from typing import List
+from pydantic import BaseModel, Field
+from quest_maker_api_shared_library.custom_types import PydanticObjectId
+
+
+class OrganizationSummary(BaseModel):
+    id: PydanticObjectId = Field(alias='_id')
+    name: str
+    ownerId: PydanticObjectId = Field(alias='ownerId')
+    updatedAt: datetime
+
+
+class RoleSummary(BaseModel):
+    id: PydanticObjectId = Field(alias='_id')
+    name: str
+    organizationId: PydanticObjectId = Field(alias='organizationId')
+
+
+class MemberSummary(BaseModel):
+    memberId: PydanticObjectId = Field(alias='_id')
+    organizations: List[OrganizationSummary] = []
+    roles: List[RoleSummary] = []
@@ -0,0 +1,316 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from quest_maker_api_shared_library.custom_types import PydanticObjectId
+
+from core.config.database import AsyncOrganizationDatabase, OrganizationDatabase
+from core.config.env import get_env
+from core.errors.database import DocumentNotFoundError
+from core.models.jobs import CascadeDeleteJob
+from core.services.organization import AsyncOrganizationService, OrganizationService
+from core.services.summary import AsyncMemberSummaryService, MemberSummaryService
+from core.utils.managers.roles import RoleQueries
+
+env = get_env()
+logger = logging.getLogger(__name__)
+db = OrganizationDatabase()
+async_db = AsyncOrganizationDatabase()
+
+# Collections emptied of an organization's documents, in order. Assignments go before the
+# roles they reference; summaries are cleaned last with a single indexed update.
+CASCADE_STAGES = ('organization_member', 'role_assigned', 'role', 'member_summary')
+BATCH_PROJECTIONS = {'organization_member': {'memberId': 1},
+                     'role_assigned': {'toId': 1, 'organizationId': 1, 'roleId': 1},
+                     'role': {'_id': 1}}
+# Left by a job whose request failed before deleting the organization
+ORGANIZATION_NOT_DELETED = 'Organization was not deleted'
+
+JOB_RESPONSE_PROJECTION = {'_id': {'$toString': '$_id'}, 'organizationId': {'$toString': '$organizationId'},
+                           'status': 1, 'stage': 1, 'deleted': 1, 'error': 1, 'createdAt': 1, 'updatedAt': 1}
+
+
+class JobStatus:
+    pending = 'pending'
+    running = 'running'
+    completed = 'completed'
+    failed = 'failed'
+
+
+class CascadeDeleteQueries(RoleQueries):
+    # Job documents record the current stage and the last _id deleted in it, so a job
+    # picked up again after a restart continues from its last finished batch
+    def _new_job(self, owner_id: PydanticObjectId, organization_id: PydanticObjectId) -> Dict[str, Any]:
+        # Inserted before the organization is deleted and leased to that request until it is gone,
+        # so an organization is never removed without a job left to clean up after it
+        timestamp = datetime.utcnow()
+        return {'type': 'cascade_delete', 'ownerId': ObjectId(owner_id), 'organizationId': ObjectId(organization_id),
+                'status': JobStatus.pending, 'stage': CASCADE_STAGES[0], 'lastId': None,
+                'deleted': {stage: 0 for stage in CASCADE_STAGES}, 'error': None, 'leaseUntil': self._lease_until(),
+                'attempts': 0, 'createdAt': timestamp, 'updatedAt': timestamp}
+
+    def _claim_filter(self, job_id: ObjectId) -> Dict[str, Any]:
+        # A job is run by one worker at a time; the lease lapses if that worker dies
+        return {'_id': ObjectId(job_id), 'status': {'$in': [JobStatus.pending, JobStatus.running]},
+                '$or': [{'leaseUntil': None}, {'leaseUntil': {'$lt': datetime.utcnow()}}]}
+
+    def _lease_until(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=env.CASCADE_DELETE_LEASE_SECONDS)
+
+    def _claim_update(self) -> Dict[str, Any]:
+        return {'$set': {'status': JobStatus.running, 'leaseUntil': self._lease_until(),
+                         'updatedAt': datetime.utcnow()}}
+
+    def _resumable_filter(self) -> Dict[str, Any]:
+        return {'type': 'cascade_delete', 'status': {'$in': [JobStatus.pending, JobStatus.running]},
+                '$or': [{'leaseUntil': None}, {'leaseUntil': {'$lt': datetime.utcnow()}}]}
+
+    def _batch_filter(self, organization_id: ObjectId, last_id: Optional[ObjectId]) -> Dict[str, Any]:
+        match = {'organizationId': organization_id}
+        if last_id:
+            match['_id'] = {'$gt': last_id}
+        return match
+
+    def _release_update(self) -> Dict[str, Any]:
+        # Jobs interrupted by a clean shutdown can be claimed again at once, without waiting out the lease
+        return {'$set': {'leaseUntil': None, 'updatedAt': datetime.utcnow()}}
+
+    def _progress_update(self, stage: str, next_stage: str, last_id: Optional[ObjectId], deleted: int) -> Dict[str, Any]:
+        # attempts counts consecutive failures, so a job that keeps making progress is never given up on
+        return {'$set': {'stage': next_stage, 'lastId': last_id, 'leaseUntil': self._lease_until(),
+                         'attempts': 0, 'updatedAt': datetime.utcnow()},
+                '$inc': {f'deleted.{stage}': deleted}}
+
+    def _failure_update(self, job: Dict[str, Any], error: str) -> Dict[str, Any]:
+        # A failed job keeps its progress and is leased out for an exponential backoff, after which the
+        # next scan resumes it; it is only marked failed once it has run out of attempts
+        attempts = job.get('attempts', 0) + 1
+        if attempts >= env.CASCADE_DELETE_MAX_ATTEMPTS:
+            return self._finish_update(JobStatus.failed, error)
+        backoff = env.CASCADE_DELETE_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+        return {'$set': {'error': error, 'attempts': attempts, 'leaseUntil': datetime.utcnow() + timedelta(seconds=backoff),
+                         'updatedAt': datetime.utcnow()}}
+
+    def _finish_update(self, status: str, error: Optional[str] = None) -> Dict[str, Any]:
+        return {'$set': {'status': status, 'error': error, 'leaseUntil': None, 'updatedAt': datetime.utcnow()}}
+
+    def _next_stage(self, stage: str) -> str:
+        index = CASCADE_STAGES.index(stage) + 1
+        return CASCADE_STAGES[index] if index < len(CASCADE_STAGES) else JobStatus.completed
+
+    def _invalidate_assignments(self, assignments: List[Dict[str, Any]]) -> None:
+        for assignment in assignments:
+            self._invalidate_permissions(assignment['toId'], assignment['organizationId'])
+
+
+class CascadeDeleteJobs(CascadeDeleteQueries):
+    # Blocking runner for scripts: enqueue() runs the whole job before returning
+    def __init__(self) -> None:
+        self.service = OrganizationService()
+        self.summaries = MemberSummaryService()
+
+    def delete_organization(self, owner_id: PydanticObjectId, organization_id: PydanticObjectId) -> str:
+        try:
+            job = self._new_job(owner_id, organization_id)
+            db.job_collection.insert_one(job)
+            try:
+                self.service.delete(owner_id=owner_id, organization_id=organization_id)
+            except DocumentNotFoundError:
+                db.job_collection.delete_one({'_id': job['_id']})
+                raise
+            db.job_collection.update_one({'_id': job['_id']}, self._release_update())
+            self.run(job['_id'])
+            return str(job['_id'])
+        except Exception as e:
+            raise e
+
+    def _delete_batch(self, stage: str, organization_id: ObjectId, last_id: Optional[ObjectId]) -> Tuple[int, Optional[ObjectId], bool]:
+        documents = list(db.db[stage].find(self._batch_filter(organization_id, last_id), BATCH_PROJECTIONS[stage])
+                         .sort('_id', 1).limit(env.CASCADE_DELETE_BATCH_SIZE))
+        if not documents:
+            return 0, last_id, True
+        result = db.db[stage].delete_many({'_id': {'$in': [document['_id'] for document in documents]}})
+        if stage == 'organization_member':
+            self.service.bump_membership_versions([document['memberId'] for document in documents])
+        elif stage == 'role_assigned':
+            self._invalidate_assignments(documents)
+            self.summaries.remove_roles(documents)
+        return result.deleted_count, documents[-1]['_id'], len(documents) < env.CASCADE_DELETE_BATCH_SIZE
+
+    def run(self, job_id: ObjectId) -> None:
+        job = db.job_collection.find_one_and_update(
+            self._claim_filter(job_id), self._claim_update(), return_document=ReturnDocument.AFTER)
+        if job is None:
+            return
+        if db.organization_collection.count_documents({'_id': job['organizationId']}, limit=1):
+            db.job_collection.update_one({'_id': job['_id']}, self._finish_update(JobStatus.failed, ORGANIZATION_NOT_DELETED))
+            return
+        try:
+            stage, last_id = job['stage'], job['lastId']
+            while stage != JobStatus.completed:
+                if stage == 'member_summary':
+                    self.summaries.remove_organization(job['organizationId'])
+                    deleted, done = 0, True
+                else:
+                    deleted, last_id, done = self._delete_batch(stage, job['organizationId'], last_id)
+                next_stage = self._next_stage(stage) if done else stage
+                last_id = None if done else last_id
+                db.job_collection.update_one({'_id': job['_id']}, self._progress_update(stage, next_stage, last_id, deleted))
+                job['attempts'] = 0
+                stage = next_stage
+            db.job_collection.update_one({'_id': job['_id']}, self._finish_update(JobStatus.completed))
+        except Exception as e:
+            db.job_collection.update_one({'_id': job['_id']}, self._failure_update(job, str(e)))
+            raise e
+
+    def read(self, owner_id: PydanticObjectId, job_id: PydanticObjectId) -> CascadeDeleteJob:
+        try:
+            document = db.job_collection.find_one(
+                {'_id': ObjectId(job_id), 'ownerId': ObjectId(owner_id)}, JOB_RESPONSE_PROJECTION)
+            if document is None:
+                raise DocumentNotFoundError
+            return CascadeDeleteJob.model_validate(document)
+        except Exception as e:
+            raise e
+
+
+class AsyncCascadeDeleteJobs(CascadeDeleteQueries):
+    # Runs jobs as background tasks, pausing between batches so request traffic is not starved
+    def __init__(self) -> None:
+        self.service = AsyncOrganizationService()
+        self.summaries = AsyncMemberSummaryService()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._scanner: Optional[asyncio.Task] = None
+
+    async def delete_organization(self, owner_id: PydanticObjectId, organization_id: PydanticObjectId) -> str:
+        # If the delete fails for any other reason the job stays behind; once its lease lapses a scan
+        # runs it, and it only removes anything if the organization turns out to be gone
+        try:
+            job = self._new_job(owner_id, organization_id)
+            await async_db.job_collection.insert_one(job)
+            try:
+                await self.service.delete(owner_id=owner_id, organization_id=organization_id)
+            except DocumentNotFoundError:
+                await async_db.job_collection.delete_one({'_id': job['_id']})
+                raise
+            await async_db.job_collection.update_one({'_id': job['_id']}, self._release_update())
+            self._start(job['_id'])
+            return str(job['_id'])
+        except Exception as e:
+            raise e
+
+    def _start(self, job_id: ObjectId) -> None:
+        key = str(job_id)
+        if key in self._tasks:
+            return
+        task = asyncio.create_task(self.run(job_id))
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+
+    async def resume(self) -> int:
+        # Pick up jobs left unfinished by a worker that stopped or died
+        try:
+            job_ids = await async_db.job_collection.distinct('_id', self._resumable_filter())
+            for job_id in job_ids:
+                self._start(job_id)
+            return len(job_ids)
+        except Exception as e:
+            raise e
+
+    def start(self) -> None:
+        # Resume unfinished jobs now, then keep picking up jobs whose lease lapsed because
+        # the worker running them died while this one stayed up
+        if self._scanner is None:
+            self._scanner = asyncio.create_task(self._scan())
+
+    async def _scan(self) -> None:
+        while True:
+            try:
+                await self.resume()
+            except PyMongoError as e:
+                logger.warning('Could not scan for unfinished cascade deletes: %s', e)
+            await asyncio.sleep(env.CASCADE_DELETE_RESCAN_SECONDS)
+
+    async def stop(self) -> None:
+        # Interrupted jobs keep their progress and have their lease released, so the next
+        # worker to scan resumes them straight away
+        if self._scanner is not None:
+            self._scanner.cancel()
+            await asyncio.gather(self._scanner, return_exceptions=True)
+            self._scanner = None
+        job_ids = [ObjectId(job_id) for job_id in self._tasks]
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if job_ids:
+            try:
+                await async_db.job_collection.update_many(
+                    {'_id': {'$in': job_ids}, 'status': JobStatus.running}, self._release_update())
+            except PyMongoError as e:
+                logger.warning('Could not release cascade delete leases, they lapse on their own: %s', e)
+
+    async def _delete_batch(self, stage: str, organization_id: ObjectId, last_id: Optional[ObjectId]) -> Tuple[int, Optional[ObjectId], bool]:
+        documents = await async_db.db[stage].find(self._batch_filter(organization_id, last_id), BATCH_PROJECTIONS[stage]) \
+            .sort('_id', 1).limit(env.CASCADE_DELETE_BATCH_SIZE).to_list(length=None)
+        if not documents:
+            return 0, last_id, True
+        result = await async_db.db[stage].delete_many({'_id': {'$in': [document['_id'] for document in documents]}})
+        if stage == 'organization_member':
+            await self.service.bump_membership_versions([document['memberId'] for document in documents])
+        elif stage == 'role_assigned':
+            self._invalidate_assignments(documents)
+            await self.summaries.remove_roles(documents)
+        return result.deleted_count, documents[-1]['_id'], len(documents) < env.CASCADE_DELETE_BATCH_SIZE
+
+    async def run(self, job_id: ObjectId) -> None:
+        job = await async_db.job_collection.find_one_and_update(
+            self._claim_filter(job_id), self._claim_update(), return_document=ReturnDocument.AFTER)
+        if job is None:
+            return
+        if await async_db.organization_collection.count_documents({'_id': job['organizationId']}, limit=1):
+            await async_db.job_collection.update_one(
+                {'_id': job['_id']}, self._finish_update(JobStatus.failed, ORGANIZATION_NOT_DELETED))
+            return
+        started = time.monotonic()
+        try:
+            stage, last_id = job['stage'], job['lastId']
+            while stage != JobStatus.completed:
+                if stage == 'member_summary':
+                    await self.summaries.remove_organization(job['organizationId'])
+                    deleted, done = 0, True
+                else:
+                    deleted, last_id, done = await self._delete_batch(stage, job['organizationId'], last_id)
+                next_stage = self._next_stage(stage) if done else stage
+                last_id = None if done else last_id
+                await async_db.job_collection.update_one(
+                    {'_id': job['_id']}, self._progress_update(stage, next_stage, last_id, deleted))
+                job['attempts'] = 0
+                stage = next_stage
+                await asyncio.sleep(env.CASCADE_DELETE_PAUSE_SECONDS)
+            await async_db.job_collection.update_one({'_id': job['_id']}, self._finish_update(JobStatus.completed))
+            logger.info('Cascade delete of organization %s finished in %.1fs',
+                        job['organizationId'], time.monotonic() - started)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception('Cascade delete of organization %s failed', job['organizationId'])
+            await async_db.job_collection.update_one({'_id': job['_id']}, self._failure_update(job, str(e)))
+
+    async def read(self, owner_id: PydanticObjectId, job_id: PydanticObjectId) -> CascadeDeleteJob:
+        try:
+            document = await async_db.job_collection.find_one(
+                {'_id': ObjectId(job_id), 'ownerId': ObjectId(owner_id)}, JOB_RESPONSE_PROJECTION)
+            if document is None:
+                raise DocumentNotFoundError
+            return CascadeDeleteJob.model_validate(document)
+        except Exception as e:
+            raise e
+
+
+cascade_jobs = AsyncCascadeDeleteJobs()
@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from bson import ObjectId
+from quest_maker_api_shared_library.custom_types import PydanticObjectId
+
+from core.config.database import AsyncOrganizationDatabase
+from core.models.changes import AssignmentChange, MembershipChange, OrganizationChanges, Removal
+from core.services.organization import ORGANIZATION_RESPONSE_PROJECTION, AsyncOrganizationService
+from core.utils.managers.roles import ROLE_RESPONSE_PROJECTION, AsyncRoleManager
+
+async_db = AsyncOrganizationDatabase()
+
+# The cursor trails the clock so writes still in flight when a feed is read land inside the next window
+SETTLE_SECONDS = 1.0
+REMOVAL_PROJECTION = {'_id': 0, 'type': 1, 'documentId': {'$toString': '$documentId'},
+                      'organizationId': {'$toString': '$organizationId'}, 'removedAt': 1}
+
+
+class ChangeFeed:
+    # Organizations, memberships and role assignments of a member that changed within (since, cursor], and
+    # the organizations and roles they lost. Removals are kept for CHANGE_FEED_RETENTION_DAYS; a client
+    # further behind than that has to start over without `since`.
+    def __init__(self) -> None:
+        self.service = AsyncOrganizationService()
+        self.role_manager = AsyncRoleManager()
+
+    def _utc(self, timestamp: datetime) -> datetime:
+        # BSON datetimes come back naive in UTC; compare client timestamps the same way
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        return timestamp
+
+    def _cursor(self, since: Optional[datetime]) -> datetime:
+        # Millisecond precision, as stored, and never behind the window already served
+        until = datetime.utcnow() - timedelta(seconds=SETTLE_SECONDS)
+        until = until.replace(microsecond=until.microsecond // 1000 * 1000)
+        return max(until, since) if since else until
+
+    def _in_window(self, timestamp: Optional[datetime], since: Optional[datetime], until: datetime) -> bool:
+        return timestamp is not None and (since is None or timestamp > since) and timestamp <= until
+
+    def _window(self, since: Optional[datetime], until: datetime) -> Dict[str, Any]:
+        window = {'$lte': until}
+        if since:
+            window['$gt'] = since
+        return window
+
+    async def changes_since(self, member_id: PydanticObjectId, since: Optional[datetime] = None) -> OrganizationChanges:
+        try:
+            since = self._utc(since) if since else None
+            until = self._cursor(since)
+            window = self._window(since, until)
+
+            memberships, assignments = await asyncio.gather(
+                async_db.organization_member_collection.find(
+                    {'memberId': ObjectId(member_id)}, {'_id': 0, 'organizationId': 1, 'createdAt': 1}).to_list(length=None),
+                async_db.role_assigned.find(
+                    {'toId': ObjectId(member_id)}, {'_id': 0, 'roleId': 1, 'organizationId': 1, 'createdAt': 1}).to_list(length=None))
+            organization_ids = [membership['organizationId'] for membership in memberships]
+            joined = [membership for membership in memberships
+                      if self._in_window(membership.get('createdAt'), since, until)]
+            role_ids = [assignment['roleId'] for assignment in assignments]
+            granted = [assignment for assignment in assignments
+                       if self._in_window(assignment.get('createdAt'), since, until)]
+
+            # Newly joined organizations and newly granted roles are returned whole, whenever they were last modified
+            organizations, roles, removed = await asyncio.gather(
+                async_db.organization_collection.find(
+                    {'$or': [{'_id': {'$in': [membership['organizationId'] for membership in joined]}},
+                             {'_id': {'$in': organization_ids}, 'updatedAt': window}]},
+                    ORGANIZATION_RESPONSE_PROJECTION).sort('_id').to_list(length=None),
+                async_db.role_collection.find(
+                    {'$or': [{'_id': {'$in': [assignment['roleId'] for assignment in granted]}},
+                             {'_id': {'$in': role_ids}, 'updatedAt': window}]},
+                    ROLE_RESPONSE_PROJECTION).sort('_id').to_list(length=None),
+                async_db.removal_collection.find(
+                    {'memberId': ObjectId(member_id), 'removedAt': window},
+                    REMOVAL_PROJECTION).sort('removedAt').to_list(length=None))
+
+            return OrganizationChanges(
+                since=since,
+                cursor=until,
+                organizations=self.service._to_organization_responses(organizations),
+                memberships=[MembershipChange.model_validate(membership) for membership in joined],
+                roles=self.role_manager._to_role_responses(roles),
+                assignments=[AssignmentChange.model_validate(assignment) for assignment in granted],
+                removed=[Removal.model_validate(removal) for removal in removed]
+            )
+        except Exception as e:
+            raise e
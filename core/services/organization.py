@@ -1,114 +1,254 @@
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
 
 from bson import ObjectId
-from pymongo import ReturnDocument
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 from quest_maker_api_shared_library.custom_types import PydanticObjectId
 
 
-from core.config.env import Env
-from core.config.database import OrganizationDatabase
-from core.models.organization import OrganizationCreate, OrganizationResponse, OrganizationUpdate, OrganizationInDB
+from core.config.env import get_env
+from core.config.database import AsyncOrganizationDatabase, OrganizationDatabase
+from core.models.batch import BatchItemResult
+from core.models.organization import OrganizationCreate, OrganizationResponse, OrganizationSearchResult, OrganizationUpdate, OrganizationInDB
 from core.errors.database import DocumentNotFoundError
+from core.services.removals import AsyncRemovalLog, RemovalLog
+from core.services.summary import AsyncMemberSummaryService, MemberSummaryService
+from core.utils.cache import TTLCache
+from core.utils.metrics import registry
+from core.utils.search import normalize_name, prefix_pattern
+from core.utils.singleflight import SingleFlight
+from core.utils.serialization import validate_list
 
-env = Env()
+env = get_env()
 db = OrganizationDatabase()
+async_db = AsyncOrganizationDatabase()
+summaries = MemberSummaryService()
+async_summaries = AsyncMemberSummaryService()
+removals = RemovalLog()
+async_removals = AsyncRemovalLog()
 
+# Fields returned to clients for an organization document, with ids already converted to strings
+ORGANIZATION_RESPONSE_PROJECTION = {'_id': {'$toString': '$_id'}, 'name': 1, 'description': 1,
+                                    'ownerId': {'$toString': '$ownerId'}, 'createdAt': 1, 'updatedAt': 1}
+# Search results are served from memberships alone, which carry the organization's name
+SEARCH_RESULT_PROJECTION = {'_id': {'$toString': '$organizationId'}, 'name': '$organizationName'}
+SEARCH_SORT = [('nameNormalized', 1), ('organizationId', 1)]
 
-class OrganizationService:
+# Organization responses by id, shared by both services. Updates replace entries and deletes drop them.
+organization_cache = registry.register_cache('organizations', TTLCache(max_size=env.ORGANIZATION_CACHE_SIZE,
+                                                                       ttl=env.ORGANIZATION_CACHE_TTL_SECONDS))
+# In-flight reads shared by concurrent identical requests in this worker
+read_flights = SingleFlight('organization.read')
+read_all_flights = SingleFlight('organization.read_all')
+
+
+class SearchMode:
+    prefix = 'prefix'
+    word = 'word'
+
+
+class OrganizationQueries:
+    # Query builders shared by the blocking and asyncio services
+    def _new_organization(self, owner_id: PydanticObjectId, data: OrganizationCreate) -> Dict[str, Any]:
+        # Load data into OrganizationInDB container
+        timestamp = datetime.utcnow()
+        organization = OrganizationInDB(
+            name=data.name,
+            description=data.description,
+            ownerId=str(owner_id),
+            createdAt=timestamp,
+            updatedAt=timestamp
+        )
+
+        # Convert the OrganizationInDB container into a dict
+        return organization.model_dump()
+
+    def _new_membership(self, owner_id: PydanticObjectId, organization: Dict[str, Any], member_id: Optional[PydanticObjectId] = None) -> Dict[str, Any]:
+        # The owner is the member unless member_id names someone else
+        return {'ownerId': ObjectId(owner_id), 'memberId': ObjectId(member_id or owner_id),
+                'organizationId': ObjectId(organization['_id']), 'organizationName': organization['name'],
+                'nameNormalized': normalize_name(organization['name']), 'createdAt': datetime.utcnow()}
+
+    def _rename_update(self, name: str) -> Dict[str, Any]:
+        return {'$set': {'organizationName': name, 'nameNormalized': normalize_name(name)}}
+
+    def _search_filter(self, member_id: PydanticObjectId, query: str, mode: str,
+                       after: Optional[PydanticObjectId], after_name: Optional[str]) -> Dict[str, Any]:
+        match = {'memberId': ObjectId(member_id)}
+        if mode == SearchMode.word:
+            match['$text'] = {'$search': normalize_name(query)}
+        else:
+            match['nameNormalized'] = {'$regex': prefix_pattern(query)}
+        if after:
+            # Keyset pagination on (nameNormalized, organizationId), resuming after the previous page's last result
+            match.setdefault('nameNormalized', {})['$gte'] = after_name
+            match['$nor'] = [{'nameNormalized': after_name, 'organizationId': {'$lte': ObjectId(after)}}]
+        return match
+
+    def _membership_filter(self, member_id: PydanticObjectId, organization_id: PydanticObjectId) -> Dict[str, Any]:
+        return {'memberId': ObjectId(member_id), 'organizationId': ObjectId(organization_id)}
+
+    def _read_all_pipeline(self, member_id: PydanticObjectId, limit: Optional[int], after: Optional[PydanticObjectId] = None) -> List[Dict[str, Any]]:
+        # Join memberships to organizations in a single round trip, ordered by organization id
+        match = {'memberId': ObjectId(member_id)}
+        if after:
+            # Keyset pagination: resume after the last organization id of the previous page
+            match['organizationId'] = {'$gt': ObjectId(after)}
+        pipeline = [
+            {'$match': match},
+            {'$sort': {'organizationId': 1}},
+            {'$lookup': {'from': 'organization',
+                         'localField': 'organizationId',
+                         'foreignField': '_id',
+                         'as': 'organization'}},
+            {'$unwind': '$organization'},
+        ]
+        if limit:
+            # Limited after the join so memberships whose organization is already deleted (and
+            # awaiting the cascade job) do not shorten a page and end pagination early. The
+            # pipeline streams, so only the memberships needed to fill the page are joined.
+            pipeline.append({'$limit': limit})
+        pipeline += [
+            {'$replaceRoot': {'newRoot': '$organization'}},
+            {'$project': ORGANIZATION_RESPONSE_PROJECTION},
+        ]
+        return pipeline
+
+    def _update_document(self, data: Union[OrganizationUpdate, Dict[str, Any]]) -> Dict[str, Any]:
+        if isinstance(data, OrganizationUpdate):
+            data = data.model_dump(exclude_unset=True)
+
+        # Stamp updatedAt as a native BSON datetime
+        data['updatedAt'] = datetime.utcnow()
+        return {'$set': data}
+
+    def _version_updates(self, member_ids: List[PydanticObjectId]) -> List[UpdateOne]:
+        # A member's version changes whenever the organizations listed for them may have changed
+        return [UpdateOne({'_id': ObjectId(member_id)}, {'$inc': {'version': 1}}, upsert=True)
+                for member_id in member_ids]
+
+    def _owner_filter(self, owner_id: PydanticObjectId, organization_id: PydanticObjectId) -> Dict[str, Any]:
+        return {'_id': ObjectId(organization_id), 'ownerId': ObjectId(owner_id)}
+
+    def _create_results(self, organizations: List[Dict[str, Any]], failed: Dict[int, str]) -> List[BatchItemResult]:
+        return [BatchItemResult(index=index, error=failed[index]) if index in failed
+                else BatchItemResult(index=index, id=str(organization['_id']))
+                for index, organization in enumerate(organizations)]
+
+    def _write_errors(self, error: BulkWriteError) -> Dict[int, str]:
+        # Map the index of each failed document in an unordered insert_many to its error
+        return {write_error['index']: write_error['errmsg'] for write_error in error.details.get('writeErrors', [])}
+
+    def _to_organization_responses(self, documents) -> List[OrganizationResponse]:
+        # Documents fetched with ORGANIZATION_RESPONSE_PROJECTION validate as-is
+        return validate_list(OrganizationResponse, documents)
+
+    def _to_organization_response(self, document: Dict[str, Any]) -> OrganizationResponse:
+        # Load result into OrganizationResponse container
+        return OrganizationResponse(
+            _id=str(document['_id']),
+            name=document['name'],
+            description=document.get('description'),
+            ownerId=str(document['ownerId']),
+            createdAt=document['createdAt'],
+            updatedAt=document['updatedAt']
+        )
+
+
+class OrganizationService(OrganizationQueries):
     def create(self, owner_id: PydanticObjectId, data: OrganizationCreate) -> PydanticObjectId:
         try:
-            # Load data into OrganizationInDB container
-            organization = OrganizationInDB(
-                name=data.name,
-                description=data.description,
-                ownerId=str(owner_id),
-                createdAt=str(datetime.utcnow()),
-                updatedAt=str(datetime.utcnow())
-            )
-
-            # Convert the OrganizationInDB container into a dict
-            organization_dict = organization.model_dump()
+            organization_dict = self._new_organization(owner_id, data)
 
             # Create new organization instance in database collection
             document = db.organization_collection.insert_one(organization_dict)
             db.organization_member_collection.insert_one(
-                {'ownerId': ObjectId(owner_id), 'memberId': ObjectId(owner_id), 'organizationId': ObjectId(str(document.inserted_id))})
+                self._new_membership(owner_id, organization_dict))
+            self.bump_membership_versions([owner_id])
+            summaries.add_organizations(owner_id, [organization_dict])
 
             return str(document.inserted_id)
 
         except Exception as e:
             raise e
 
+    def create_many(self, owner_id: PydanticObjectId, data: List[OrganizationCreate]) -> List[BatchItemResult]:
+        try:
+            organizations = [self._new_organization(owner_id, item) for item in data]
+            failed = {}
+            if organizations:
+                try:
+                    db.organization_collection.insert_many(
+                        organizations, ordered=False)
+                except BulkWriteError as e:
+                    failed = self._write_errors(e)
+            memberships = [self._new_membership(owner_id, organization)
+                           for index, organization in enumerate(organizations) if index not in failed]
+            if memberships:
+                db.organization_member_collection.insert_many(
+                    memberships, ordered=False)
+                self.bump_membership_versions([owner_id])
+                summaries.add_organizations(owner_id, [organization for index, organization in enumerate(organizations)
+                                                       if index not in failed])
+            return self._create_results(organizations, failed)
+        except Exception as e:
+            raise e
+
     def read(self, member_id: Optional[PydanticObjectId], organization_id: PydanticObjectId) -> OrganizationResponse:
         try:
             if member_id:
                 association_document = db.organization_member_collection.find_one(
-                    {'member_id': ObjectId(member_id), 'organization_id': ObjectId(organization_id)})
-                if association_document:
-                    document = db.organization_collection.find_one(
-                        {'_id': ObjectId(organization_id), 'memberId': ObjectId(member_id)})
-                elif association_document is None:
+                    self._membership_filter(member_id, organization_id))
+                if association_document is None:
+                    raise DocumentNotFoundError
+            organization = organization_cache.get(str(organization_id))
+            if organization is None:
+                document = db.organization_collection.find_one(
+                    {'_id': ObjectId(organization_id)}, ORGANIZATION_RESPONSE_PROJECTION)
+                if document is None:
                     raise DocumentNotFoundError
-            # Convert ObjectId's to strings
-            document['_id'] = str(document['_id'])
-            document['ownerId'] = str(document['ownerId'])
-            return document
+                organization = OrganizationResponse.model_validate(document)
+                organization_cache.set(str(organization_id), organization)
+            return organization
         except Exception as e:
             raise e
 
-    def read_all(self, member_id: PydanticObjectId) -> List[OrganizationResponse]:
+    def read_all(self, member_id: PydanticObjectId, limit: Optional[int] = None, after: Optional[PydanticObjectId] = None) -> List[OrganizationResponse]:
         try:
-            association_documents = db.organization_member_collection.find(
-                {'memberId': ObjectId(member_id)})
+            documents = db.organization_member_collection.aggregate(
+                self._read_all_pipeline(member_id, limit, after))
+            return self._to_organization_responses(documents)
 
-            organization_ids = []
-            result = []
-
-            for association_document in association_documents:
-                organization_ids.append(
-                    str(association_document['organizationId']))
-
-            for organization_id in organization_ids:
-                document = db.organization_collection.find_one(
-                    {'_id': ObjectId(organization_id)})
-                if document:
-                    # Load result into OrganizationResponse container
-                    document = OrganizationResponse(
-                        _id=str(document['_id']),
-                        name=document['name'],
-                        description=document['description'],
-                        ownerId=str(document['ownerId']),
-                        createdAt=document['createdAt'],
-                        updatedAt=document['updatedAt']
-                    )
-                    result.append(document)
-            return result
+        except Exception as e:
+            raise e
 
+    def read_many(self, organization_ids: List[PydanticObjectId]) -> List[OrganizationResponse]:
+        try:
+            documents = db.organization_collection.find(
+                {'_id': {'$in': [ObjectId(organization_id) for organization_id in organization_ids]}},
+                ORGANIZATION_RESPONSE_PROJECTION).sort('_id')
+            return self._to_organization_responses(documents)
         except Exception as e:
             raise e
 
     def update(self, owner_id: PydanticObjectId, organization_id: PydanticObjectId, data: Union[OrganizationUpdate, Dict[str, Any]]):
         try:
-            if isinstance(data, OrganizationUpdate):
-                data = data.model_dump(exclude_unset=True)
-
-            # Update and convert date in updatedAt field to string
-            data['updatedAt'] = str(datetime.utcnow())
             # Find and update an organization instance
+            update = self._update_document(data)
             document = db.organization_collection.find_one_and_update(
-                {'_id': ObjectId(organization_id), 'ownerId': ObjectId(owner_id)}, {'$set': data}, return_document=ReturnDocument.AFTER)
+                self._owner_filter(owner_id, organization_id), update,
+                projection=ORGANIZATION_RESPONSE_PROJECTION, return_document=ReturnDocument.AFTER)
             if document:
-                # Load result into OrganizationResponse container
-                document = OrganizationResponse(
-                    _id=str(document['_id']),
-                    name=document['name'],
-                    description=document['description'],
-                    ownerId=str(document['ownerId']),
-                    createdAt=document['createdAt'],
-                    updatedAt=document['updatedAt']
-                )
-                return document
+                if update['$set'].get('name'):
+                    db.organization_member_collection.update_many(
+                        {'organizationId': ObjectId(organization_id)}, self._rename_update(update['$set']['name']))
+                organization = OrganizationResponse.model_validate(document)
+                organization_cache.set(str(organization_id), organization)
+                summaries.update_organization(document)
+                self.bump_membership_versions(db.organization_member_collection.distinct(
+                    'memberId', {'organizationId': ObjectId(organization_id)}))
+                return organization
             else:
                 raise DocumentNotFoundError
         except Exception as e:
@@ -116,10 +256,215 @@ class OrganizationService:
 
     def delete(self, owner_id: PydanticObjectId, organization_id: PydanticObjectId):
         try:
-            # Delete an organization instance using it's id and owner_id
-            db.organization_collection.delete_one(
-                {'_id': ObjectId(organization_id), 'ownerId': ObjectId(owner_id)})
-            db.organization_member_collection.delete_many(
-                {'ownerId': ObjectId(owner_id), 'organizationId': ObjectId(organization_id)})
+            # Delete an organization instance using it's id and owner_id. Members' list versions and
+            # summaries change now; the rows themselves are removed afterwards by a cascade delete job.
+            result = db.organization_collection.delete_one(
+                self._owner_filter(owner_id, organization_id))
+            if result.deleted_count == 0:
+                raise DocumentNotFoundError
+            organization_cache.invalidate(str(organization_id))
+            member_ids = db.organization_member_collection.distinct(
+                'memberId', {'organizationId': ObjectId(organization_id)})
+            self.bump_membership_versions(member_ids)
+            summaries.remove_organization(organization_id)
+            removals.record_organization(organization_id, member_ids)
+        except Exception as e:
+            raise e
+
+    def search(self, member_id: PydanticObjectId, query: str, mode: str = SearchMode.prefix, limit: int = 20,
+               after: Optional[PydanticObjectId] = None) -> List[OrganizationSearchResult]:
+        try:
+            after_name = None
+            if after:
+                membership = db.organization_member_collection.find_one(
+                    self._membership_filter(member_id, after), {'nameNormalized': 1})
+                if membership is None:
+                    raise DocumentNotFoundError
+                after_name = membership['nameNormalized']
+            documents = db.organization_member_collection.find(
+                self._search_filter(member_id, query, mode, after, after_name),
+                SEARCH_RESULT_PROJECTION).sort(SEARCH_SORT).limit(limit)
+            return validate_list(OrganizationSearchResult, documents)
+        except Exception as e:
+            raise e
+
+    def membership_version(self, member_id: PydanticObjectId) -> int:
+        try:
+            document = db.membership_version_collection.find_one({'_id': ObjectId(member_id)})
+            return document['version'] if document else 0
+        except Exception as e:
+            raise e
+
+    def bump_membership_versions(self, member_ids: List[PydanticObjectId]) -> None:
+        try:
+            if member_ids:
+                db.membership_version_collection.bulk_write(
+                    self._version_updates(member_ids), ordered=False)
+        except Exception as e:
+            raise e
+
+
+class AsyncOrganizationService(OrganizationQueries):
+    async def create(self, owner_id: PydanticObjectId, data: OrganizationCreate) -> PydanticObjectId:
+        try:
+            organization_dict = self._new_organization(owner_id, data)
+
+            # Create new organization instance in database collection
+            document = await async_db.organization_collection.insert_one(organization_dict)
+            await async_db.organization_member_collection.insert_one(
+                self._new_membership(owner_id, organization_dict))
+            await self.bump_membership_versions([owner_id])
+            await async_summaries.add_organizations(owner_id, [organization_dict])
+
+            return str(document.inserted_id)
+
+        except Exception as e:
+            raise e
+
+    async def create_many(self, owner_id: PydanticObjectId, data: List[OrganizationCreate]) -> List[BatchItemResult]:
+        try:
+            organizations = [self._new_organization(owner_id, item) for item in data]
+            failed = {}
+            if organizations:
+                try:
+                    await async_db.organization_collection.insert_many(
+                        organizations, ordered=False)
+                except BulkWriteError as e:
+                    failed = self._write_errors(e)
+            memberships = [self._new_membership(owner_id, organization)
+                           for index, organization in enumerate(organizations) if index not in failed]
+            if memberships:
+                await async_db.organization_member_collection.insert_many(
+                    memberships, ordered=False)
+                await self.bump_membership_versions([owner_id])
+                await async_summaries.add_organizations(owner_id, [organization for index, organization in enumerate(organizations)
+                                                                   if index not in failed])
+            return self._create_results(organizations, failed)
+        except Exception as e:
+            raise e
+
+    async def read(self, member_id: Optional[PydanticObjectId], organization_id: PydanticObjectId) -> OrganizationResponse:
+        return await read_flights.do((str(member_id), str(organization_id)),
+                                     lambda: self._read(member_id, organization_id))
+
+    async def _read(self, member_id: Optional[PydanticObjectId], organization_id: PydanticObjectId) -> OrganizationResponse:
+        try:
+            if member_id:
+                association_document = await async_db.organization_member_collection.find_one(
+                    self._membership_filter(member_id, organization_id))
+                if association_document is None:
+                    raise DocumentNotFoundError
+            organization = organization_cache.get(str(organization_id))
+            if organization is None:
+                document = await async_db.organization_collection.find_one(
+                    {'_id': ObjectId(organization_id)}, ORGANIZATION_RESPONSE_PROJECTION)
+                if document is None:
+                    raise DocumentNotFoundError
+                organization = OrganizationResponse.model_validate(document)
+                organization_cache.set(str(organization_id), organization)
+            return organization
+        except Exception as e:
+            raise e
+
+    async def read_all(self, member_id: PydanticObjectId, limit: Optional[int] = None, after: Optional[PydanticObjectId] = None,
+                       version: Optional[int] = None) -> List[OrganizationResponse]:
+        # Callers that tag the result with the member's version pass it in, so they never join a
+        # flight started before a write that bumped it
+        return await read_all_flights.do((str(member_id), limit, str(after), version),
+                                         lambda: self._read_all(member_id, limit, after))
+
+    async def _read_all(self, member_id: PydanticObjectId, limit: Optional[int] = None, after: Optional[PydanticObjectId] = None) -> List[OrganizationResponse]:
+        try:
+            cursor = async_db.organization_member_collection.aggregate(
+                self._read_all_pipeline(member_id, limit, after))
+            return self._to_organization_responses(await cursor.to_list(length=None))
+
+        except Exception as e:
+            raise e
+
+    async def stream_all(self, member_id: PydanticObjectId, after: Optional[PydanticObjectId] = None) -> AsyncIterator[OrganizationResponse]:
+        # Yield organizations as the cursor produces them, without materializing the whole list
+        cursor = async_db.organization_member_collection.aggregate(
+            self._read_all_pipeline(member_id, None, after))
+        async for document in cursor:
+            yield OrganizationResponse.model_validate(document)
+
+    async def read_many(self, organization_ids: List[PydanticObjectId]) -> List[OrganizationResponse]:
+        try:
+            cursor = async_db.organization_collection.find(
+                {'_id': {'$in': [ObjectId(organization_id) for organization_id in organization_ids]}},
+                ORGANIZATION_RESPONSE_PROJECTION).sort('_id')
+            return self._to_organization_responses(await cursor.to_list(length=None))
+        except Exception as e:
+            raise e
+
+    async def update(self, owner_id: PydanticObjectId, organization_id: PydanticObjectId, data: Union[OrganizationUpdate, Dict[str, Any]]):
+        try:
+            # Find and update an organization instance
+            update = self._update_document(data)
+            document = await async_db.organization_collection.find_one_and_update(
+                self._owner_filter(owner_id, organization_id), update,
+                projection=ORGANIZATION_RESPONSE_PROJECTION, return_document=ReturnDocument.AFTER)
+            if document:
+                if update['$set'].get('name'):
+                    await async_db.organization_member_collection.update_many(
+                        {'organizationId': ObjectId(organization_id)}, self._rename_update(update['$set']['name']))
+                organization = OrganizationResponse.model_validate(document)
+                organization_cache.set(str(organization_id), organization)
+                await async_summaries.update_organization(document)
+                await self.bump_membership_versions(await async_db.organization_member_collection.distinct(
+                    'memberId', {'organizationId': ObjectId(organization_id)}))
+                return organization
+            else:
+                raise DocumentNotFoundError
+        except Exception as e:
+            raise e
+
+    async def delete(self, owner_id: PydanticObjectId, organization_id: PydanticObjectId):
+        try:
+            # Delete an organization instance using it's id and owner_id. Members' list versions and
+            # summaries change now; the rows themselves are removed afterwards by a cascade delete job.
+            result = await async_db.organization_collection.delete_one(
+                self._owner_filter(owner_id, organization_id))
+            if result.deleted_count == 0:
+                raise DocumentNotFoundError
+            organization_cache.invalidate(str(organization_id))
+            member_ids = await async_db.organization_member_collection.distinct(
+                'memberId', {'organizationId': ObjectId(organization_id)})
+            await self.bump_membership_versions(member_ids)
+            await async_summaries.remove_organization(organization_id)
+            await async_removals.record_organization(organization_id, member_ids)
+        except Exception as e:
+            raise e
+
+    async def search(self, member_id: PydanticObjectId, query: str, mode: str = SearchMode.prefix, limit: int = 20,
+                     after: Optional[PydanticObjectId] = None) -> List[OrganizationSearchResult]:
+        try:
+            after_name = None
+            if after:
+                membership = await async_db.organization_member_collection.find_one(
+                    self._membership_filter(member_id, after), {'nameNormalized': 1})
+                if membership is None:
+                    raise DocumentNotFoundError
+                after_name = membership['nameNormalized']
+            cursor = async_db.organization_member_collection.find(
+                self._search_filter(member_id, query, mode, after, after_name),
+                SEARCH_RESULT_PROJECTION).sort(SEARCH_SORT).limit(limit)
+            return validate_list(OrganizationSearchResult, await cursor.to_list(length=None))
+        except Exception as e:
+            raise e
+
+    async def membership_version(self, member_id: PydanticObjectId) -> int:
+        try:
+            document = await async_db.membership_version_collection.find_one({'_id': ObjectId(member_id)})
+            return document['version'] if document else 0
+        except Exception as e:
+            raise e
+
+    async def bump_membership_versions(self, member_ids: List[PydanticObjectId]) -> None:
+        try:
+            if member_ids:
+                await async_db.membership_version_collection.bulk_write(
+                    self._version_updates(member_ids), ordered=False)
         except Exception as e:
             raise e
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, NamedTuple
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+from quest_maker_api_shared_library.custom_types import PydanticObjectId
+
+from core.config.database import AsyncOrganizationDatabase
+from core.config.env import get_env
+from core.models.organization import OrganizationCreate, OrganizationResponse
+from core.models.roles import RoleResponse
+from core.services.organization import AsyncOrganizationService
+from core.services.summary import AsyncMemberSummaryService
+from core.utils.managers.roles import AsyncRoleManager
+
+env = get_env()
+logger = logging.getLogger(__name__)
+async_db = AsyncOrganizationDatabase()
+
+# Server error codes meaning multi-document transactions are unavailable (standalone mongod)
+TRANSACTIONS_UNSUPPORTED = {20, 263}
+
+
+class ProvisionedOrganization(NamedTuple):
+    organization: OrganizationResponse
+    roles: List[RoleResponse]
+    owner_role_id: str
+
+
+class OrganizationProvisioner:
+    # Creates an organization, its membership, default roles and the owner's admin assignment in one step
+    def __init__(self) -> None:
+        self.service = AsyncOrganizationService()
+        self.role_manager = AsyncRoleManager()
+        self.summaries = AsyncMemberSummaryService()
+        # Cleared the first time the server turns out not to support transactions, so later
+        # creates go straight to concurrent writes
+        self.use_transactions = env.PROVISIONING_USE_TRANSACTIONS
+
+    def _documents(self, owner_id: PydanticObjectId, data: OrganizationCreate) -> Dict[str, Any]:
+        # Every _id is generated client-side so nothing has to be read back after the writes
+        organization = self.service._new_organization(owner_id, data)
+        organization['_id'] = ObjectId()
+        membership = self.service._new_membership(owner_id, organization)
+        membership['_id'] = ObjectId()
+        roles = self.role_manager._default_roles(organization['_id'])
+        for role in roles:
+            role['_id'] = ObjectId()
+        assignment = self.role_manager._new_assignment(
+            {'toId': owner_id, 'organizationId': organization['_id'], 'roleId': roles[0]['_id']})
+        assignment['_id'] = ObjectId()
+        return {'organization': organization, 'membership': membership, 'roles': roles, 'assignment': assignment}
+
+    async def _write_in_transaction(self, documents: Dict[str, Any]) -> None:
+        async with await async_db.client.start_session() as session:
+            async with session.start_transaction():
+                await async_db.organization_collection.insert_one(documents['organization'], session=session)
+                await async_db.organization_member_collection.insert_one(documents['membership'], session=session)
+                await async_db.role_collection.insert_many(documents['roles'], session=session)
+                await async_db.role_assigned.insert_one(documents['assignment'], session=session)
+
+    async def _write_concurrently(self, documents: Dict[str, Any]) -> None:
+        # Without transactions the four independent inserts share one round trip of latency,
+        # and any partial write is rolled back by deleting the pre-generated ids
+        results = await asyncio.gather(
+            async_db.organization_collection.insert_one(documents['organization']),
+            async_db.organization_member_collection.insert_one(documents['membership']),
+            async_db.role_collection.insert_many(documents['roles']),
+            async_db.role_assigned.insert_one(documents['assignment']),
+            return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            await asyncio.gather(
+                async_db.organization_collection.delete_one({'_id': documents['organization']['_id']}),
+                async_db.organization_member_collection.delete_one({'_id': documents['membership']['_id']}),
+                async_db.role_collection.delete_many({'_id': {'$in': [role['_id'] for role in documents['roles']]}}),
+                async_db.role_assigned.delete_one({'_id': documents['assignment']['_id']}),
+                return_exceptions=True)
+            raise errors[0]
+
+    async def provision(self, owner_id: PydanticObjectId, data: OrganizationCreate) -> ProvisionedOrganization:
+        try:
+            documents = self._documents(owner_id, data)
+            if self.use_transactions:
+                try:
+                    await self._write_in_transaction(documents)
+                except OperationFailure as e:
+                    if e.code not in TRANSACTIONS_UNSUPPORTED:
+                        raise e
+                    self.use_transactions = False
+                    logger.warning(
+                        'Transactions unavailable, provisioning with concurrent writes from now on')
+                    await self._write_concurrently(documents)
+            else:
+                await self._write_concurrently(documents)
+
+            self.role_manager._invalidate_permissions(
+                owner_id, documents['organization']['_id'])
+            await self.service.bump_membership_versions([owner_id])
+            await self.summaries.add_organizations(owner_id, [documents['organization']])
+            await self.summaries.add_roles([documents['assignment']], roles=[documents['roles'][0]])
+            return ProvisionedOrganization(
+                organization=self.service._to_organization_response(
+                    documents['organization']),
+                roles=[self.role_manager._to_role_response(role)
+                       for role in documents['roles']],
+                owner_role_id=str(documents['roles'][0]['_id'])
+            )
+        except Exception as e:
+            raise e
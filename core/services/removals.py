@@ -0,0 +1,65 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable, List
+
+from bson import ObjectId
+from quest_maker_api_shared_library.custom_types import PydanticObjectId
+
+from core.config.database import AsyncOrganizationDatabase, OrganizationDatabase
+
+db = OrganizationDatabase()
+async_db = AsyncOrganizationDatabase()
+
+
+class RemovalType:
+    organization = 'organization'
+    role = 'role'
+
+
+class RemovalQueries:
+    # One tombstone per affected member, so the change feed reads a member's removals with a single
+    # indexed range scan. Tombstones expire after CHANGE_FEED_RETENTION_DAYS.
+    def _organization_removals(self, organization_id: PydanticObjectId, member_ids: Iterable[PydanticObjectId]) -> List[Dict[str, Any]]:
+        timestamp = datetime.utcnow()
+        return [{'memberId': ObjectId(member_id), 'type': RemovalType.organization, 'documentId': ObjectId(organization_id),
+                 'organizationId': ObjectId(organization_id), 'removedAt': timestamp}
+                for member_id in member_ids]
+
+    def _role_removals(self, assignments: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        timestamp = datetime.utcnow()
+        return [{'memberId': ObjectId(assignment['toId']), 'type': RemovalType.role, 'documentId': ObjectId(assignment['roleId']),
+                 'organizationId': ObjectId(assignment['organizationId']), 'removedAt': timestamp}
+                for assignment in assignments]
+
+
+class RemovalLog(RemovalQueries):
+    def record_organization(self, organization_id: PydanticObjectId, member_ids: List[PydanticObjectId]) -> None:
+        try:
+            if member_ids:
+                db.removal_collection.insert_many(
+                    self._organization_removals(organization_id, member_ids), ordered=False)
+        except Exception as e:
+            raise e
+
+    def record_roles(self, assignments: List[Dict[str, Any]]) -> None:
+        try:
+            if assignments:
+                db.removal_collection.insert_many(self._role_removals(assignments), ordered=False)
+        except Exception as e:
+            raise e
+
+
+class AsyncRemovalLog(RemovalQueries):
+    async def record_organization(self, organization_id: PydanticObjectId, member_ids: List[PydanticObjectId]) -> None:
+        try:
+            if member_ids:
+                await async_db.removal_collection.insert_many(
+                    self._organization_removals(organization_id, member_ids), ordered=False)
+        except Exception as e:
+            raise e
+
+    async def record_roles(self, assignments: List[Dict[str, Any]]) -> None:
+        try:
+            if assignments:
+                await async_db.removal_collection.insert_many(self._role_removals(assignments), ordered=False)
+        except Exception as e:
+            raise e
@@ -0,0 +1,288 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+from quest_maker_api_shared_library.custom_types import PydanticObjectId
+
+from core.config.database import AsyncOrganizationDatabase, OrganizationDatabase
+from core.models.summary import MemberSummary
+
+db = OrganizationDatabase()
+async_db = AsyncOrganizationDatabase()
+
+# Members whose summaries a full rebuild regenerates per round trip
+REBUILD_BATCH_SIZE = 500
+
+
+class SummaryQueries:
+    # Per-member summaries hold string ids so the hot read returns them without conversion.
+    # Only materialized summaries are maintained incrementally; a missing one is built from
+    # the source collections on first read, so incremental writes never create partial documents.
+    def _organization_entry(self, organization: Dict[str, Any]) -> Dict[str, Any]:
+        return {'_id': str(organization['_id']), 'name': organization['name'],
+                'ownerId': str(organization['ownerId']), 'updatedAt': organization['updatedAt']}
+
+    def _role_entry(self, role: Dict[str, Any]) -> Dict[str, Any]:
+        return {'_id': str(role['_id']), 'name': role['name'], 'organizationId': str(role['organizationId'])}
+
+    def _replace_entries(self, field: str, entries_by_member: Dict[str, List[Dict[str, Any]]]) -> List[UpdateOne]:
+        # Pull then push, so re-adding an entry replaces it instead of duplicating it
+        operations = []
+        for member_id, entries in entries_by_member.items():
+            ids = [entry['_id'] for entry in entries]
+            operations.append(UpdateOne({'_id': str(member_id)}, {'$pull': {field: {'_id': {'$in': ids}}}}))
+            operations.append(UpdateOne({'_id': str(member_id)}, {'$push': {field: {'$each': entries}}}))
+        return operations
+
+    def _remove_entries(self, field: str, ids_by_member: Dict[str, List[str]]) -> List[UpdateOne]:
+        return [UpdateOne({'_id': str(member_id)}, {'$pull': {field: {'_id': {'$in': ids}}}})
+                for member_id, ids in ids_by_member.items()]
+
+    def _role_entries_by_member(self, assignments: Iterable[Dict[str, Any]], roles: Iterable[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+        roles_by_id = {str(role['_id']): self._role_entry(role) for role in roles}
+        entries = defaultdict(list)
+        for assignment in assignments:
+            role = roles_by_id.get(str(assignment['roleId']))
+            if role:
+                entries[str(assignment['toId'])].append(role)
+        return entries
+
+    def _role_ids_by_member(self, assignments: Iterable[Dict[str, Any]]) -> Dict[str, List[str]]:
+        ids = defaultdict(list)
+        for assignment in assignments:
+            ids[str(assignment['toId'])].append(str(assignment['roleId']))
+        return ids
+
+    def _organization_update(self, organization: Dict[str, Any]) -> Dict[str, Any]:
+        entry = self._organization_entry(organization)
+        return {'$set': {'organizations.$.name': entry['name'], 'organizations.$.ownerId': entry['ownerId'],
+                         'organizations.$.updatedAt': entry['updatedAt']}}
+
+    def _organizations_pipeline(self, match: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # organization_member joined to organization, grouped per member
+        return [
+            {'$match': match},
+            {'$sort': {'organizationId': 1}},
+            {'$lookup': {'from': 'organization',
+                         'localField': 'organizationId',
+                         'foreignField': '_id',
+                         'as': 'organization'}},
+            {'$unwind': '$organization'},
+            {'$group': {'_id': {'$toString': '$memberId'}, 'organizations': {'$push': {
+                '_id': {'$toString': '$organization._id'}, 'name': '$organization.name',
+                'ownerId': {'$toString': '$organization.ownerId'}, 'updatedAt': '$organization.updatedAt'}}}},
+        ]
+
+    def _roles_pipeline(self, match: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # role_assigned joined to role, grouped per member
+        return [
+            {'$match': match},
+            {'$sort': {'roleId': 1}},
+            {'$lookup': {'from': 'role',
+                         'localField': 'roleId',
+                         'foreignField': '_id',
+                         'as': 'role'}},
+            {'$unwind': '$role'},
+            {'$group': {'_id': {'$toString': '$toId'}, 'roles': {'$push': {
+                '_id': {'$toString': '$role._id'}, 'name': '$role.name',
+                'organizationId': {'$toString': '$role.organizationId'}}}}},
+        ]
+
+    def _member_ids_pipeline(self) -> List[Dict[str, Any]]:
+        # Everyone with a membership or a role assignment, run against organization_member
+        return [
+            {'$project': {'_id': '$memberId'}},
+            {'$unionWith': {'coll': 'role_assigned', 'pipeline': [{'$project': {'_id': '$toId'}}]}},
+            {'$group': {'_id': '$_id'}},
+        ]
+
+    def _summary_replacements(self, member_ids: List[PydanticObjectId], organizations: Iterable[Dict[str, Any]],
+                              roles: Iterable[Dict[str, Any]], rebuilt_at: datetime) -> List[ReplaceOne]:
+        # Each summary is written whole in one replace, so readers never see it half rebuilt
+        organizations_by_member = {document['_id']: document['organizations'] for document in organizations}
+        roles_by_member = {document['_id']: document['roles'] for document in roles}
+        return [ReplaceOne({'_id': str(member_id)}, {
+            '_id': str(member_id), 'organizations': organizations_by_member.get(str(member_id), []),
+            'roles': roles_by_member.get(str(member_id), []), 'rebuiltAt': rebuilt_at}, upsert=True)
+            for member_id in member_ids]
+
+
+class MemberSummaryService(SummaryQueries):
+    def read(self, member_id: PydanticObjectId) -> MemberSummary:
+        try:
+            document = db.member_summary_collection.find_one({'_id': str(member_id)})
+            if document is None:
+                self.rebuild([member_id])
+                document = db.member_summary_collection.find_one({'_id': str(member_id)})
+            return MemberSummary.model_validate(document)
+        except Exception as e:
+            raise e
+
+    def add_organizations(self, member_id: PydanticObjectId, organizations: List[Dict[str, Any]]) -> None:
+        try:
+            if organizations:
+                db.member_summary_collection.bulk_write(self._replace_entries(
+                    'organizations', {str(member_id): [self._organization_entry(organization) for organization in organizations]}))
+        except Exception as e:
+            raise e
+
+    def update_organization(self, organization: Dict[str, Any]) -> None:
+        try:
+            db.member_summary_collection.update_many(
+                {'organizations._id': str(organization['_id'])}, self._organization_update(organization))
+        except Exception as e:
+            raise e
+
+    def remove_organization(self, organization_id: PydanticObjectId) -> None:
+        try:
+            db.member_summary_collection.update_many(
+                {'organizations._id': str(organization_id)},
+                {'$pull': {'organizations': {'_id': str(organization_id)}, 'roles': {'organizationId': str(organization_id)}}})
+        except Exception as e:
+            raise e
+
+    def add_roles(self, assignments: List[Dict[str, Any]], roles: Optional[List[Dict[str, Any]]] = None) -> None:
+        try:
+            if not assignments:
+                return
+            if roles is None:
+                roles = db.role_collection.find(
+                    {'_id': {'$in': list({ObjectId(assignment['roleId']) for assignment in assignments})}},
+                    {'name': 1, 'organizationId': 1})
+            operations = self._replace_entries('roles', self._role_entries_by_member(assignments, roles))
+            if operations:
+                db.member_summary_collection.bulk_write(operations)
+        except Exception as e:
+            raise e
+
+    def remove_roles(self, assignments: List[Dict[str, Any]]) -> None:
+        try:
+            if assignments:
+                db.member_summary_collection.bulk_write(
+                    self._remove_entries('roles', self._role_ids_by_member(assignments)), ordered=False)
+        except Exception as e:
+            raise e
+
+    def remove_role(self, role_id: PydanticObjectId) -> None:
+        try:
+            db.member_summary_collection.update_many(
+                {'roles._id': str(role_id)}, {'$pull': {'roles': {'_id': str(role_id)}}})
+        except Exception as e:
+            raise e
+
+    def _rebuild_members(self, member_ids: List[PydanticObjectId], rebuilt_at: datetime) -> None:
+        object_ids = [ObjectId(member_id) for member_id in member_ids]
+        organizations = db.organization_member_collection.aggregate(
+            self._organizations_pipeline({'memberId': {'$in': object_ids}}))
+        roles = db.role_assigned.aggregate(self._roles_pipeline({'toId': {'$in': object_ids}}))
+        db.member_summary_collection.bulk_write(
+            self._summary_replacements(member_ids, organizations, roles, rebuilt_at), ordered=False)
+
+    def rebuild(self, member_ids: Optional[List[PydanticObjectId]] = None) -> int:
+        # Regenerate summaries from the source collections: the given members, or everyone. A full
+        # rebuild works in place one batch of members at a time, so incremental writes to members
+        # outside the current batch are kept, then drops summaries of members with nothing left.
+        try:
+            if member_ids:
+                self._rebuild_members(member_ids, datetime.utcnow())
+                return len(member_ids)
+
+            started = datetime.utcnow()
+            count = 0
+            batch = []
+            for document in db.organization_member_collection.aggregate(self._member_ids_pipeline(), allowDiskUse=True):
+                batch.append(document['_id'])
+                if len(batch) == REBUILD_BATCH_SIZE:
+                    self._rebuild_members(batch, datetime.utcnow())
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self._rebuild_members(batch, datetime.utcnow())
+                count += len(batch)
+            # Summaries written before the rebuild started belong to members it no longer found;
+            # they are rebuilt on their next read if that changes
+            db.member_summary_collection.delete_many(
+                {'$or': [{'rebuiltAt': {'$lt': started}}, {'rebuiltAt': {'$exists': False}}]})
+            return count
+        except Exception as e:
+            raise e
+
+
+class AsyncMemberSummaryService(SummaryQueries):
+    async def read(self, member_id: PydanticObjectId) -> MemberSummary:
+        try:
+            document = await async_db.member_summary_collection.find_one({'_id': str(member_id)})
+            if document is None:
+                await self.rebuild([member_id])
+                document = await async_db.member_summary_collection.find_one({'_id': str(member_id)})
+            return MemberSummary.model_validate(document)
+        except Exception as e:
+            raise e
+
+    async def add_organizations(self, member_id: PydanticObjectId, organizations: List[Dict[str, Any]]) -> None:
+        try:
+            if organizations:
+                await async_db.member_summary_collection.bulk_write(self._replace_entries(
+                    'organizations', {str(member_id): [self._organization_entry(organization) for organization in organizations]}))
+        except Exception as e:
+            raise e
+
+    async def update_organization(self, organization: Dict[str, Any]) -> None:
+        try:
+            await async_db.member_summary_collection.update_many(
+                {'organizations._id': str(organization['_id'])}, self._organization_update(organization))
+        except Exception as e:
+            raise e
+
+    async def remove_organization(self, organization_id: PydanticObjectId) -> None:
+        try:
+            await async_db.member_summary_collection.update_many(
+                {'organizations._id': str(organization_id)},
+                {'$pull': {'organizations': {'_id': str(organization_id)}, 'roles': {'organizationId': str(organization_id)}}})
+        except Exception as e:
+            raise e
+
+    async def add_roles(self, assignments: List[Dict[str, Any]], roles: Optional[List[Dict[str, Any]]] = None) -> None:
+        try:
+            if not assignments:
+                return
+            if roles is None:
+                roles = await async_db.role_collection.find(
+                    {'_id': {'$in': list({ObjectId(assignment['roleId']) for assignment in assignments})}},
+                    {'name': 1, 'organizationId': 1}).to_list(length=None)
+            operations = self._replace_entries('roles', self._role_entries_by_member(assignments, roles))
+            if operations:
+                await async_db.member_summary_collection.bulk_write(operations)
+        except Exception as e:
+            raise e
+
+    async def remove_roles(self, assignments: List[Dict[str, Any]]) -> None:
+        try:
+            if assignments:
+                await async_db.member_summary_collection.bulk_write(
+                    self._remove_entries('roles', self._role_ids_by_member(assignments)), ordered=False)
+        except Exception as e:
+            raise e
+
+    async def remove_role(self, role_id: PydanticObjectId) -> None:
+        try:
+            await async_db.member_summary_collection.update_many(
+                {'roles._id': str(role_id)}, {'$pull': {'roles': {'_id': str(role_id)}}})
+        except Exception as e:
+            raise e
+
+    async def rebuild(self, member_ids: List[PydanticObjectId]) -> int:
+        # Regenerate the given members' summaries in place; full rebuilds run through the blocking service
+        try:
+            object_ids = [ObjectId(member_id) for member_id in member_ids]
+            organizations = await async_db.organization_member_collection.aggregate(
+                self._organizations_pipeline({'memberId': {'$in': object_ids}})).to_list(length=None)
+            roles = await async_db.role_assigned.aggregate(
+                self._roles_pipeline({'toId': {'$in': object_ids}})).to_list(length=None)
+            await async_db.member_summary_collection.bulk_write(
+                self._summary_replacements(member_ids, organizations, roles, datetime.utcnow()), ordered=False)
+            return len(member_ids)
+        except Exception as e:
+            raise e
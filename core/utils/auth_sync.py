@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import time
+from http import HTTPStatus
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+import httpx
+from pymongo import ReturnDocument
+
+from core.config.database import AsyncOrganizationDatabase
+from core.config.env import get_env
+from core.models.auth_sync import AuthSyncChangeSet, AuthSyncSnapshot
+from core.models.organization import OrganizationResponse
+from core.models.roles import RoleResponse
+from core.services.organization import AsyncOrganizationService
+from core.utils.managers.roles import AsyncRoleManager
+from core.utils.metrics import auth_sync_duration
+
+env = get_env()
+logger = logging.getLogger(__name__)
+async_db = AsyncOrganizationDatabase()
+service = AsyncOrganizationService()
+role_manager = AsyncRoleManager()
+
+
+class PendingChanges:
+    # Organizations and roles that changed for one user since the last push
+    def __init__(self, upserted_organizations: Iterable[str] = (), removed_organizations: Iterable[str] = (),
+                 added_roles: Iterable[str] = (), removed_roles: Iterable[str] = (), snapshot: bool = False,
+                 organizations: Iterable[OrganizationResponse] = (), roles: Iterable[RoleResponse] = ()) -> None:
+        self.upserted_organizations: Set[str] = set()
+        self.removed_organizations: Set[str] = set()
+        self.added_roles: Set[str] = set()
+        self.removed_roles: Set[str] = set()
+        # Documents already known to the caller, pushed without being read back
+        self.organization_documents: Dict[str, OrganizationResponse] = {}
+        self.role_documents: Dict[str, RoleResponse] = {}
+        self.snapshot = snapshot
+        for organization_id in upserted_organizations:
+            self.upsert_organization(organization_id)
+        for organization_id in removed_organizations:
+            self.remove_organization(organization_id)
+        for role_id in added_roles:
+            self.add_role(role_id)
+        for role_id in removed_roles:
+            self.remove_role(role_id)
+        for organization in organizations:
+            self.upsert_organization(organization.id, document=organization)
+        for role in roles:
+            self.add_role(role.id, document=role)
+
+    def upsert_organization(self, organization_id: str, document: Optional[OrganizationResponse] = None) -> None:
+        organization_id = str(organization_id)
+        self.removed_organizations.discard(organization_id)
+        self.upserted_organizations.add(organization_id)
+        if document is None:
+            self.organization_documents.pop(organization_id, None)
+        else:
+            self.organization_documents[organization_id] = document
+
+    def remove_organization(self, organization_id: str) -> None:
+        organization_id = str(organization_id)
+        self.upserted_organizations.discard(organization_id)
+        self.organization_documents.pop(organization_id, None)
+        self.removed_organizations.add(organization_id)
+
+    def add_role(self, role_id: str, document: Optional[RoleResponse] = None) -> None:
+        role_id = str(role_id)
+        self.removed_roles.discard(role_id)
+        self.added_roles.add(role_id)
+        if document is None:
+            self.role_documents.pop(role_id, None)
+        else:
+            self.role_documents[role_id] = document
+
+    def remove_role(self, role_id: str) -> None:
+        role_id = str(role_id)
+        self.added_roles.discard(role_id)
+        self.role_documents.pop(role_id, None)
+        self.removed_roles.add(role_id)
+
+    def merge(self, other: 'PendingChanges') -> None:
+        # Later changes win over earlier ones for the same document
+        self.snapshot = self.snapshot or other.snapshot
+        for organization_id in other.upserted_organizations:
+            self.upsert_organization(
+                organization_id, document=other.organization_documents.get(organization_id))
+        for organization_id in other.removed_organizations:
+            self.remove_organization(organization_id)
+        for role_id in other.added_roles:
+            self.add_role(role_id, document=other.role_documents.get(role_id))
+        for role_id in other.removed_roles:
+            self.remove_role(role_id)
+
+
+async def next_version(user_id: str) -> int:
+    # Per-user sequence number so the Authentication service can detect missed pushes
+    document = await async_db.auth_sync_collection.find_one_and_update(
+        {'_id': str(user_id)}, {'$inc': {'version': 1}}, upsert=True, return_document=ReturnDocument.AFTER)
+    return document['version']
+
+
+def _organization_payload(organization) -> Dict[str, Any]:
+    organization = organization.model_copy()
+    organization.id = str(organization.id)
+    organization.ownerId = str(organization.ownerId)
+    # JSON mode so createdAt/updatedAt go out as ISO strings httpx can encode
+    return organization.model_dump(mode='json')
+
+
+def _role_payload(role) -> Dict[str, Any]:
+    role = role.model_copy()
+    role.id = str(role.id)
+    role.organizationId = str(role.organizationId)
+    return role.model_dump(mode='json', by_alias=True)
+
+
+async def build_snapshot(user_id: str) -> Dict[str, Any]:
+    # Full set of the user's organizations and roles, used for recovery and resyncs. The version is
+    # taken first so a push that fails to build still leaves a gap the receiver can detect.
+    version = await next_version(user_id)
+    organizations = await service.read_all(member_id=user_id)
+    roles = await role_manager.get_roles(to_id=user_id)
+    snapshot = AuthSyncSnapshot(
+        userId=str(user_id),
+        version=version,
+        organizations=[_organization_payload(organization)
+                       for organization in organizations],
+        roles=[_role_payload(role) for role in roles]
+    )
+    return snapshot.model_dump(mode='json')
+
+
+async def build_change_set(user_id: str, changes: PendingChanges) -> Dict[str, Any]:
+    # Only the documents that changed; those not supplied with the change are read at send time
+    version = await next_version(user_id)
+    organizations = list(changes.organization_documents.values())
+    missing_organizations = changes.upserted_organizations - changes.organization_documents.keys()
+    if missing_organizations:
+        organizations += await service.read_many(list(missing_organizations))
+    roles = list(changes.role_documents.values())
+    missing_roles = changes.added_roles - changes.role_documents.keys()
+    if missing_roles:
+        roles += await role_manager.get_roles_by_ids(list(missing_roles))
+
+    # Documents deleted before the push went out are reported as removed
+    found_organizations = {str(organization.id) for organization in organizations}
+    found_roles = {str(role.id) for role in roles}
+    change_set = AuthSyncChangeSet(
+        userId=str(user_id),
+        version=version,
+        upsertedOrganizations=[_organization_payload(organization)
+                               for organization in organizations],
+        removedOrganizationIds=sorted(
+            changes.removed_organizations | (changes.upserted_organizations - found_organizations)),
+        addedRoles=[_role_payload(role) for role in roles],
+        removedRoleIds=sorted(
+            changes.removed_roles | (changes.added_roles - found_roles))
+    )
+    return change_set.model_dump(mode='json')
+
+
+class AuthSyncDispatcher:
+    def __init__(self, base_url: str,
+                 build_snapshot: Callable[[str], Awaitable[Dict[str, Any]]] = build_snapshot,
+                 build_change_set: Callable[[str, PendingChanges], Awaitable[Dict[str, Any]]] = build_change_set,
+                 timeout: float = 5.0, max_retries: int = 3, backoff: float = 0.5,
+                 workers: int = 4, client: Optional[httpx.AsyncClient] = None) -> None:
+        self.base_url = base_url
+        self.build_snapshot = build_snapshot
+        self.build_change_set = build_change_set
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.workers = workers
+        self._client = client
+        self._owns_client = client is None
+        # Latest bearer token and accumulated changes per user waiting to be pushed
+        self._pending: Dict[str, str] = {}
+        self._changes: Dict[str, PendingChanges] = {}
+        # Users whose push is being built or sent; at most one per user at a time, so pushes stay in order
+        self._in_flight: Set[str] = set()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url, timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.workers, max_keepalive_connections=self.workers))
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._run())
+                       for _ in range(self.workers)]
+
+    def enqueue(self, user_id: str, token: str, changes: Optional[PendingChanges] = None) -> None:
+        # Bursts for the same user collapse into one push; no changes means a full snapshot
+        user_id = str(user_id)
+        changes = changes or PendingChanges(snapshot=True)
+        already_pending = user_id in self._pending
+        self._pending[user_id] = token
+        if already_pending:
+            self._changes[user_id].merge(changes)
+        else:
+            self._changes[user_id] = changes
+            # A user with a push in flight is queued again once that push finishes
+            if user_id not in self._in_flight:
+                self._queue.put_nowait(user_id)
+
+    async def drain(self, timeout: Optional[float] = None) -> None:
+        # Flush queued pushes, then stop the workers and release the connection pool
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning('Auth sync drain timed out with %d users pending',
+                           len(self._pending))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._owns_client:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self) -> None:
+        while True:
+            user_id = await self._queue.get()
+            self._in_flight.add(user_id)
+            try:
+                token = self._pending.pop(user_id)
+                changes = self._changes.pop(user_id)
+                try:
+                    if changes.snapshot:
+                        method, json_data = 'PUT', await self.build_snapshot(user_id)
+                    else:
+                        method, json_data = 'PATCH', await self.build_change_set(user_id, changes)
+                except Exception:
+                    # Nothing was sent and the popped changes would be lost: retry with a snapshot,
+                    # which covers them and anything newer
+                    logger.exception('Building auth sync push for user %s failed', user_id)
+                    await asyncio.sleep(self.backoff)
+                    self._pending.setdefault(user_id, token)
+                    self._changes.setdefault(user_id, PendingChanges()).snapshot = True
+                else:
+                    await self._push(method, user_id, token, json_data)
+            except Exception:
+                logger.exception('Auth sync for user %s failed', user_id)
+            finally:
+                self._in_flight.discard(user_id)
+                # Changes that arrived during the push go out in a follow-up, queued before
+                # task_done so drain() keeps waiting for them
+                if user_id in self._pending:
+                    self._queue.put_nowait(user_id)
+                self._queue.task_done()
+
+    async def _push(self, method: str, user_id: str, token: str, json_data: Dict[str, Any]) -> None:
+        headers = {'Authorization': f'Bearer {token}'}
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                response = await self._client.request(method, 'auth/', json=json_data, headers=headers)
+                auth_sync_duration.observe(time.perf_counter() - started, method, str(response.status_code))
+                if response.status_code == HTTPStatus.OK:
+                    return
+                if response.status_code < HTTPStatus.INTERNAL_SERVER_ERROR and response.status_code != HTTPStatus.TOO_MANY_REQUESTS:
+                    logger.error('Auth sync for user %s rejected with status %d',
+                                 user_id, response.status_code)
+                    return
+            except httpx.TransportError as e:
+                auth_sync_duration.observe(time.perf_counter() - started, method, 'error')
+                logger.warning('Auth sync for user %s attempt %d failed: %s',
+                               user_id, attempt + 1, e)
+            if attempt < self.max_retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        # The skipped version tells the Authentication service to request a resync
+        logger.error('Auth sync for user %s gave up after %d attempts',
+                     user_id, self.max_retries + 1)
+
+
+dispatcher = AuthSyncDispatcher(base_url=str(env.AUTHENTICATION_SERVICE_URL),
+                                timeout=env.AUTH_SYNC_TIMEOUT_SECONDS,
+                                max_retries=env.AUTH_SYNC_MAX_RETRIES,
+                                backoff=env.AUTH_SYNC_BACKOFF_SECONDS,
+                                workers=env.AUTH_SYNC_WORKERS)
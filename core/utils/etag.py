@@ -0,0 +1,22 @@
+import hashlib
+
+from core.models.organization import OrganizationResponse
+
+
+def make_etag(*parts) -> str:
+    # Strong validator over the parts that determine a response body
+    digest = hashlib.blake2b('\x1f'.join(str(part) for part in parts).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def organization_etag(organization: OrganizationResponse) -> str:
+    return make_etag(organization.id, organization.updatedAt)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match may list several validators, weak ones included, or '*'
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return etag in {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
@@ -1,19 +1,43 @@
 from datetime import datetime
 from logging import log
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple, Union
 
 from bson import ObjectId
-from pymongo.errors import DuplicateKeyError as MongoDBDuplicateKeyError
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError as MongoDBDuplicateKeyError
 from quest_maker_api_shared_library.custom_types import PydanticObjectId
 from quest_maker_api_shared_library.errors.database import DuplicateKeyError
 
+from core.models.batch import BatchItemResult
 from core.models.roles import RoleAssignedInDB, RoleCreate, RoleInDB, RoleResponse
-from core.config.env import Env
-from core.config.database import OrganizationDatabase
-from core.utils.permissions import Permissions
+from core.config.env import get_env
+from core.config.database import AsyncOrganizationDatabase, OrganizationDatabase
+from core.services.removals import AsyncRemovalLog, RemovalLog
+from core.services.summary import AsyncMemberSummaryService, MemberSummaryService
+from core.utils.cache import TTLCache
+from core.utils.metrics import registry
+from core.utils.singleflight import SingleFlight
+from core.utils.permissions import NO_ROLE_QUERY, PERMISSION_BITS, Permissions, from_mask, mask_query, to_mask, unknown_permissions
+from core.utils.serialization import validate_list
 
-env = Env()
+env = get_env()
 db = OrganizationDatabase()
+async_db = AsyncOrganizationDatabase()
+summaries = MemberSummaryService()
+async_summaries = AsyncMemberSummaryService()
+removals = RemovalLog()
+async_removals = AsyncRemovalLog()
+
+# Fields returned to clients for a role document, with ids already converted to strings
+ROLE_RESPONSE_PROJECTION = {'_id': {'$toString': '$_id'}, 'name': 1, 'template': 1, 'description': 1,
+                            'organizationId': {'$toString': '$organizationId'}, 'permissions': 1,
+                            'permissionMask': 1, 'createdAt': 1, 'updatedAt': 1}
+
+# Effective permissions per (toId, organizationId), shared by both role managers
+permission_cache = registry.register_cache('permissions', TTLCache(max_size=env.PERMISSION_CACHE_SIZE,
+                                                                   ttl=env.PERMISSION_CACHE_TTL_SECONDS))
+# In-flight role lookups shared by concurrent identical requests in this worker
+get_roles_flights = SingleFlight('roles.get_roles')
 
 
 class DefaultRoles:
@@ -26,116 +50,469 @@ class DefaultRoles:
         return iter([cls.admin, cls.manager, cls.user])
 
 
-class RoleManager:
-    def setup(self, organization_id: PydanticObjectId):
-        role_ids = []
+class RoleTemplate(NamedTuple):
+    name: str
+    description: str
+    permissions: Tuple[str, ...]
+    permissionMask: int
+
+
+def _role_template(name: str, description: str, permissions: List[str]) -> RoleTemplate:
+    return RoleTemplate(name=name, description=description,
+                        permissions=tuple(permissions), permissionMask=to_mask(permissions))
+
+
+# Default roles, built once per process. Organization roles reference a template by name
+# and store only the fields they override.
+ROLE_TEMPLATES: Dict[str, RoleTemplate] = {
+    DefaultRoles.admin: _role_template(DefaultRoles.admin, 'Admin role', [permission for permission in Permissions()]),
+    DefaultRoles.manager: _role_template(DefaultRoles.manager, 'Manager role', [Permissions.read_own, Permissions.write_own, Permissions.delete_own,
+                                                                               Permissions.read_all, Permissions.write_all, Permissions.delete_all,
+                                                                               Permissions.read_org, Permissions.write_org, Permissions.delete_org,
+                                                                               Permissions.access_control]),
+    DefaultRoles.user: _role_template(DefaultRoles.user, 'User role', [Permissions.read_own, Permissions.write_own, Permissions.delete_own]),
+}
+
+
+def resolve_role(role: Dict[str, Any]) -> Dict[str, Any]:
+    # Fill the fields a template-backed role does not override from its template
+    template = ROLE_TEMPLATES.get(role.get('template'))
+    if template is None:
+        return role
+    resolved = {'description': template.description,
+                'permissions': list(template.permissions)}
+    if 'permissions' not in role:
+        resolved['permissionMask'] = template.permissionMask
+    resolved.update(role)
+    return resolved
+
+
+class EffectivePermissions(NamedTuple):
+    # Permission mask granted by each assigned role and their union
+    roles: Dict[str, int]
+    mask: int
+
+    @property
+    def permissions(self) -> FrozenSet[str]:
+        return frozenset(from_mask(self.mask))
+
+    def allows(self, required_permission: str, role_id: Optional[PydanticObjectId] = None) -> bool:
+        bit = PERMISSION_BITS.get(required_permission)
+        if bit is None:
+            return False
+        mask = self.mask if role_id is None else self.roles.get(str(role_id), 0)
+        return bool(mask & bit)
+
+
+class RoleQueries:
+    # Query builders shared by the blocking and asyncio role managers
+    def _default_roles(self, organization_id: PydanticObjectId) -> List[Dict[str, Any]]:
+        # The admin role comes first; it is the one assigned to an organization's owner
+        timestamp = datetime.utcnow()
+        return [{'name': template.name, 'template': template.name, 'organizationId': ObjectId(organization_id),
+                 'createdAt': timestamp, 'updatedAt': timestamp}
+                for template in ROLE_TEMPLATES.values()]
+
+    def _new_role(self, data: RoleCreate) -> Dict[str, Any]:
+        unknown = unknown_permissions(data.permissions)
+        if unknown:
+            raise ValueError(f"Unknown permissions: {', '.join(unknown)}")
+
+        # Load data into RoleInDB container
+        role = RoleInDB(
+            name=data.name,
+            organizationId=str(data.organizationId),
+            description=data.description,
+            permissions=data.permissions,
+            permissionMask=to_mask(data.permissions),
+            createdAt=datetime.utcnow(),
+            updatedAt=datetime.utcnow()
+        )
+
+        # Convert the RoleInDB container into a dictionary
+        return role.model_dump()
+
+    def _role_pipeline(self, match: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # Join role assignments to their roles in a single aggregation
+        return [
+            {'$match': match},
+            {'$lookup': {'from': 'role',
+                         'localField': 'roleId',
+                         'foreignField': '_id',
+                         'as': 'role'}},
+            {'$unwind': '$role'},
+            {'$sort': {'role._id': 1}},
+            {'$project': {'_id': 0, 'toId': 1, 'organizationId': 1, 'role': {
+                field: {'$toString': f'$role.{field}'} if isinstance(value, dict) else value
+                for field, value in ROLE_RESPONSE_PROJECTION.items()}}},
+        ]
+
+    def _assignment_match(self, to_ids: List[PydanticObjectId], organization_id: Optional[PydanticObjectId]) -> Dict[str, Any]:
+        match = {'toId': {'$in': [ObjectId(to_id) for to_id in to_ids]}}
+        if organization_id:
+            match['organizationId'] = ObjectId(organization_id)
+        return match
+
+    def _permission_mask(self, role: Dict[str, Any]) -> int:
+        role = resolve_role(role)
+        # Roles written before permissionMask existed fall back to their permission list
+        if 'permissionMask' in role:
+            return role['permissionMask']
+        return to_mask(role['permissions'])
+
+    def _to_role_response(self, role: Dict[str, Any]) -> RoleResponse:
+        role = resolve_role(role)
+        # Load result into RoleResponse container
+        return RoleResponse(
+            _id=str(role['_id']),
+            name=role['name'],
+            description=role.get('description'),
+            organizationId=str(role['organizationId']),
+            permissions=role['permissions'],
+            permissionMask=self._permission_mask(role),
+            createdAt=role['createdAt'],
+            updatedAt=role['updatedAt']
+        )
+
+    def _to_role_responses(self, roles) -> List[RoleResponse]:
+        # Roles fetched with ROLE_RESPONSE_PROJECTION only need their template fields resolved
+        documents = []
+        for role in roles:
+            role = resolve_role(role)
+            role['permissionMask'] = self._permission_mask(role)
+            role.setdefault('description', None)
+            documents.append(role)
+        return validate_list(RoleResponse, documents)
+
+    def _group_by_member(self, to_ids: List[PydanticObjectId], documents: List[Dict[str, Any]]) -> Dict[str, List[RoleResponse]]:
+        roles = {str(to_id): [] for to_id in to_ids}
+        for document in documents:
+            roles[str(document['toId'])].append(
+                self._to_role_response(document['role']))
+        return roles
+
+    def _new_assignment(self, data: Union[RoleAssignedInDB, Dict[str, Any]]) -> Dict[str, Any]:
+        if isinstance(data, RoleAssignedInDB):
+            data = data.model_dump()
+        data['toId'] = ObjectId(data['toId'])
+        data['organizationId'] = ObjectId(data['organizationId'])
+        data['roleId'] = ObjectId(data['roleId'])
+        # Grants are reported by the change feed from their creation time
+        data.setdefault('createdAt', datetime.utcnow())
+        return data
+
+    def _effective_permissions_pipeline(self, to_id: PydanticObjectId, organization_id: PydanticObjectId) -> List[Dict[str, Any]]:
+        pipeline = self._role_pipeline(
+            self._assignment_match([to_id], organization_id))
+        pipeline.append(
+            {'$project': {'_id': 0, 'role._id': 1, 'role.template': 1, 'role.permissions': 1, 'role.permissionMask': 1}})
+        return pipeline
+
+    def _to_effective_permissions(self, documents: List[Dict[str, Any]]) -> EffectivePermissions:
+        roles = {str(document['role']['_id']): self._permission_mask(document['role'])
+                 for document in documents}
+        mask = 0
+        for role_mask in roles.values():
+            mask |= role_mask
+        return EffectivePermissions(roles=roles, mask=mask)
+
+    def _effective_permissions_many_pipeline(self, keys: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        # Every (toId, organizationId) pair's assigned roles in one aggregation
+        pipeline = self._role_pipeline({'$or': [{'toId': ObjectId(to_id), 'organizationId': ObjectId(organization_id)}
+                                                for to_id, organization_id in keys]})
+        pipeline.append(
+            {'$project': {'_id': 0, 'toId': 1, 'organizationId': 1, 'role._id': 1, 'role.template': 1,
+                          'role.permissions': 1, 'role.permissionMask': 1}})
+        return pipeline
+
+    def _group_effective_permissions(self, keys: List[Tuple[str, str]], documents: List[Dict[str, Any]]) -> Dict[Tuple[str, str], EffectivePermissions]:
+        # Pairs without any assignment get an empty permission set, which is cached like any other
+        documents_by_key = {key: [] for key in keys}
+        for document in documents:
+            # Keyed by the assignment's organizationId, as get_effective_permissions is
+            key = self.permission_key(document['toId'], document['organizationId'])
+            if key in documents_by_key:
+                documents_by_key[key].append(document)
+        effective_permissions = {}
+        for key, key_documents in documents_by_key.items():
+            effective_permissions[key] = self._to_effective_permissions(key_documents)
+            permission_cache.set(key, effective_permissions[key])
+        return effective_permissions
+
+    def _roles_with_permissions_filter(self, organization_id: PydanticObjectId, permissions: List[str]) -> Dict[str, Any]:
+        # Roles storing their own permissions are matched with $bitsAllSet, template-backed ones by template name
+        if unknown_permissions(permissions):
+            return {'organizationId': ObjectId(organization_id), **NO_ROLE_QUERY}
+        mask = to_mask(permissions)
+        templates = [name for name, template in ROLE_TEMPLATES.items()
+                     if template.permissionMask & mask == mask]
+        return {'organizationId': ObjectId(organization_id),
+                '$or': [mask_query(permissions),
+                        {'template': {'$in': templates}, 'permissions': {'$exists': False}}]}
+
+    def permission_key(self, to_id: PydanticObjectId, organization_id: PydanticObjectId) -> Tuple[str, str]:
+        # Key of get_effective_permissions_many results and of the permission cache
+        return (str(to_id), str(organization_id))
+
+    def _invalidate_permissions(self, to_id: PydanticObjectId, organization_id: PydanticObjectId) -> None:
+        permission_cache.invalidate(
+            self.permission_key(to_id, organization_id))
+
+    def _invalidate_organization_permissions(self, organization_id: PydanticObjectId) -> None:
+        organization_id = str(organization_id)
+        permission_cache.invalidate_where(
+            lambda key: key[1] == organization_id)
+
+    def _write_errors(self, error: BulkWriteError) -> Dict[int, str]:
+        # Map the index of each failed operation in an unordered bulk write to its error
+        return {write_error['index']: write_error['errmsg'] for write_error in error.details.get('writeErrors', [])}
+
+    def _group_roles_by_organization(self, organization_ids: List[PydanticObjectId], documents: List[Dict[str, Any]], failed: Dict[int, str]) -> Dict[str, Dict[str, ObjectId]]:
+        # Ids of the default roles created for each organization, by template name
+        role_ids = {str(organization_id): {} for organization_id in organization_ids}
+        for index, document in enumerate(documents):
+            if index not in failed:
+                role_ids[str(document['organizationId'])][document['template']] = document['_id']
+        return role_ids
+
+    def _new_assignments(self, items: List[RoleAssignedInDB]) -> List[Dict[str, Any]]:
+        assignments = [self._new_assignment(item) for item in items]
+        for assignment in assignments:
+            assignment['_id'] = ObjectId()
+        return assignments
+
+    def _role_organizations_filter(self, assignments: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {'_id': {'$in': list({assignment['roleId'] for assignment in assignments})}}
+
+    def _memberships_match(self, assignments: List[Dict[str, Any]]) -> Dict[str, Any]:
+        pairs = {(assignment['toId'], assignment['organizationId']) for assignment in assignments}
+        return {'$or': [{'memberId': to_id, 'organizationId': organization_id} for to_id, organization_id in pairs]}
+
+    def _invalid_assignments(self, assignments: List[Dict[str, Any]], role_organizations: Dict[ObjectId, ObjectId],
+                             memberships: Set[Tuple[ObjectId, ObjectId]]) -> Dict[int, str]:
+        # A role may only be assigned within its own organization, and only to that organization's members
+        failed = {}
+        for index, assignment in enumerate(assignments):
+            if role_organizations.get(assignment['roleId']) != assignment['organizationId']:
+                failed[index] = 'Role not found in organization'
+            elif (assignment['toId'], assignment['organizationId']) not in memberships:
+                failed[index] = 'Assignee is not a member of the organization'
+        return failed
+
+    def _valid_indexes(self, assignments: List[Dict[str, Any]], failed: Dict[int, str]) -> List[int]:
+        return [index for index in range(len(assignments)) if index not in failed]
+
+    def _assign_results(self, assignments: List[Dict[str, Any]], failed: Dict[int, str]) -> List[BatchItemResult]:
+        results = []
+        for index, assignment in enumerate(assignments):
+            if index in failed:
+                results.append(BatchItemResult(index=index, error=failed[index]))
+            else:
+                self._invalidate_permissions(
+                    assignment['toId'], assignment['organizationId'])
+                results.append(BatchItemResult(
+                    index=index, id=str(assignment['_id'])))
+        return results
+
+    def _assignments_match(self, assignments: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {'$or': [self._assignment_filter(assignment['toId'], assignment['organizationId'], assignment['roleId'])
+                        for assignment in assignments]}
+
+    def _assignment_key(self, assignment: Dict[str, Any]):
+        return (assignment['toId'], assignment['organizationId'], assignment['roleId'])
+
+    def _revoke_results(self, assignments: List[Dict[str, Any]], found: Dict[Any, ObjectId]) -> List[BatchItemResult]:
+        results = []
+        for index, assignment in enumerate(assignments):
+            key = self._assignment_key(assignment)
+            if key in found:
+                self._invalidate_permissions(
+                    assignment['toId'], assignment['organizationId'])
+                results.append(BatchItemResult(index=index, id=str(found[key])))
+            else:
+                results.append(BatchItemResult(
+                    index=index, error='Role assignment not found'))
+        return results
+
+    def _assignment_filter(self, to_id: PydanticObjectId, organization_id: PydanticObjectId, role_id: PydanticObjectId) -> Dict[str, Any]:
+        return {'toId': ObjectId(to_id), 'organizationId': ObjectId(organization_id), 'roleId': ObjectId(role_id)}
+
+
+class RoleManager(RoleQueries):
+    def setup(self, organization_id: PydanticObjectId) -> List[ObjectId]:
         try:
-            exists = db.role_collection.count_documents(
-                {'name': {'$in': [role for role in DefaultRoles()]}})
+            documents = db.role_collection.insert_many(
+                self._default_roles(organization_id))
+            return list(documents.inserted_ids)
+        except Exception as e:
+            raise e
 
-            if exists == 0:
-                admin = {'name': 'admin', 'organizationId': ObjectId(organization_id), 'description': "Admin role", 'permissions': [
-                    permission for permission in Permissions()], 'createdAt': str(datetime.utcnow()), 'updatedAt': str(datetime.utcnow())}
-                manager = {'name': 'manager', 'organizationId': ObjectId(organization_id), 'description': "Manager role", 'permissions': [Permissions.read_own, Permissions.write_own, Permissions.delete_own,
-                                                                                                                                          Permissions.read_all, Permissions.write_all, Permissions.delete_all,
-                                                                                                                                          Permissions.read_org, Permissions.write_org, Permissions.delete_org,
-                                                                                                                                          Permissions.access_control], 'createdAt': str(datetime.utcnow()), 'updatedAt': str(datetime.utcnow())}
-                user = {'name': 'user', 'organizationId': ObjectId(organization_id), 'description': "User role", 'permissions': [
-                    Permissions.read_own, Permissions.write_own, Permissions.delete_own], 'createdAt': str(datetime.utcnow()), 'updatedAt': str(datetime.utcnow())}
-                documents = db.role_collection.insert_many(
-                    [admin, manager, user])
-                for id in documents.inserted_ids:
-                    role_ids.append(id)
-                return role_ids
+    def setup_many(self, organization_ids: List[PydanticObjectId]) -> Dict[str, Dict[str, ObjectId]]:
+        try:
+            documents = [role for organization_id in organization_ids
+                         for role in self._default_roles(organization_id)]
+            failed = {}
+            if documents:
+                try:
+                    db.role_collection.insert_many(documents, ordered=False)
+                except BulkWriteError as e:
+                    failed = self._write_errors(e)
+            return self._group_roles_by_organization(organization_ids, documents, failed)
         except Exception as e:
             raise e
 
     def create(self, data: RoleCreate):
         try:
-            # Load data into RoleInDB container
-            role = RoleInDB(
-                name=data.name,
-                organization_id=str(data.organization_id),
-                description=data.description,
-                permissions=data.permissions,
-                createdAt=str(datetime.utcnow()),
-                updatedAt=str(datetime.utcnow())
-            )
+            # Create new role instance in database collection
+            db.role_collection.insert_one(self._new_role(data))
+        except Exception as e:
+            raise e
 
-            # Convert the RoleInDB container into a dictionary
-            role_dict = role.model_dump()
+    def get_roles(self, to_id: PydanticObjectId, organization_id: Optional[PydanticObjectId] = None) -> List[RoleResponse]:
+        try:
+            documents = db.role_assigned.aggregate(self._role_pipeline(
+                self._assignment_match([to_id], organization_id)))
+            return self._to_role_responses(document['role'] for document in documents)
+        except Exception as e:
+            raise e
 
-            # Create new role instance in database collection
-            db.role_collection.insert_one(role_dict)
+    def get_roles_for_members(self, to_ids: List[PydanticObjectId], organization_id: Optional[PydanticObjectId] = None) -> Dict[str, List[RoleResponse]]:
+        try:
+            documents = db.role_assigned.aggregate(self._role_pipeline(
+                self._assignment_match(to_ids, organization_id)))
+            return self._group_by_member(to_ids, documents)
         except Exception as e:
             raise e
 
-    def get_roles(self, to_id: PydanticObjectId) -> Optional[List[RoleResponse]]:
-        roles = []
+    def get_roles_by_ids(self, role_ids: List[PydanticObjectId]) -> List[RoleResponse]:
         try:
-            role_assigned_documents = db.role_assigned.find(
-                {'toId': ObjectId(to_id)})
-            # role_assigned_documents = db.role_assigned.find({'toId': to_id})
-            for role_assigned_document in role_assigned_documents:
-                roles.append(db.role_collection.find_one(
-                    {'_id': role_assigned_document['roleId']}))
-            for role in roles:
-                role = RoleResponse(
-                    _id=str(role['_id']),
-                    name=role['name'],
-                    description=role['description'],
-                    organizationId=str(role['organizationId']),
-                    permissions=role['permissions'],
-                    createdAt=role['createdAt'],
-                    updatedAt=role['updatedAt']
-                )
-            return roles
+            documents = db.role_collection.find(
+                {'_id': {'$in': [ObjectId(role_id) for role_id in role_ids]}}, ROLE_RESPONSE_PROJECTION).sort('_id')
+            return self._to_role_responses(documents)
         except Exception as e:
             raise e
 
     def assign_role(self, data: RoleAssignedInDB):
         try:
-            if isinstance(data, RoleAssignedInDB):
-                data = data.model_dump()
-            data['toId'] = ObjectId(data['toId'])
-            data['organizationId'] = ObjectId(data['organizationId'])
-            data['roleId'] = ObjectId(data['roleId'])
-
+            data = self._new_assignment(data)
             db.role_assigned.insert_one(data)
+            self._invalidate_permissions(data['toId'], data['organizationId'])
+            summaries.add_roles([data])
+        except Exception as e:
+            raise e
+
+    def assign_roles(self, items: List[RoleAssignedInDB]) -> List[BatchItemResult]:
+        try:
+            assignments = self._new_assignments(items)
+            failed = {}
+            if assignments:
+                role_organizations = {role['_id']: role['organizationId'] for role in db.role_collection.find(
+                    self._role_organizations_filter(assignments), {'organizationId': 1})}
+                memberships = {(membership['memberId'], membership['organizationId'])
+                               for membership in db.organization_member_collection.find(
+                                   self._memberships_match(assignments), {'memberId': 1, 'organizationId': 1})}
+                failed = self._invalid_assignments(assignments, role_organizations, memberships)
+                valid = self._valid_indexes(assignments, failed)
+                try:
+                    if valid:
+                        db.role_assigned.bulk_write(
+                            [InsertOne(assignments[index]) for index in valid], ordered=False)
+                except BulkWriteError as e:
+                    # Write error indexes refer to the inserted subset
+                    failed.update({valid[index]: error for index, error in self._write_errors(e).items()})
+            summaries.add_roles([assignment for index, assignment in enumerate(assignments) if index not in failed])
+            return self._assign_results(assignments, failed)
+        except Exception as e:
+            raise e
+
+    def revoke_roles(self, items: List[RoleAssignedInDB]) -> List[BatchItemResult]:
+        try:
+            assignments = [self._new_assignment(item) for item in items]
+            found = {}
+            if assignments:
+                for document in db.role_assigned.find(self._assignments_match(assignments)):
+                    found[self._assignment_key(document)] = document['_id']
+                if found:
+                    db.role_assigned.delete_many(
+                        {'_id': {'$in': list(found.values())}})
+            revoked = [assignment for assignment in assignments if self._assignment_key(assignment) in found]
+            summaries.remove_roles(revoked)
+            removals.record_roles(revoked)
+            return self._revoke_results(assignments, found)
         except Exception as e:
             raise e
 
     def revoke_role(self, role_id: PydanticObjectId, to_id: PydanticObjectId):
         try:
-            role_assigned_match = db.role_assigned.find_one(
+            role_assigned_match = db.role_assigned.find_one_and_delete(
                 {'toId': ObjectId(to_id), 'roleId': ObjectId(role_id)})
 
             if role_assigned_match:
-                db.role_assigned.delete_one(
-                    {'toId': ObjectId(to_id), 'roleId': ObjectId(role_id)})
+                self._invalidate_permissions(
+                    to_id, role_assigned_match['organizationId'])
+                summaries.remove_roles([role_assigned_match])
+                removals.record_roles([role_assigned_match])
+        except Exception as e:
+            raise e
+
+    def get_effective_permissions(self, to_id: PydanticObjectId, organization_id: PydanticObjectId) -> EffectivePermissions:
+        try:
+            key = self.permission_key(to_id, organization_id)
+            effective_permissions = permission_cache.get(key)
+            if effective_permissions is None:
+                documents = db.role_assigned.aggregate(
+                    self._effective_permissions_pipeline(to_id, organization_id))
+                effective_permissions = self._to_effective_permissions(
+                    list(documents))
+                permission_cache.set(key, effective_permissions)
+            return effective_permissions
+        except Exception as e:
+            raise e
+
+    def get_effective_permissions_many(self, pairs: List[Tuple[PydanticObjectId, PydanticObjectId]]) -> Dict[Tuple[str, str], EffectivePermissions]:
+        try:
+            # Cached pairs are answered locally, the rest with a single aggregation
+            effective_permissions = {}
+            missing = []
+            for key in dict.fromkeys(self.permission_key(to_id, organization_id) for to_id, organization_id in pairs):
+                cached = permission_cache.get(key)
+                if cached is None:
+                    missing.append(key)
+                else:
+                    effective_permissions[key] = cached
+            if missing:
+                documents = db.role_assigned.aggregate(
+                    self._effective_permissions_many_pipeline(missing))
+                effective_permissions.update(
+                    self._group_effective_permissions(missing, list(documents)))
+            return effective_permissions
         except Exception as e:
             raise e
 
     def has_permission(self, to_id: PydanticObjectId, organization_id: PydanticObjectId, role_id: PydanticObjectId, required_permission: str) -> bool:
         is_match = False
         try:
-            role_assigned_match = db.role_assigned.find_one({'toId': ObjectId(
-                to_id), 'organizationId': ObjectId(organization_id), 'roleId': ObjectId(role_id)})
-
-            if role_assigned_match:
-                role = db.role_collection.find_one({'_id': ObjectId(role_id)})
-                for permission in role['permissions']:
-                    if permission == required_permission:
-                        is_match = True
+            effective_permissions = self.get_effective_permissions(
+                to_id, organization_id)
+            is_match = effective_permissions.allows(
+                required_permission, role_id=role_id)
         except Exception as e:
             raise e
         finally:
             return is_match
 
+    def get_roles_with_permissions(self, organization_id: PydanticObjectId, permissions: List[str]) -> List[RoleResponse]:
+        try:
+            documents = db.role_collection.find(
+                self._roles_with_permissions_filter(organization_id, permissions))
+            return [self._to_role_response(document) for document in documents]
+        except Exception as e:
+            raise e
+
     def get_permissions(self, role_id: PydanticObjectId) -> List[str]:
         permissions = []
         try:
-            role = db.role_collection.find_one({'_id': ObjectId(role_id)})
+            role = resolve_role(db.role_collection.find_one({'_id': ObjectId(role_id)}))
             for permission in role['permissions']:
                 permissions.append(permission)
             return permissions
@@ -147,7 +524,212 @@ class RoleManager:
             role = db.role_collection.find_one(
                 {'_id': ObjectId(role_id), 'organizationId': ObjectId(organization_id)})
             if role:
+                # Assignees are read first so each one is told the role is gone
+                assignments = list(db.role_assigned.find(
+                    {'roleId': ObjectId(role_id)}, {'toId': 1, 'organizationId': 1, 'roleId': 1}))
                 db.role_assigned.delete_many({'roleId': ObjectId(role_id)})
                 db.role_collection.delete_one({'_id': ObjectId(role_id)})
+                self._invalidate_organization_permissions(organization_id)
+                summaries.remove_role(role_id)
+                removals.record_roles(assignments)
+        except Exception as e:
+            raise e
+
+
+class AsyncRoleManager(RoleQueries):
+    async def setup(self, organization_id: PydanticObjectId) -> List[ObjectId]:
+        try:
+            documents = await async_db.role_collection.insert_many(
+                self._default_roles(organization_id))
+            return list(documents.inserted_ids)
+        except Exception as e:
+            raise e
+
+    async def setup_many(self, organization_ids: List[PydanticObjectId]) -> Dict[str, Dict[str, ObjectId]]:
+        try:
+            documents = [role for organization_id in organization_ids
+                         for role in self._default_roles(organization_id)]
+            failed = {}
+            if documents:
+                try:
+                    await async_db.role_collection.insert_many(documents, ordered=False)
+                except BulkWriteError as e:
+                    failed = self._write_errors(e)
+            return self._group_roles_by_organization(organization_ids, documents, failed)
+        except Exception as e:
+            raise e
+
+    async def create(self, data: RoleCreate):
+        try:
+            # Create new role instance in database collection
+            await async_db.role_collection.insert_one(self._new_role(data))
+        except Exception as e:
+            raise e
+
+    async def get_roles(self, to_id: PydanticObjectId, organization_id: Optional[PydanticObjectId] = None) -> List[RoleResponse]:
+        return await get_roles_flights.do((str(to_id), str(organization_id)),
+                                          lambda: self._get_roles(to_id, organization_id))
+
+    async def _get_roles(self, to_id: PydanticObjectId, organization_id: Optional[PydanticObjectId] = None) -> List[RoleResponse]:
+        try:
+            cursor = async_db.role_assigned.aggregate(self._role_pipeline(
+                self._assignment_match([to_id], organization_id)))
+            return self._to_role_responses([document['role'] async for document in cursor])
+        except Exception as e:
+            raise e
+
+    async def get_roles_for_members(self, to_ids: List[PydanticObjectId], organization_id: Optional[PydanticObjectId] = None) -> Dict[str, List[RoleResponse]]:
+        try:
+            cursor = async_db.role_assigned.aggregate(self._role_pipeline(
+                self._assignment_match(to_ids, organization_id)))
+            return self._group_by_member(to_ids, await cursor.to_list(length=None))
+        except Exception as e:
+            raise e
+
+    async def get_roles_by_ids(self, role_ids: List[PydanticObjectId]) -> List[RoleResponse]:
+        try:
+            cursor = async_db.role_collection.find(
+                {'_id': {'$in': [ObjectId(role_id) for role_id in role_ids]}}, ROLE_RESPONSE_PROJECTION).sort('_id')
+            return self._to_role_responses(await cursor.to_list(length=None))
+        except Exception as e:
+            raise e
+
+    async def assign_role(self, data: RoleAssignedInDB):
+        try:
+            data = self._new_assignment(data)
+            await async_db.role_assigned.insert_one(data)
+            self._invalidate_permissions(data['toId'], data['organizationId'])
+            await async_summaries.add_roles([data])
+        except Exception as e:
+            raise e
+
+    async def assign_roles(self, items: List[RoleAssignedInDB]) -> List[BatchItemResult]:
+        try:
+            assignments = self._new_assignments(items)
+            failed = {}
+            if assignments:
+                role_organizations = {role['_id']: role['organizationId'] async for role in async_db.role_collection.find(
+                    self._role_organizations_filter(assignments), {'organizationId': 1})}
+                memberships = {(membership['memberId'], membership['organizationId'])
+                               async for membership in async_db.organization_member_collection.find(
+                                   self._memberships_match(assignments), {'memberId': 1, 'organizationId': 1})}
+                failed = self._invalid_assignments(assignments, role_organizations, memberships)
+                valid = self._valid_indexes(assignments, failed)
+                try:
+                    if valid:
+                        await async_db.role_assigned.bulk_write(
+                            [InsertOne(assignments[index]) for index in valid], ordered=False)
+                except BulkWriteError as e:
+                    # Write error indexes refer to the inserted subset
+                    failed.update({valid[index]: error for index, error in self._write_errors(e).items()})
+            await async_summaries.add_roles([assignment for index, assignment in enumerate(assignments) if index not in failed])
+            return self._assign_results(assignments, failed)
+        except Exception as e:
+            raise e
+
+    async def revoke_roles(self, items: List[RoleAssignedInDB]) -> List[BatchItemResult]:
+        try:
+            assignments = [self._new_assignment(item) for item in items]
+            found = {}
+            if assignments:
+                async for document in async_db.role_assigned.find(self._assignments_match(assignments)):
+                    found[self._assignment_key(document)] = document['_id']
+                if found:
+                    await async_db.role_assigned.delete_many(
+                        {'_id': {'$in': list(found.values())}})
+            revoked = [assignment for assignment in assignments if self._assignment_key(assignment) in found]
+            await async_summaries.remove_roles(revoked)
+            await async_removals.record_roles(revoked)
+            return self._revoke_results(assignments, found)
+        except Exception as e:
+            raise e
+
+    async def revoke_role(self, role_id: PydanticObjectId, to_id: PydanticObjectId):
+        try:
+            role_assigned_match = await async_db.role_assigned.find_one_and_delete(
+                {'toId': ObjectId(to_id), 'roleId': ObjectId(role_id)})
+
+            if role_assigned_match:
+                self._invalidate_permissions(
+                    to_id, role_assigned_match['organizationId'])
+                await async_summaries.remove_roles([role_assigned_match])
+                await async_removals.record_roles([role_assigned_match])
+        except Exception as e:
+            raise e
+
+    async def get_effective_permissions(self, to_id: PydanticObjectId, organization_id: PydanticObjectId) -> EffectivePermissions:
+        try:
+            key = self.permission_key(to_id, organization_id)
+            effective_permissions = permission_cache.get(key)
+            if effective_permissions is None:
+                cursor = async_db.role_assigned.aggregate(
+                    self._effective_permissions_pipeline(to_id, organization_id))
+                effective_permissions = self._to_effective_permissions(
+                    await cursor.to_list(length=None))
+                permission_cache.set(key, effective_permissions)
+            return effective_permissions
+        except Exception as e:
+            raise e
+
+    async def get_effective_permissions_many(self, pairs: List[Tuple[PydanticObjectId, PydanticObjectId]]) -> Dict[Tuple[str, str], EffectivePermissions]:
+        try:
+            # Cached pairs are answered locally, the rest with a single aggregation
+            effective_permissions = {}
+            missing = []
+            for key in dict.fromkeys(self.permission_key(to_id, organization_id) for to_id, organization_id in pairs):
+                cached = permission_cache.get(key)
+                if cached is None:
+                    missing.append(key)
+                else:
+                    effective_permissions[key] = cached
+            if missing:
+                cursor = async_db.role_assigned.aggregate(
+                    self._effective_permissions_many_pipeline(missing))
+                effective_permissions.update(
+                    self._group_effective_permissions(missing, await cursor.to_list(length=None)))
+            return effective_permissions
+        except Exception as e:
+            raise e
+
+    async def has_permission(self, to_id: PydanticObjectId, organization_id: PydanticObjectId, role_id: PydanticObjectId, required_permission: str) -> bool:
+        is_match = False
+        try:
+            effective_permissions = await self.get_effective_permissions(
+                to_id, organization_id)
+            is_match = effective_permissions.allows(
+                required_permission, role_id=role_id)
+        except Exception as e:
+            raise e
+        finally:
+            return is_match
+
+    async def get_roles_with_permissions(self, organization_id: PydanticObjectId, permissions: List[str]) -> List[RoleResponse]:
+        try:
+            cursor = async_db.role_collection.find(
+                self._roles_with_permissions_filter(organization_id, permissions))
+            return [self._to_role_response(document) async for document in cursor]
+        except Exception as e:
+            raise e
+
+    async def get_permissions(self, role_id: PydanticObjectId) -> List[str]:
+        try:
+            role = resolve_role(await async_db.role_collection.find_one({'_id': ObjectId(role_id)}))
+            return list(role['permissions'])
+        except Exception as e:
+            raise e
+
+    async def delete(self, organization_id: PydanticObjectId, role_id: PydanticObjectId):
+        try:
+            role = await async_db.role_collection.find_one(
+                {'_id': ObjectId(role_id), 'organizationId': ObjectId(organization_id)})
+            if role:
+                # Assignees are read first so each one is told the role is gone
+                assignments = await async_db.role_assigned.find(
+                    {'roleId': ObjectId(role_id)}, {'toId': 1, 'organizationId': 1, 'roleId': 1}).to_list(length=None)
+                await async_db.role_assigned.delete_many({'roleId': ObjectId(role_id)})
+                await async_db.role_collection.delete_one({'_id': ObjectId(role_id)})
+                self._invalidate_organization_permissions(organization_id)
+                await async_summaries.remove_role(role_id)
+                await async_removals.record_roles(assignments)
         except Exception as e:
             raise e
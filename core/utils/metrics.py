@@ -0,0 +1,168 @@
+import threading
+from contextvars import ContextVar
+from typing import Dict, List, Sequence, Tuple
+
+from pymongo import monitoring
+
+from core.utils.cache import TTLCache
+
+# Route template of the request being served, read by the Mongo command listener.
+# Motor copies the context into its executor threads, so commands inherit the tag.
+current_route: ContextVar[str] = ContextVar('current_route', default='none')
+
+# Latency buckets in seconds, from sub-millisecond cache hits to multi-second scans
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: count per bucket (made cumulative when rendered), sum and count
+        self._values: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    bucket = _labels(self.labelnames, labels, 'le="%s"' % bound)
+                    lines.append(f'{self.name}_bucket{bucket} {cumulative}')
+                bucket = _labels(self.labelnames, labels, 'le="+Inf"')
+                lines.append(f'{self.name}_bucket{bucket} {count}')
+                lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total}')
+                lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: List = []
+        self.caches: Dict[str, TTLCache] = {}
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def register_cache(self, name: str, cache: TTLCache) -> TTLCache:
+        self.caches[name] = cache
+        return cache
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        # Cache counters are read from the caches themselves at scrape time
+        if self.caches:
+            for name, help_text, attribute in (('cache_hits_total', 'Cache lookups that found a live entry', 'hits'),
+                                               ('cache_misses_total', 'Cache lookups that found no live entry', 'misses')):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                lines += [f'{name}{_labels(("cache",), (cache_name,))} {getattr(cache, attribute)}'
+                          for cache_name, cache in sorted(self.caches.items())]
+            lines += ['# HELP cache_entries Entries currently held by the cache', '# TYPE cache_entries gauge']
+            lines += [f'cache_entries{_labels(("cache",), (cache_name,))} {len(cache)}'
+                      for cache_name, cache in sorted(self.caches.items())]
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route template',
+    ('method', 'route', 'status')))
+command_duration = registry.register(Histogram(
+    'mongodb_command_duration_seconds', 'MongoDB command latency by collection, command and originating route',
+    ('collection', 'command', 'route')))
+command_failures = registry.register(Counter(
+    'mongodb_command_failures_total', 'MongoDB commands that returned an error',
+    ('collection', 'command', 'route')))
+auth_sync_duration = registry.register(Histogram(
+    'auth_sync_push_duration_seconds', 'Authentication service push latency by method and status',
+    ('method', 'status')))
+change_stream_events = registry.register(Counter(
+    'change_stream_events_total', 'Change stream events turned into local cache invalidations',
+    ('collection', 'operation')))
+singleflight_coalesced = registry.register(Counter(
+    'singleflight_coalesced_total', 'Requests answered by joining an identical in-flight fetch',
+    ('operation',)))
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    # Times every command sent by the clients it is registered on, tagged with the current route
+    def __init__(self) -> None:
+        self._started: Dict[Tuple, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, event) -> Tuple:
+        return (event.connection_id, event.request_id)
+
+    def started(self, event) -> None:
+        # getMore names the cursor id, not the collection, in the command's first field
+        target = event.command.get('collection' if event.command_name == 'getMore' else event.command_name)
+        collection = target if isinstance(target, str) else ''
+        with self._lock:
+            self._started[self._key(event)] = (collection, current_route.get())
+
+    def _finish(self, event) -> Tuple[str, str]:
+        with self._lock:
+            return self._started.pop(self._key(event), ('', current_route.get()))
+
+    def succeeded(self, event) -> None:
+        collection, route = self._finish(event)
+        command_duration.observe(event.duration_micros / 1e6, collection, event.command_name, route)
+
+    def failed(self, event) -> None:
+        collection, route = self._finish(event)
+        command_duration.observe(event.duration_micros / 1e6, collection, event.command_name, route)
+        command_failures.inc(collection, event.command_name, route)
+
+
+command_listener = CommandMetricsListener()
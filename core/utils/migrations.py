@@ -0,0 +1,153 @@
+import argparse
+from datetime import datetime
+from typing import Iterator, List, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from core.config.database import OrganizationDatabase
+from core.services.summary import MemberSummaryService
+from core.services.organization import OrganizationQueries
+from core.utils.managers.roles import ROLE_TEMPLATES
+from core.utils.permissions import to_mask
+
+db = OrganizationDatabase()
+
+BATCH_SIZE = 1000
+
+
+def migrate_permission_masks() -> int:
+    # Store permissionMask on role documents created before the bitmask encoding
+    updated = 0
+    operations = []
+    cursor = db.role_collection.find(
+        {'permissionMask': {'$exists': False}, 'permissions': {'$exists': True}}, {'permissions': 1})
+    for role in cursor:
+        operations.append(UpdateOne({'_id': role['_id']}, {
+                          '$set': {'permissionMask': to_mask(role['permissions'])}}))
+        if len(operations) == BATCH_SIZE:
+            updated += db.role_collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += db.role_collection.bulk_write(operations, ordered=False).modified_count
+    return updated
+
+
+def migrate_role_templates() -> int:
+    # Point default roles at their template and drop the fields that match it
+    updated = 0
+    for name, template in ROLE_TEMPLATES.items():
+        result = db.role_collection.update_many(
+            {'name': name, 'template': {'$exists': False},
+             'permissions': {'$size': len(template.permissions), '$all': list(template.permissions)}},
+            {'$set': {'template': name}, '$unset': {'permissions': '', 'permissionMask': ''}})
+        updated += result.modified_count
+        db.role_collection.update_many(
+            {'template': name, 'description': template.description},
+            {'$unset': {'description': ''}})
+    return updated
+
+
+def _convert_timestamps(collection) -> int:
+    # Parse createdAt/updatedAt written as str(datetime.utcnow()) into BSON datetimes
+    updated = 0
+    operations = []
+    cursor = collection.find({'$or': [{'createdAt': {'$type': 'string'}}, {'updatedAt': {'$type': 'string'}}]},
+                             {'createdAt': 1, 'updatedAt': 1})
+    for document in cursor:
+        fields = {field: datetime.fromisoformat(document[field]) for field in ('createdAt', 'updatedAt')
+                  if isinstance(document.get(field), str)}
+        operations.append(UpdateOne({'_id': document['_id']}, {'$set': fields}))
+        if len(operations) == BATCH_SIZE:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    return updated
+
+
+def migrate_native_timestamps() -> int:
+    # Run member-summaries afterwards so embedded organization timestamps are rewritten too
+    updated = sum(_convert_timestamps(collection)
+                  for collection in (db.organization_collection, db.role_collection, db.job_collection))
+    # Memberships and role assignments created before createdAt existed take the creation time
+    # encoded in their ObjectId
+    for collection in (db.organization_member_collection, db.role_assigned):
+        updated += collection.update_many(
+            {'createdAt': {'$exists': False}}, [{'$set': {'createdAt': {'$toDate': '$_id'}}}]).modified_count
+    return updated
+
+
+def backfill_membership_names() -> int:
+    # Copy each organization's name onto its memberships so name search needs no join
+    updated = 0
+    queries = OrganizationQueries()
+    memberships = []
+    cursor = db.organization_member_collection.find(
+        {'nameNormalized': {'$exists': False}}, {'organizationId': 1})
+
+    def apply(memberships) -> int:
+        names = {organization['_id']: organization['name'] for organization in db.organization_collection.find(
+            {'_id': {'$in': list({membership['organizationId'] for membership in memberships})}}, {'name': 1})}
+        operations = [UpdateOne({'_id': membership['_id']}, queries._rename_update(names[membership['organizationId']]))
+                      for membership in memberships if membership['organizationId'] in names]
+        return db.organization_member_collection.bulk_write(operations, ordered=False).modified_count if operations else 0
+
+    for membership in cursor:
+        memberships.append(membership)
+        if len(memberships) == BATCH_SIZE:
+            updated += apply(memberships)
+            memberships = []
+    if memberships:
+        updated += apply(memberships)
+    return updated
+
+
+def _duplicates(collection, fields: Tuple[str, ...]) -> Iterator[List[ObjectId]]:
+    # _ids of the documents sharing one value of fields, oldest first
+    pipeline = [
+        {'$group': {'_id': {field: f'${field}' for field in fields}, 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+    ]
+    for group in collection.aggregate(pipeline, allowDiskUse=True):
+        yield sorted(group['ids'])
+
+
+def dedupe_unique_keys() -> int:
+    # Remove the duplicates that stop the unique indexes in core.config.indexes from building, keeping
+    # the oldest document of each. Run member-summaries afterwards.
+    removed = 0
+    # Duplicate roles have their assignments moved onto the role that is kept
+    for ids in _duplicates(db.role_collection, ('organizationId', 'name')):
+        db.role_assigned.update_many({'roleId': {'$in': ids[1:]}}, {'$set': {'roleId': ids[0]}})
+        removed += db.role_collection.delete_many({'_id': {'$in': ids[1:]}}).deleted_count
+    # Assignments go after roles, since merging roles can leave the same role assigned twice
+    for collection, fields in ((db.organization_member_collection, ('memberId', 'organizationId')),
+                               (db.role_assigned, ('toId', 'organizationId', 'roleId'))):
+        for ids in _duplicates(collection, fields):
+            removed += collection.delete_many({'_id': {'$in': ids[1:]}}).deleted_count
+    return removed
+
+
+def rebuild_member_summaries() -> int:
+    # Regenerate every member summary from organization_member and role_assigned
+    return MemberSummaryService().rebuild()
+
+
+MIGRATIONS = {
+    'permission-masks': migrate_permission_masks,
+    'role-templates': migrate_role_templates,
+    'member-summaries': rebuild_member_summaries,
+    'native-timestamps': migrate_native_timestamps,
+    'membership-names': backfill_membership_names,
+    'unique-keys': dedupe_unique_keys,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run organization_db data migrations')
+    parser.add_argument('migration', choices=sorted(MIGRATIONS))
+    args = parser.parse_args()
+
+    print(f'{args.migration}: {MIGRATIONS[args.migration]()} documents updated')
@@ -1,10 +1,15 @@
+import logging
+from enum import IntFlag
+from typing import Any, Dict, Iterable, List
+
 from pymongo.errors import DuplicateKeyError as MongoDBDuplicateKeyError
 from quest_maker_api_shared_library.custom_types import PydanticObjectId
 from quest_maker_api_shared_library.errors.database import DuplicateKeyError
 
-from core.config.env import Env
+from core.config.env import get_env
 
-env = Env()
+env = get_env()
+logger = logging.getLogger(__name__)
 
 
 class Permissions:
@@ -35,3 +40,67 @@ class Permissions:
             cls.administer,
             cls.access_control
         ])
+
+
+class PermissionFlag(IntFlag):
+    # Bit positions are stored in role documents and must never be reused or reordered.
+    # New permissions take the next unused bit.
+    read_own = 1 << 0
+    write_own = 1 << 1
+    delete_own = 1 << 2
+    read_org = 1 << 3
+    write_org = 1 << 4
+    delete_org = 1 << 5
+    read_all = 1 << 6
+    write_all = 1 << 7
+    delete_all = 1 << 8
+    administer = 1 << 9
+    access_control = 1 << 10
+
+
+# Stable registry mapping each permission string to its bit
+PERMISSION_BITS: Dict[str, PermissionFlag] = {
+    Permissions.read_own: PermissionFlag.read_own,
+    Permissions.write_own: PermissionFlag.write_own,
+    Permissions.delete_own: PermissionFlag.delete_own,
+    Permissions.read_org: PermissionFlag.read_org,
+    Permissions.write_org: PermissionFlag.write_org,
+    Permissions.delete_org: PermissionFlag.delete_org,
+    Permissions.read_all: PermissionFlag.read_all,
+    Permissions.write_all: PermissionFlag.write_all,
+    Permissions.delete_all: PermissionFlag.delete_all,
+    Permissions.administer: PermissionFlag.administer,
+    Permissions.access_control: PermissionFlag.access_control,
+}
+
+
+def unknown_permissions(permissions: Iterable[str]) -> List[str]:
+    return [permission for permission in permissions if permission not in PERMISSION_BITS]
+
+
+def to_mask(permissions: Iterable[str]) -> int:
+    # Unknown values grant nothing; they are logged rather than failing every read of the role
+    mask = 0
+    for permission in permissions:
+        bit = PERMISSION_BITS.get(permission)
+        if bit is None:
+            logger.warning('Ignoring unknown permission %r', permission)
+            continue
+        mask |= bit
+    return mask
+
+
+def from_mask(mask: int) -> List[str]:
+    return [permission for permission, bit in PERMISSION_BITS.items() if mask & bit]
+
+
+# Matches no role: an unknown permission is never granted
+NO_ROLE_QUERY = {'permissionMask': {'$in': []}}
+
+
+def mask_query(permissions: Iterable[str]) -> Dict[str, Any]:
+    # Match role documents granting every one of the given permissions
+    permissions = list(permissions)
+    if unknown_permissions(permissions):
+        return NO_ROLE_QUERY
+    return {'permissionMask': {'$bitsAllSet': to_mask(permissions)}}
@@ -0,0 +1,12 @@
+import re
+import unicodedata
+
+
+def normalize_name(name: str) -> str:
+    # Compatibility-normalized, case-folded and whitespace-collapsed, so 'ＡＣＭＥ  Corp' matches 'acme corp'
+    return ' '.join(unicodedata.normalize('NFKC', name).casefold().split())
+
+
+def prefix_pattern(query: str) -> str:
+    # Anchored, case-sensitive and fully escaped so the index bounds cover just the prefix range
+    return '^' + re.escape(normalize_name(query))
@@ -0,0 +1,20 @@
+from functools import lru_cache
+from typing import Any, Iterable, List, Type
+
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, TypeAdapter
+
+
+@lru_cache(maxsize=None)
+def list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    # Built once per model; validating a whole list is a single pydantic-core call
+    return TypeAdapter(List[model])
+
+
+def validate_list(model: Type[BaseModel], documents: Iterable[Any]) -> List[BaseModel]:
+    return list_adapter(model).validate_python(list(documents))
+
+
+def list_response(model: Type[BaseModel], items: List[BaseModel], **kwargs) -> ORJSONResponse:
+    # Dump already-validated models straight to JSON types, skipping FastAPI's jsonable_encoder pass
+    return ORJSONResponse(content=list_adapter(model).dump_python(items, mode='json', by_alias=True), **kwargs)
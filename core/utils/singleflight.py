@@ -0,0 +1,32 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+from core.utils.metrics import singleflight_coalesced
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one in-flight fetch and its result or exception.
+    # Results are shared objects, so callers must copy before mutating them.
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fetch: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            singleflight_coalesced.inc(self.name)
+        # A caller that goes away must not cancel the fetch the others are waiting on
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception retrieved even when every waiter was cancelled
+            task.exception()
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import socket
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from core.config.database import AsyncOrganizationDatabase
+from core.config.env import get_env
+from core.services.organization import organization_cache
+from core.utils.managers.roles import RoleQueries, permission_cache
+from core.utils.metrics import change_stream_events
+
+env = get_env()
+logger = logging.getLogger(__name__)
+async_db = AsyncOrganizationDatabase()
+
+WATCHED_COLLECTIONS = ('organization', 'organization_member', 'role', 'role_assigned')
+# Deletes carry no fullDocument, so these record pre-images to invalidate only the affected keys
+PRE_IMAGE_COLLECTIONS = ('role', 'role_assigned')
+# Resume token no longer in the oplog, or the stream cannot continue from it
+HISTORY_LOST = {280, 286}
+NAMESPACE_EXISTS = 48
+
+
+class Invalidation(NamedTuple):
+    # One change to a watched collection, reduced to the keys local caches are indexed by
+    collection: str
+    operation: str
+    document_id: Optional[str]
+    organization_id: Optional[str]
+    to_id: Optional[str]
+
+
+Handler = Callable[[Invalidation], None]
+
+
+class ChangeStreamWatcher:
+    # Tails one database-level change stream and hands each change to the caches subscribed to its collection.
+    # While the stream is unavailable (standalone mongod, network failure) caches fall back to their TTL.
+    def __init__(self, name: str, collections=WATCHED_COLLECTIONS, retry_seconds: float = 30.0,
+                 checkpoint_seconds: float = 5.0, pre_image_collections=PRE_IMAGE_COLLECTIONS) -> None:
+        self.name = name
+        self.collections = tuple(collections)
+        self.pre_image_collections = tuple(pre_image_collections)
+        # Set once pre-images are enabled; servers before 6.0 reject the option on the stream
+        self.pre_images = False
+        self.retry_seconds = retry_seconds
+        self.checkpoint_seconds = checkpoint_seconds
+        self.available = False
+        self._handlers: Dict[str, List[Handler]] = defaultdict(list)
+        self._gap_handlers: List[Callable[[], None]] = []
+        self._resume_token: Optional[Dict[str, Any]] = None
+        self._saved_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, collection: str, handler: Handler) -> None:
+        self._handlers[collection].append(handler)
+
+    def on_gap(self, handler: Callable[[], None]) -> None:
+        # Called when changes may have been missed and cached entries can no longer be trusted
+        self._gap_handlers.append(handler)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self.available = False
+        await self._save_token()
+
+    def _pipeline(self) -> List[Dict[str, Any]]:
+        # Only the fields invalidation needs; _id is kept because it is the resume token
+        return [
+            {'$match': {'ns.coll': {'$in': list(self.collections)}}},
+            {'$project': {'operationType': 1, 'ns': 1, 'documentKey': 1,
+                          'fullDocument.organizationId': 1, 'fullDocument.toId': 1,
+                          'fullDocumentBeforeChange.organizationId': 1, 'fullDocumentBeforeChange.toId': 1}},
+        ]
+
+    def _to_invalidation(self, change: Dict[str, Any]) -> Invalidation:
+        # Deletes only carry the keys in their pre-image
+        document = change.get('fullDocument') or change.get('fullDocumentBeforeChange') or {}
+        document_id = change.get('documentKey', {}).get('_id')
+        organization_id = document.get('organizationId')
+        to_id = document.get('toId')
+        return Invalidation(
+            collection=change['ns']['coll'],
+            operation=change['operationType'],
+            document_id=str(document_id) if document_id is not None else None,
+            organization_id=str(organization_id) if organization_id is not None else None,
+            to_id=str(to_id) if to_id is not None else None
+        )
+
+    def _dispatch(self, invalidation: Invalidation) -> None:
+        change_stream_events.inc(invalidation.collection, invalidation.operation)
+        for handler in self._handlers.get(invalidation.collection, ()):
+            try:
+                handler(invalidation)
+            except Exception:
+                logger.exception('Invalidation handler failed for %s', invalidation)
+
+    def _gap(self) -> None:
+        for handler in self._gap_handlers:
+            handler()
+
+    async def _load_token(self) -> None:
+        document = await async_db.change_stream_state_collection.find_one({'_id': self.name})
+        self._resume_token = document.get('resumeToken') if document else None
+
+    async def _enable_pre_images(self) -> bool:
+        try:
+            for collection in self.pre_image_collections:
+                try:
+                    await async_db.db.create_collection(
+                        collection, check_exists=False, changeStreamPreAndPostImages={'enabled': True})
+                except OperationFailure as e:
+                    if e.code != NAMESPACE_EXISTS:
+                        raise
+                    await async_db.db.command('collMod', collection, changeStreamPreAndPostImages={'enabled': True})
+            return True
+        except PyMongoError as e:
+            logger.warning('Change stream pre-images unavailable, deletes flush whole caches: %s', e)
+            return False
+
+    async def _save_token(self) -> None:
+        if self._resume_token is None:
+            return
+        try:
+            await async_db.change_stream_state_collection.update_one(
+                {'_id': self.name}, {'$set': {'resumeToken': self._resume_token}}, upsert=True)
+            self._saved_at = time.monotonic()
+        except PyMongoError as e:
+            logger.warning('Could not persist change stream resume token: %s', e)
+
+    async def _watch(self) -> None:
+        if self._resume_token is None:
+            # Nothing to replay from, so anything cached before now may be stale
+            self._gap()
+        async with async_db.db.watch(self._pipeline(), full_document='updateLookup',
+                                     full_document_before_change='whenAvailable' if self.pre_images else None,
+                                     resume_after=self._resume_token) as stream:
+            self.available = True
+            logger.info('Change stream %s watching %s', self.name, ', '.join(self.collections))
+            async for change in stream:
+                self._dispatch(self._to_invalidation(change))
+                self._resume_token = stream.resume_token
+                if time.monotonic() - self._saved_at >= self.checkpoint_seconds:
+                    await self._save_token()
+
+    async def _run(self) -> None:
+        try:
+            await self._load_token()
+        except PyMongoError as e:
+            logger.warning('Could not load change stream resume token: %s', e)
+        self.pre_images = await self._enable_pre_images()
+        while True:
+            try:
+                await self._watch()
+            except OperationFailure as e:
+                if e.code in HISTORY_LOST:
+                    logger.warning('Change stream %s cannot resume, restarting from now', self.name)
+                    self._resume_token = None
+                    continue
+                logger.warning('Change stream unavailable, caches fall back to TTL expiry: %s', e)
+            except PyMongoError as e:
+                logger.warning('Change stream interrupted, caches fall back to TTL expiry: %s', e)
+            self.available = False
+            await asyncio.sleep(self.retry_seconds)
+
+
+role_queries = RoleQueries()
+
+
+def _invalidate_organization(invalidation: Invalidation) -> None:
+    organization_cache.invalidate(invalidation.document_id)
+
+
+def _invalidate_role(invalidation: Invalidation) -> None:
+    # Without a pre-image a deleted role's organization is unknown, so every cached permission set is dropped
+    if invalidation.organization_id:
+        role_queries._invalidate_organization_permissions(invalidation.organization_id)
+    else:
+        permission_cache.clear()
+
+
+def _invalidate_assignment(invalidation: Invalidation) -> None:
+    # Likewise for a deleted assignment without a pre-image
+    if invalidation.organization_id and invalidation.to_id:
+        role_queries._invalidate_permissions(invalidation.to_id, invalidation.organization_id)
+    else:
+        permission_cache.clear()
+
+
+def _clear_caches() -> None:
+    organization_cache.clear()
+    permission_cache.clear()
+
+
+watcher = ChangeStreamWatcher(name=env.CHANGE_STREAM_NAME or socket.gethostname(),
+                              retry_seconds=env.CHANGE_STREAM_RETRY_SECONDS,
+                              checkpoint_seconds=env.CHANGE_STREAM_CHECKPOINT_SECONDS)
+watcher.subscribe('organization', _invalidate_organization)
+watcher.subscribe('role', _invalidate_role)
+watcher.subscribe('role_assigned', _invalidate_assignment)
+watcher.on_gap(_clear_caches)
+
+
+async def _print_invalidations() -> None:
+    # Tail the stream and print what would be invalidated, e.g. against `mongod --replSet rs0`
+    for collection in WATCHED_COLLECTIONS:
+        watcher.subscribe(collection, print)
+    watcher.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await watcher.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_print_invalidations())
@@ -1,9 +1,47 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
+from core.api.endpoints.health import health
+from core.api.endpoints.metrics import metrics
+from core.api.middleware import TimingMiddleware
 from core.api.endpoints.organization import organization
+from core.config.database import close_clients, get_async_client
+from core.config.env import get_env
+from core.config.indexes import apply_indexes_async
+from core.services.cascade import cascade_jobs
+from core.utils.auth_sync import dispatcher
+from core.utils.watcher import watcher
+
+env = get_env()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open this worker's connection pool after any pre-fork, then ensure indexes exist. Indexes that
+    # cannot be built (e.g. unique ones over duplicate data) are logged and the worker starts without them.
+    get_async_client()
+    await apply_indexes_async()
+    dispatcher.start()
+    # Continue cascade deletes interrupted by a previous shutdown or by a worker that died
+    cascade_jobs.start()
+    if env.CHANGE_STREAM_ENABLED:
+        # Invalidate this worker's caches on writes made by any worker
+        watcher.start()
+    yield
+    await watcher.stop()
+    await cascade_jobs.stop()
+    # Flush pending Authentication service pushes before the worker exits
+    await dispatcher.drain(timeout=env.AUTH_SYNC_DRAIN_TIMEOUT_SECONDS)
+    close_clients()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(TimingMiddleware)
 
 # Register routers
 app.include_router(router=organization, tags=[
                    'Organizations'], prefix='/organizations')
+app.include_router(router=health, tags=['Health'], prefix='/health')
+app.include_router(router=metrics, tags=['Metrics'])
@@ -0,0 +1,11 @@
+import os
+
+# Settings required by core.config.env. Mongo clients are created lazily and the
+# Authentication service is replaced by httpx.MockTransport, so nothing here is contacted.
+for name, value in {'MONGODB_CLUSTER': 'localhost', 'MONGODB_USERNAME': 'test', 'MONGODB_PASSWORD': 'test',
+                    'MONGODB_URI': 'mongodb://127.0.0.1:27017/?serverSelectionTimeoutMS=100',
+                    'MONGODB_DATABASE': 'organization_test', 'ENCRYPTION_SCHEMES': 'bcrypt',
+                    'JWT_SECRET_KEY': 'test-secret', 'JWT_EXPIRATION_TIME_IN_MINUTES': '30',
+                    'JWT_REFRESH_EXPIRATION_TIME_IN_HOURS': '24', 'JWT_ALGORITHM': 'HS256',
+                    'AUTHENTICATION_SERVICE_URL': 'http://auth.test/', 'CHANGE_STREAM_ENABLED': 'false'}.items():
+    os.environ.setdefault(name, value)
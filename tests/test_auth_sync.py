@@ -0,0 +1,255 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Any, Dict, List
+
+import httpx
+from bson import ObjectId
+
+from core.models.organization import OrganizationResponse
+from core.models.roles import RoleResponse
+from core.utils import auth_sync
+from core.utils.auth_sync import AuthSyncDispatcher, PendingChanges
+
+
+class FakeAuthService:
+    # Records every push and answers with the queued status codes, then 200
+    def __init__(self, statuses: List[int] = (), hold: bool = False) -> None:
+        self.statuses = list(statuses)
+        self.requests: List[httpx.Request] = []
+        self.in_flight: Dict[str, int] = {}
+        self.max_in_flight = 0
+        self.release = asyncio.Event()
+        if not hold:
+            self.release.set()
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        user_id = json.loads(request.content)['userId']
+        self.in_flight[user_id] = self.in_flight.get(user_id, 0) + 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight[user_id])
+        try:
+            await self.release.wait()
+        finally:
+            self.in_flight[user_id] -= 1
+        return httpx.Response(self.statuses.pop(0) if self.statuses else 200)
+
+    def bodies(self) -> List[Dict[str, Any]]:
+        return [json.loads(request.content) for request in self.requests]
+
+
+async def _build_snapshot(user_id: str) -> Dict[str, Any]:
+    return {'userId': user_id, 'snapshot': True}
+
+
+async def _build_change_set(user_id: str, changes: PendingChanges) -> Dict[str, Any]:
+    return {'userId': user_id, 'upserted': sorted(changes.upserted_organizations),
+            'removed': sorted(changes.removed_organizations)}
+
+
+def _dispatcher(auth: FakeAuthService, **kwargs) -> AuthSyncDispatcher:
+    client = httpx.AsyncClient(base_url='http://auth.test/', transport=httpx.MockTransport(auth.handler))
+    return AuthSyncDispatcher(base_url='http://auth.test/', build_snapshot=_build_snapshot,
+                              build_change_set=_build_change_set, backoff=0, client=client, **kwargs)
+
+
+def test_merge_keeps_latest_change_per_document():
+    changes = PendingChanges(upserted_organizations=['a', 'b'], added_roles=['r1'])
+    changes.merge(PendingChanges(removed_organizations=['a'], removed_roles=['r1'], added_roles=['r2']))
+    changes.merge(PendingChanges(upserted_organizations=['c']))
+
+    assert changes.upserted_organizations == {'b', 'c'}
+    assert changes.removed_organizations == {'a'}
+    assert changes.added_roles == {'r2'}
+    assert changes.removed_roles == {'r1'}
+    assert not changes.snapshot
+
+
+def test_merge_upgrades_to_snapshot():
+    changes = PendingChanges(upserted_organizations=['a'])
+    changes.merge(PendingChanges(snapshot=True))
+    changes.merge(PendingChanges(removed_organizations=['b']))
+
+    assert changes.snapshot
+
+
+def test_burst_for_one_user_is_coalesced_into_one_push():
+    async def run():
+        auth = FakeAuthService()
+        dispatcher = _dispatcher(auth)
+        dispatcher.start()
+        dispatcher.enqueue('user', 'token', PendingChanges(upserted_organizations=['a']))
+        dispatcher.enqueue('user', 'token', PendingChanges(upserted_organizations=['b']))
+        dispatcher.enqueue('user', 'newer-token', PendingChanges(removed_organizations=['a']))
+        await dispatcher.drain(timeout=5)
+        return auth
+
+    auth = asyncio.run(run())
+    assert [request.method for request in auth.requests] == ['PATCH']
+    assert auth.bodies() == [{'userId': 'user', 'upserted': ['b'], 'removed': ['a']}]
+    assert auth.requests[0].headers['Authorization'] == 'Bearer newer-token'
+
+
+def test_enqueue_without_changes_pushes_a_snapshot():
+    async def run():
+        auth = FakeAuthService()
+        dispatcher = _dispatcher(auth)
+        dispatcher.start()
+        dispatcher.enqueue('user', 'token', PendingChanges(upserted_organizations=['a']))
+        dispatcher.enqueue('user', 'token')
+        await dispatcher.drain(timeout=5)
+        return auth
+
+    auth = asyncio.run(run())
+    assert [request.method for request in auth.requests] == ['PUT']
+    assert auth.bodies() == [{'userId': 'user', 'snapshot': True}]
+
+
+def test_changes_during_a_push_wait_for_it_to_finish():
+    async def run():
+        auth = FakeAuthService(hold=True)
+        dispatcher = _dispatcher(auth, workers=4)
+        dispatcher.start()
+        dispatcher.enqueue('user', 'token', PendingChanges(upserted_organizations=['a']))
+        while not auth.requests:
+            await asyncio.sleep(0)
+        # Arrives while the first push is held open by the fake service
+        dispatcher.enqueue('user', 'token', PendingChanges(upserted_organizations=['b']))
+        for _ in range(20):
+            await asyncio.sleep(0)
+        assert len(auth.requests) == 1
+        auth.release.set()
+        await dispatcher.drain(timeout=5)
+        return auth
+
+    auth = asyncio.run(run())
+    assert auth.max_in_flight == 1
+    assert [body['upserted'] for body in auth.bodies()] == [['a'], ['b']]
+
+
+def test_server_errors_are_retried():
+    async def run():
+        auth = FakeAuthService(statuses=[503, 429])
+        dispatcher = _dispatcher(auth, max_retries=3)
+        dispatcher.start()
+        dispatcher.enqueue('user', 'token')
+        await dispatcher.drain(timeout=5)
+        return auth
+
+    assert len(asyncio.run(run()).requests) == 3
+
+
+def test_client_errors_are_not_retried():
+    async def run():
+        auth = FakeAuthService(statuses=[400])
+        dispatcher = _dispatcher(auth, max_retries=3)
+        dispatcher.start()
+        dispatcher.enqueue('user', 'token')
+        await dispatcher.drain(timeout=5)
+        return auth
+
+    assert len(asyncio.run(run()).requests) == 1
+
+
+def test_retries_stop_after_max_retries():
+    async def run():
+        auth = FakeAuthService(statuses=[500] * 10)
+        dispatcher = _dispatcher(auth, max_retries=2)
+        dispatcher.start()
+        dispatcher.enqueue('user', 'token')
+        await dispatcher.drain(timeout=5)
+        return auth
+
+    assert len(asyncio.run(run()).requests) == 3
+
+
+def test_transport_errors_are_retried():
+    attempts = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        attempts.append(request)
+        if len(attempts) == 1:
+            raise httpx.ConnectError('connection refused', request=request)
+        return httpx.Response(200)
+
+    async def run():
+        client = httpx.AsyncClient(base_url='http://auth.test/', transport=httpx.MockTransport(handler))
+        dispatcher = AuthSyncDispatcher(base_url='http://auth.test/', build_snapshot=_build_snapshot,
+                                        build_change_set=_build_change_set, backoff=0, client=client)
+        dispatcher.start()
+        dispatcher.enqueue('user', 'token')
+        await dispatcher.drain(timeout=5)
+
+    asyncio.run(run())
+    assert len(attempts) == 2
+
+
+def test_drain_flushes_every_queued_user_and_stops_workers():
+    async def run():
+        auth = FakeAuthService()
+        dispatcher = _dispatcher(auth, workers=2)
+        dispatcher.start()
+        for index in range(10):
+            dispatcher.enqueue(f'user-{index}', 'token', PendingChanges(upserted_organizations=[str(index)]))
+        await dispatcher.drain(timeout=5)
+        return auth, dispatcher
+
+    auth, dispatcher = asyncio.run(run())
+    assert sorted(body['userId'] for body in auth.bodies()) == sorted(f'user-{index}' for index in range(10))
+    assert dispatcher._tasks == []
+
+
+def test_failed_build_is_retried_as_a_snapshot():
+    failures = []
+
+    async def flaky_change_set(user_id: str, changes: PendingChanges) -> Dict[str, Any]:
+        # e.g. a transient Mongo error while reading the changed documents
+        failures.append(user_id)
+        raise RuntimeError('read_many failed')
+
+    async def run():
+        auth = FakeAuthService()
+        client = httpx.AsyncClient(base_url='http://auth.test/', transport=httpx.MockTransport(auth.handler))
+        dispatcher = AuthSyncDispatcher(base_url='http://auth.test/', build_snapshot=_build_snapshot,
+                                        build_change_set=flaky_change_set, backoff=0, client=client)
+        dispatcher.start()
+        dispatcher.enqueue('user', 'token', PendingChanges(upserted_organizations=['a']))
+        await dispatcher.drain(timeout=5)
+        return auth
+
+    auth = asyncio.run(run())
+    assert failures == ['user']
+    assert [request.method for request in auth.requests] == ['PUT']
+    assert auth.bodies() == [{'userId': 'user', 'snapshot': True}]
+
+
+def test_change_set_with_timestamps_is_pushed_as_json(monkeypatch):
+    async def next_version(user_id: str) -> int:
+        return 7
+
+    monkeypatch.setattr(auth_sync, 'next_version', next_version)
+    now = datetime(2024, 1, 2, 3, 4, 5)
+    organization = OrganizationResponse(_id=str(ObjectId()), name='Organization', description=None,
+                                        ownerId=str(ObjectId()), createdAt=now, updatedAt=now)
+    role = RoleResponse(_id=str(ObjectId()), name='manager', description=None, organizationId=str(organization.id),
+                        permissions=['read:org'], createdAt=now, updatedAt=now)
+
+    async def run():
+        auth = FakeAuthService()
+        client = httpx.AsyncClient(base_url='http://auth.test/', transport=httpx.MockTransport(auth.handler))
+        # The real builder, fed documents supplied with the change so nothing is read from Mongo
+        dispatcher = AuthSyncDispatcher(base_url='http://auth.test/', build_snapshot=_build_snapshot,
+                                        build_change_set=auth_sync.build_change_set, backoff=0, client=client)
+        dispatcher.start()
+        dispatcher.enqueue('user', 'token', PendingChanges(organizations=[organization], roles=[role]))
+        await dispatcher.drain(timeout=5)
+        return auth
+
+    auth = asyncio.run(run())
+    assert [request.method for request in auth.requests] == ['PATCH']
+    body = auth.bodies()[0]
+    assert body['version'] == 7
+    assert body['upsertedOrganizations'][0]['id'] == str(organization.id)
+    assert body['upsertedOrganizations'][0]['createdAt'] == now.isoformat()
+    assert body['addedRoles'][0]['_id'] == str(role.id)
+    assert body['addedRoles'][0]['updatedAt'] == now.isoformat()
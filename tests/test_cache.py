@@ -0,0 +1,51 @@
+import time
+
+from core.utils.cache import TTLCache
+
+
+def test_get_returns_live_entries_and_counts_hits_and_misses():
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.set('a', 1)
+
+    assert cache.get('a') == 1
+    assert cache.get('b', 'default') == 'default'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_expire_after_their_ttl():
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.set('a', 1, ttl=0.01)
+    cache.set('b', 2)
+    time.sleep(0.02)
+
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    assert len(cache) == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_invalidate_invalidate_where_and_clear():
+    cache = TTLCache(max_size=10, ttl=60)
+    for key in [('user', 'org-1'), ('user', 'org-2'), ('other', 'org-1')]:
+        cache.set(key, True)
+
+    cache.invalidate(('user', 'org-2'))
+    assert cache.get(('user', 'org-2')) is None
+
+    cache.invalidate_where(lambda key: key[1] == 'org-1')
+    assert len(cache) == 0
+
+    cache.set('a', 1)
+    cache.clear()
+    assert cache.get('a') is None
@@ -0,0 +1,26 @@
+from core.utils.etag import etag_matches, make_etag
+
+
+def test_make_etag_is_a_stable_strong_validator():
+    etag = make_etag('organization', '2024-01-01 00:00:00')
+
+    assert etag == make_etag('organization', '2024-01-01 00:00:00')
+    assert etag != make_etag('organization', '2024-01-01 00:00:01')
+    assert etag.startswith('"') and etag.endswith('"')
+
+
+def test_etag_matches_single_list_weak_and_wildcard():
+    etag = make_etag('organization', 1)
+
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", {etag}', etag)
+    assert etag_matches(f'W/{etag}', etag)
+    assert etag_matches('*', etag)
+
+
+def test_etag_does_not_match_missing_or_different_validators():
+    etag = make_etag('organization', 1)
+
+    assert not etag_matches(None, etag)
+    assert not etag_matches('', etag)
+    assert not etag_matches(make_etag('organization', 2), etag)
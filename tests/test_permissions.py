@@ -0,0 +1,43 @@
+from core.utils.permissions import NO_ROLE_QUERY, PERMISSION_BITS, Permissions, from_mask, mask_query, to_mask, unknown_permissions
+
+
+def test_bit_assignments_are_pinned():
+    # Stored in role documents: changing any of these silently changes what existing roles grant
+    assert {permission: int(bit) for permission, bit in PERMISSION_BITS.items()} == {
+        'read:own': 1 << 0,
+        'write:own': 1 << 1,
+        'delete:own': 1 << 2,
+        'read:org': 1 << 3,
+        'write:org': 1 << 4,
+        'delete:org': 1 << 5,
+        'read:all': 1 << 6,
+        'write:all': 1 << 7,
+        'delete:all': 1 << 8,
+        'administer': 1 << 9,
+        'access control': 1 << 10,
+    }
+
+
+def test_every_permission_has_a_bit():
+    assert list(Permissions()) == list(PERMISSION_BITS)
+
+
+def test_mask_round_trip():
+    permissions = [Permissions.read_own, Permissions.delete_org, Permissions.access_control]
+
+    assert to_mask(permissions) == (1 << 0) | (1 << 5) | (1 << 10)
+    assert from_mask(to_mask(permissions)) == permissions
+    assert from_mask(to_mask(Permissions())) == list(Permissions())
+    assert to_mask([]) == 0
+    assert from_mask(0) == []
+
+
+def test_unknown_permissions_grant_nothing():
+    assert unknown_permissions([Permissions.read_own, 'read:everything']) == ['read:everything']
+    assert to_mask([Permissions.read_own, 'read:everything']) == to_mask([Permissions.read_own])
+
+
+def test_mask_query():
+    assert mask_query([Permissions.read_org, Permissions.write_org]) == {
+        'permissionMask': {'$bitsAllSet': (1 << 3) | (1 << 4)}}
+    assert mask_query([Permissions.read_org, 'read:everything']) == NO_ROLE_QUERY
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from core.utils.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_fetch():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {'value': len(calls)}
+
+    async def run():
+        flights = SingleFlight('test')
+        return await asyncio.gather(*(flights.do('key', fetch) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_different_keys_and_later_calls_fetch_again():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return len(calls)
+
+    async def run():
+        flights = SingleFlight('test')
+        first = await asyncio.gather(flights.do('a', fetch), flights.do('b', fetch))
+        second = await flights.do('a', fetch)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert sorted(first) == [1, 2]
+    assert second == 3
+
+
+def test_exceptions_are_shared_by_every_waiter():
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise LookupError('not found')
+
+    async def run():
+        flights = SingleFlight('test')
+        return await asyncio.gather(*(flights.do('key', fetch) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, LookupError) for result in results)
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_fetch():
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return 'done'
+
+    async def run():
+        flights = SingleFlight('test')
+        leaving = asyncio.ensure_future(flights.do('key', fetch))
+        staying = asyncio.ensure_future(flights.do('key', fetch))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+        return await staying
+
+    assert asyncio.run(run()) == 'done'
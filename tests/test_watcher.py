@@ -0,0 +1,56 @@
+from bson import ObjectId
+
+from core.utils.managers.roles import permission_cache
+from core.utils.watcher import ChangeStreamWatcher, _invalidate_assignment, _invalidate_role
+
+
+def _delete(collection: str, before=None):
+    change = {'operationType': 'delete', 'ns': {'coll': collection}, 'documentKey': {'_id': ObjectId()}}
+    if before is not None:
+        change['fullDocumentBeforeChange'] = before
+    return change
+
+
+def test_delete_takes_keys_from_the_pre_image():
+    to_id, organization_id = ObjectId(), ObjectId()
+    invalidation = ChangeStreamWatcher('test')._to_invalidation(
+        _delete('role_assigned', {'toId': to_id, 'organizationId': organization_id}))
+
+    assert invalidation.operation == 'delete'
+    assert invalidation.to_id == str(to_id)
+    assert invalidation.organization_id == str(organization_id)
+
+
+def test_revoke_evicts_only_the_assignee():
+    to_id, other_id, organization_id = str(ObjectId()), str(ObjectId()), str(ObjectId())
+    permission_cache.clear()
+    permission_cache.set((to_id, organization_id), 'revoked')
+    permission_cache.set((other_id, organization_id), 'kept')
+
+    _invalidate_assignment(ChangeStreamWatcher('test')._to_invalidation(
+        _delete('role_assigned', {'toId': ObjectId(to_id), 'organizationId': ObjectId(organization_id)})))
+
+    assert permission_cache.get((to_id, organization_id)) is None
+    assert permission_cache.get((other_id, organization_id)) == 'kept'
+
+
+def test_role_delete_evicts_only_its_organization():
+    organization_id, other_organization_id = str(ObjectId()), str(ObjectId())
+    permission_cache.clear()
+    permission_cache.set(('member', organization_id), 'evicted')
+    permission_cache.set(('member', other_organization_id), 'kept')
+
+    _invalidate_role(ChangeStreamWatcher('test')._to_invalidation(
+        _delete('role', {'organizationId': ObjectId(organization_id)})))
+
+    assert permission_cache.get(('member', organization_id)) is None
+    assert permission_cache.get(('member', other_organization_id)) == 'kept'
+
+
+def test_delete_without_pre_image_flushes_everything():
+    permission_cache.clear()
+    permission_cache.set(('member', 'organization'), 'evicted')
+
+    _invalidate_assignment(ChangeStreamWatcher('test')._to_invalidation(_delete('role_assigned')))
+
+    assert len(permission_cache) == 0